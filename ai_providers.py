@@ -1,96 +1,470 @@
 import os
-import importlib
-from typing import Optional, List, Dict, Tuple
+from typing import Callable, Optional, List, Dict, Tuple
 import io
+import copy
+import json
 import random
+import hashlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
 from PIL import Image, ImageDraw, ImageFont
 
+from clients import gemini_client, openai_client
+
 # Lightweight, optional AI provider helpers.
 # - Gemini (google-genai): set GOOGLE_API_KEY or GEMINI_API_KEY
 # - OpenAI (openai): set OPENAI_API_KEY
 # If the library or key is missing, functions return None gracefully.
 
 
-def _get_gemini_client():
-    """Return a google-genai client if available and keyed, else None.
-    Prefer GEMINI_API_KEY to avoid conflicts with other Google APIs (e.g., Cloud TTS).
-    """
-    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        return None
-    try:
-        genai = importlib.import_module("google.genai")
-        client = genai.Client(api_key=api_key)
-        return client
-    except Exception:
-        return None
+_provider_order_source = lambda: ['gemini', 'openai']
 
 
-def _get_openai_client():
-    """Return an OpenAI client if available and keyed, else None."""
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        return None
+def set_provider_order_source(fn) -> None:
+    """Register a zero-arg callable returning the enabled providers in order
+    (e.g. the in-memory settings snapshot). Called once at app startup."""
+    global _provider_order_source
+    _provider_order_source = fn
+
+
+def provider_order() -> List[str]:
     try:
-        openai = importlib.import_module("openai")
-        return openai
+        order = _provider_order_source()
     except Exception:
-        return None
+        order = None
+    return list(order) if order is not None else ['gemini', 'openai']
 
 
-def summarize_text(text: str, max_tokens: int = 120) -> Optional[str]:
-    """Attempt to summarize text using Gemini first, then OpenAI. Returns None if unavailable."""
-    if not text or not isinstance(text, str):
-        return None
+# ---------------------------------------------------------------------------
+# Memoization of AI results.
+# Key = sha256(function, prompt version, models/provider order, hash of the
+# truncated input, extra args). Lookups go through an in-process LRU and then
+# the `ai_cache` Mongo collection (TTL index on expires_at, LRU eviction by
+# last_used_at). Concurrent misses for the same key are coalesced: one thread
+# calls the provider, the rest wait for its result. Heuristic fallbacks (no
+# provider answered) are cached only briefly so a transient outage does not
+# pin them for the full TTL. After AI_MEMO.call, _fell_back() tells whether the
+# value (computed or cached) came from a heuristic.
+
+GEMINI_MODEL = "gemini-1.5-flash"
+AI_CACHE_TTL_SECONDS = int(os.environ.get('AI_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+AI_CACHE_FALLBACK_TTL_SECONDS = int(os.environ.get('AI_CACHE_FALLBACK_TTL_SECONDS', '300'))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', '20000'))
+AI_CACHE_LRU_SIZE = int(os.environ.get('AI_CACHE_LRU_SIZE', '256'))
+# Waiters give up after this long and call the provider themselves
+AI_SINGLE_FLIGHT_WAIT = float(os.environ.get('AI_SINGLE_FLIGHT_WAIT', '120'))
+
+_call_state = threading.local()
+
+
+def _answered(provider: str, value):
+    """Mark the current call as answered by a provider (not a heuristic) and return `value`."""
+    _call_state.provider = provider
+    return value
+
+
+def _fell_back() -> bool:
+    """True if the last provider or memo call in this thread ended in a heuristic."""
+    return getattr(_call_state, 'provider', None) is None
+
+
+def _model_tag() -> str:
+    return '|'.join([','.join(provider_order()), GEMINI_MODEL, os.environ.get("OPENAI_MODEL", "gpt-4o-mini")])
 
-    # 1) Try Gemini
-    client = _get_gemini_client()
-    if client is not None:
+
+def memo_key(fn: str, version: int, text: str, truncate: int, extra=None, model: Optional[str] = None) -> str:
+    h = hashlib.sha256()
+    text_hash = hashlib.sha256((text or '')[:truncate].encode('utf-8')).hexdigest()
+    for part in (fn, str(version), model if model is not None else _model_tag(), text_hash,
+                 json.dumps(extra, sort_keys=True, default=str)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'ok', 'fallback')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.ok = False
+        self.fallback = False
+
+
+class AIMemo:
+    def __init__(self, collection=None, stats_collection=None, lru_size: int = AI_CACHE_LRU_SIZE,
+                 ttl_seconds: int = AI_CACHE_TTL_SECONDS, fallback_ttl_seconds: int = AI_CACHE_FALLBACK_TTL_SECONDS,
+                 max_entries: int = AI_CACHE_MAX_ENTRIES):
+        self.collection = collection
+        self.stats_collection = stats_collection
+        self.ttl_seconds = ttl_seconds
+        self.fallback_ttl_seconds = fallback_ttl_seconds
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, Tuple[datetime, object, bool]]" = OrderedDict()
+        self._lru_size = lru_size
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._puts = 0
+        self.counts = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'coalesced': 0, 'fallbacks': 0,
+                       'errors': 0, 'evictions': 0}
+
+    def configure(self, collection=None, stats_collection=None):
+        self.collection = collection
+        self.stats_collection = stats_collection
+
+    def _count(self, field: str, n: int = 1):
+        with self._lock:
+            self.counts[field] += n
+        if self.stats_collection is not None and field != 'memory_hits':
+            try:
+                self.stats_collection.update_one({'_id': 'ai_cache'}, {'$inc': {field: n}}, upsert=True)
+            except Exception:
+                pass
+
+    # -- storage --
+    def _remember(self, key: str, expires_at: datetime, value, fallback: bool = False):
+        with self._lock:
+            self._lru[key] = (expires_at, value, fallback)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._lru_size:
+                self._lru.popitem(last=False)
+
+    def _lookup(self, key: str):
+        """(found, value, fallback) from memory, then Mongo."""
+        now = datetime.utcnow()
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None and hit[0] > now:
+                self._lru.move_to_end(key)
+                found = True
+            else:
+                found = False
+        if found:
+            self._count('memory_hits')
+            return True, hit[1], hit[2]
+        if self.collection is None:
+            return False, None, False
         try:
-            # Keep the prompt short; models handle long input, but we may truncate.
-            prompt = (
-                "Resume en 3-4 líneas, claro y conciso, en español, destacando ideas clave y tono accesible.\n\n"
-            )
-            # You can also use a structured config if needed; the simple call works for text-only.
-            resp = client.models.generate_content(
-                model="gemini-1.5-flash",
-                contents=prompt + text[:6000]  # safety limit
+            doc = self.collection.find_one_and_update(
+                {'_id': key, 'expires_at': {'$gt': now}},
+                {'$set': {'last_used_at': now}, '$inc': {'hits': 1}},
+                {'value': 1, 'expires_at': 1, 'fallback': 1},
             )
-            # Extract text safely
-            summary = None
+        except Exception as e:
+            print(f"⚠️  AI cache lookup failed: {e}")
+            self._count('errors')
+            return False, None, False
+        if doc is None:
+            return False, None, False
+        fallback = bool(doc.get('fallback'))
+        self._remember(key, doc['expires_at'], doc.get('value'), fallback)
+        self._count('store_hits')
+        return True, doc.get('value'), fallback
+
+    def _store(self, key: str, fn: str, value, fallback: bool):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.fallback_ttl_seconds if fallback else self.ttl_seconds)
+        self._remember(key, expires_at, value, fallback)
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one({'_id': key}, {
+                '$set': {'fn': fn, 'value': value, 'fallback': fallback, 'expires_at': expires_at,
+                         'last_used_at': now},
+                '$setOnInsert': {'created_at': now, 'hits': 0},
+            }, upsert=True)
+        except Exception as e:
+            print(f"⚠️  AI cache store failed: {e}")
+            self._count('errors')
+            return
+        with self._lock:
+            self._puts += 1
+            check = self._puts % 50 == 1
+        if check:
+            self.evict_if_needed()
+
+    def evict_if_needed(self):
+        """Delete least-recently-used entries above `max_entries` (expired ones go via the TTL index)."""
+        if self.collection is None or self.max_entries <= 0:
+            return
+        try:
+            excess = self.collection.estimated_document_count() - self.max_entries
+            if excess <= 0:
+                return
+            old = [d['_id'] for d in self.collection.find({}, {'_id': 1}).sort('last_used_at', 1).limit(excess)]
+            if old:
+                self.collection.delete_many({'_id': {'$in': old}})
+                self._count('evictions', len(old))
+        except Exception as e:
+            print(f"⚠️  AI cache eviction failed: {e}")
+
+    # -- call path --
+    def call(self, key: str, fn: str, compute: Callable[[], object]):
+        found, value, fallback = self._lookup(key)
+        if found:
+            _call_state.provider = None if fallback else 'cache'
+            return copy.deepcopy(value)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count('coalesced')
+            if flight.done.wait(AI_SINGLE_FLIGHT_WAIT) and flight.ok:
+                _call_state.provider = None if flight.fallback else 'cache'
+                return copy.deepcopy(flight.value)
+            return compute()
+        self._count('misses')
+        try:
+            _call_state.provider = None
+            value = compute()
+            fallback = _fell_back()
+            if value is not None:
+                if fallback:
+                    self._count('fallbacks')
+                self._store(key, fn, value, fallback)
+            flight.value, flight.ok, flight.fallback = value, True, fallback
+            return copy.deepcopy(value)
+        finally:
+            flight.done.set()
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            process = dict(self.counts, in_flight=len(self._flights), memory_entries=len(self._lru))
+        hits = process['memory_hits'] + process['store_hits']
+        total = hits + process['misses']
+        process['hit_ratio'] = round(hits / total, 3) if total else None
+        out = {'process': process, 'ttl_seconds': self.ttl_seconds, 'max_entries': self.max_entries}
+        if self.collection is not None:
             try:
-                summary = resp.candidates[0].content.parts[0].text
+                out['entries'] = self.collection.estimated_document_count()
             except Exception:
-                summary = getattr(resp, "text", None)
-            if summary:
-                return summary.strip()
-        except Exception:
-            pass
+                pass
+        if self.stats_collection is not None:
+            try:
+                doc = self.stats_collection.find_one({'_id': 'ai_cache'}) or {}
+                out['global'] = {k: doc.get(k, 0) for k in ('store_hits', 'misses', 'coalesced', 'fallbacks', 'evictions')}
+            except Exception:
+                pass
+        return out
 
-    # 2) Try OpenAI as fallback
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            # Use Responses API if available, else chat.completions as fallback
-            # Prefer a small fast model name; user can configure via env later if desired
-            if hasattr(openai, "chat"):
-                r = openai.chat.completions.create(
+
+AI_MEMO = AIMemo()
+
+
+def set_memo_store(collection, stats_collection=None) -> None:
+    """Register the Mongo collection backing the AI cache. Called once at app startup."""
+    AI_MEMO.configure(collection, stats_collection)
+
+
+def memo_stats() -> dict:
+    return AI_MEMO.stats()
+
+
+def memoized(version: int, truncate: int = 8000, extra: Optional[Callable[..., object]] = None):
+    """Cache a text -> result AI helper. Bump `version` whenever its prompt or
+    output format changes. `extra(*args, **kwargs)` returns the non-text
+    arguments that must be part of the key."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(text, *args, **kwargs):
+            if not text:
+                return func(text, *args, **kwargs)
+            key = memo_key(func.__name__, version, text, truncate, extra(*args, **kwargs) if extra else None)
+            return AI_MEMO.call(key, func.__name__, lambda: func(text, *args, **kwargs))
+        return wrapper
+    return decorate
+
+
+# ---------------------------------------------------------------------------
+# Hedged provider calls.
+# Every helper runs under a per-function deadline. The preferred provider is
+# called first; if it has not produced a valid parse after the hedge delay (or
+# fails earlier) the next provider is started as well, and the first valid
+# result wins. Calls that have not started are cancelled and the ones in flight
+# are abandoned (OpenAI gets the remaining deadline as its request timeout;
+# Gemini is bounded by the client timeout in clients.py). When the deadline
+# expires without a valid answer the local heuristic is used.
+
+AI_HEDGE_DELAY_SECONDS = float(os.environ.get('AI_HEDGE_DELAY_SECONDS', '2.0'))
+AI_MAX_WORKERS = int(os.environ.get('AI_MAX_WORKERS', '16'))
+# Seconds until the heuristic answers; override with AI_DEADLINE_<FUNCTION>=s
+AI_DEADLINES = {
+    'summarize_text': 15.0,
+    'analyze_content': 25.0,
+    'expand_query': 3.0,
+    'translate_text': 30.0,
+    'detect_language': 4.0,
+    'generate_quiz': 20.0,
+    'generate_notes': 20.0,
+    'analyze_accessibility': 25.0,
+    'support_answer': 12.0,
+    'summarize_reduce': 20.0,
+    'enrich_book': 45.0,
+    'moderate_text': 15.0,
+}
+_DEFAULT_DEADLINE = 20.0
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_hedge_lock = threading.Lock()
+_hedge_counts: Dict[str, int] = {'calls': 0, 'hedged': 0, 'deadline_fallbacks': 0, 'heuristic_fallbacks': 0,
+                                 'wins_gemini': 0, 'wins_openai': 0, 'errors_gemini': 0, 'errors_openai': 0}
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=AI_MAX_WORKERS, thread_name_prefix='ai-provider')
+    return _executor
+
+
+def _bump(field: str):
+    with _hedge_lock:
+        _hedge_counts[field] = _hedge_counts.get(field, 0) + 1
+
+
+def deadline_for(name: str) -> float:
+    try:
+        return float(os.environ.get(f'AI_DEADLINE_{name.upper()}', AI_DEADLINES.get(name, _DEFAULT_DEADLINE)))
+    except ValueError:
+        return AI_DEADLINES.get(name, _DEFAULT_DEADLINE)
+
+
+def provider_stats() -> dict:
+    with _hedge_lock:
+        out = dict(_hedge_counts)
+    out['hedge_delay_seconds'] = AI_HEDGE_DELAY_SECONDS
+    out['deadlines'] = {name: deadline_for(name) for name in AI_DEADLINES}
+    return out
+
+
+def _clients_in_order() -> List[Tuple[str, object]]:
+    """Available (provider, client) pairs in the configured order."""
+    out = []
+    for name in provider_order():
+        if name == 'gemini':
+            client = gemini_client(os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY"))
+        elif name == 'openai':
+            client = openai_client(os.environ.get("OPENAI_API_KEY"))
+        else:
+            client = None
+        if client is not None:
+            out.append((name, client))
+    return out
+
+
+def _gemini_text(resp) -> Optional[str]:
+    try:
+        return resp.candidates[0].content.parts[0].text
+    except Exception:
+        return getattr(resp, "text", None)
+
+
+def _parse_json(raw: Optional[str], kind: type):
+    """json.loads tolerant of ```json fences; None unless the result is a `kind`."""
+    if not raw:
+        return None
+    s = raw.strip()
+    if s.startswith('```'):
+        s = s.split('\n', 1)[1] if '\n' in s else ''
+        s = s.rsplit('```', 1)[0]
+    try:
+        data = json.loads(s)
+    except ValueError:
+        return None
+    return data if isinstance(data, kind) else None
+
+
+def _stripped(raw: Optional[str]) -> Optional[str]:
+    return raw.strip() if raw and raw.strip() else None
+
+
+def _ask(gemini_prompt: Optional[str] = None, openai_messages: Optional[List[Dict]] = None,
+         parse: Callable[[Optional[str]], object] = _stripped, **openai_options) -> List[Tuple[str, Callable]]:
+    """Attempts for _hedged(): one per available provider that has a prompt.
+    Each attempt takes the remaining seconds and returns the parsed value (None = invalid)."""
+    attempts = []
+    for name, client in _clients_in_order():
+        if name == 'gemini' and gemini_prompt is not None:
+            def call(remaining, client=client):
+                return parse(_gemini_text(client.models.generate_content(model=GEMINI_MODEL, contents=gemini_prompt)))
+        elif name == 'openai' and openai_messages is not None:
+            def call(remaining, client=client):
+                with_options = getattr(client, 'with_options', None)
+                bounded = with_options(timeout=max(1.0, remaining)) if callable(with_options) else client
+                r = bounded.chat.completions.create(
                     model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Eres un asistente que resume textos en español de forma breve (3-4 líneas) y clara."
-                        },
-                        {"role": "user", "content": text[:6000]},
-                    ],
-                    max_tokens=max_tokens,
-                    temperature=0.4,
+                    messages=openai_messages,
+                    **openai_options,
                 )
-                return (r.choices[0].message.content or "").strip()
-        except Exception:
-            pass
+                return parse(r.choices[0].message.content)
+        else:
+            continue
+        attempts.append((name, call))
+    return attempts
+
+
+def _hedged(name: str, attempts: List[Tuple[str, Callable]], fallback: Optional[Callable[[], object]] = None):
+    """Race `attempts` (in preference order) under the deadline of `name`."""
+    _bump('calls')
+    start = time.monotonic()
+    deadline = start + deadline_for(name)
+    hedge_delay = min(AI_HEDGE_DELAY_SECONDS, deadline_for(name) / 2)
+    queue = list(attempts)
+    pending: Dict = {}
+    next_hedge = start
+
+    def launch():
+        nonlocal next_hedge
+        provider, call = queue.pop(0)
+        remaining = deadline - time.monotonic()
+        pending[_pool().submit(call, remaining)] = provider
+        next_hedge = time.monotonic() + hedge_delay
+        if len(pending) > 1:
+            _bump('hedged')
 
-    # 3) Fallback: simple heuristic summary (no external AI required)
+    try:
+        while queue or pending:
+            now = time.monotonic()
+            if now >= deadline:
+                _bump('deadline_fallbacks')
+                break
+            if queue and (not pending or now >= next_hedge):
+                launch()
+                continue
+            until = deadline if not queue else min(deadline, next_hedge)
+            done, _ = wait(list(pending), timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception:
+                    value = None
+                if value is None:
+                    _bump(f'errors_{provider}')
+                    continue
+                _bump(f'wins_{provider}')
+                return _answered(provider, value)
+    finally:
+        for future in pending:
+            future.cancel()
+    if attempts:
+        _bump('heuristic_fallbacks')
+    return fallback() if fallback is not None else None
+
+
+def _heuristic_summary(text: str) -> Optional[str]:
     try:
         import re
         # Normalize whitespace
@@ -124,67 +498,220 @@ def summarize_text(text: str, max_tokens: int = 120) -> Optional[str]:
             return None
 
 
-def analyze_content(text: str) -> Optional[dict]:
-    """
-    Analiza contenido y devuelve un dict con campos:
-    - summary (string)
-    - topics (list[str])
-    - tone (string)
-    - complexity (string)
-    - warnings (list[str])
-    - faqs (list[str])
-    Usa Gemini u OpenAI si hay claves; si no, heurística básica.
-    """
+def summarize_text(text: str, max_tokens: int = 120) -> Optional[str]:
+    """Summarize text with the configured providers (hedged); heuristic summary if none answers in time.
+    Only the first 6000 characters are read: use summarize_long_text for whole books."""
     if not text or not isinstance(text, str):
         return None
+    attempts = _ask(
+        # Keep the prompt short; models handle long input, but we may truncate.
+        gemini_prompt=(
+            "Resume en 3-4 líneas, claro y conciso, en español, destacando ideas clave y tono accesible.\n\n"
+            + text[:6000]  # safety limit
+        ),
+        openai_messages=[
+            {
+                "role": "system",
+                "content": "Eres un asistente que resume textos en español de forma breve (3-4 líneas) y clara."
+            },
+            {"role": "user", "content": text[:6000]},
+        ],
+        max_tokens=max_tokens,
+        temperature=0.4,
+    )
+    return _hedged('summarize_text', attempts, lambda: _heuristic_summary(text))
 
-    # Intentar con Gemini
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                "Eres un analista. Devuelve JSON con: summary (3-4 líneas), topics (5 palabras clave), "
-                "tone (amigable/neutral/técnico/literario), complexity (baja/media/alta), warnings (si hay temas sensibles), "
-                "faqs (3-5 preguntas frecuentes). Responde SOLO JSON válido.\n\nTexto:\n"
-            )
-            resp = client.models.generate_content(
-                model="gemini-1.5-flash",
-                contents=prompt + text[:8000]
-            )
-            # Intentar parsear JSON desde el texto de salida
-            parsed = None
-            try:
-                raw = resp.candidates[0].content.parts[0].text
-            except Exception:
-                raw = getattr(resp, "text", "")
-            import json
-            parsed = json.loads(raw)
-            return parsed
-        except Exception:
-            pass
 
-    # Intentar con OpenAI
-    openai = _get_openai_client()
-    if openai is not None:
+# ---------------------------------------------------------------------------
+# Hierarchical (map-reduce) summaries of full-length books.
+# The whole text is split into chunks of about SUMMARY_CHUNK_TOKENS, breaking
+# at paragraph and sentence boundaries. Every chunk is summarized (map), then
+# groups of up to SUMMARY_FANOUT partial summaries are merged level by level
+# until one remains (reduce). Nodes within a level run concurrently, limited
+# to SUMMARY_CONCURRENCY, so wall-clock time follows the depth of the tree.
+# Each node goes through AI_MEMO: a leaf is keyed by its chunk hash and an
+# inner node by the keys and summary hashes of its children, so an edited book
+# recomputes only the branches above the chunks that changed, and a node built
+# on a heuristic child is recomputed once that child gets a real summary.
+# Such a node is itself cached as a fallback (short TTL).
+
+SUMMARY_VERSION = 1
+SUMMARY_CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', '1500'))
+SUMMARY_FANOUT = int(os.environ.get('SUMMARY_FANOUT', '8'))
+SUMMARY_CONCURRENCY = int(os.environ.get('SUMMARY_CONCURRENCY', '8'))
+_CHARS_PER_TOKEN = 4  # rough estimate for Spanish/English prose
+
+_summary_pool_lock = threading.Lock()
+_summary_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _summary_executor() -> ThreadPoolExecutor:
+    # Separate from _pool(): these threads wait on provider calls running there
+    global _summary_pool
+    if _summary_pool is None:
+        with _summary_pool_lock:
+            if _summary_pool is None:
+                _summary_pool = ThreadPoolExecutor(max_workers=max(1, SUMMARY_CONCURRENCY),
+                                                   thread_name_prefix='ai-summary')
+    return _summary_pool
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or '') // _CHARS_PER_TOKEN + 1
+
+
+def split_for_summary(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+    """Consecutive chunks of at most `max_tokens`, cut at paragraph, then sentence, then word boundaries."""
+    import re
+    budget = max(200, max_tokens * _CHARS_PER_TOKEN)
+    pieces: List[str] = []
+    for para in re.split(r"\n\s*\n", text or ''):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= budget:
+            pieces.append(para)
+            continue
+        for sent in re.split(r"(?<=[.!?…])\s+", para):
+            while len(sent) > budget:
+                cut = sent.rfind(' ', 0, budget)
+                cut = cut if cut > budget // 2 else budget
+                pieces.append(sent[:cut])
+                sent = sent[cut:].lstrip()
+            if sent:
+                pieces.append(sent)
+    chunks: List[str] = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > budget:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _summarize_leaf(chunk: str) -> Optional[str]:
+    attempts = _ask(
+        gemini_prompt=(
+            "Resume en 3-4 líneas, claro y conciso, en español, destacando ideas clave y tono accesible.\n\n"
+            + chunk
+        ),
+        openai_messages=[
+            {"role": "system",
+             "content": "Eres un asistente que resume textos en español de forma breve (3-4 líneas) y clara."},
+            {"role": "user", "content": chunk},
+        ],
+        max_tokens=160,
+        temperature=0.4,
+    )
+    return _hedged('summarize_text', attempts, lambda: _heuristic_summary(chunk))
+
+
+def _summarize_merge(partials: List[str], final: bool) -> Optional[str]:
+    joined = "\n\n".join(f"[{i}] {p}" for i, p in enumerate(partials, start=1))
+    lines = "3-4 líneas" if final else "6-8 líneas"
+    instruction = (
+        f"Estos son resúmenes parciales consecutivos de un mismo libro, en orden. "
+        f"Combínalos en un único resumen de {lines}, en español, claro y fiel al conjunto "
+        f"(no solo al principio), sin repetir ideas ni mencionar los números de las partes."
+    )
+    attempts = _ask(
+        gemini_prompt=instruction + "\n\n" + joined,
+        openai_messages=[{"role": "system", "content": instruction},
+                         {"role": "user", "content": joined}],
+        max_tokens=160 if final else 320,
+        temperature=0.3,
+    )
+    return _hedged('summarize_reduce', attempts, lambda: _heuristic_summary(' '.join(partials)))
+
+
+def _node_key(kind: str, payload: str, final: bool = False) -> str:
+    return memo_key('summarize_node', SUMMARY_VERSION, payload, len(payload), extra=[kind, final])
+
+
+# A tree node: (memo key, summary, fallback)
+_Node = Tuple[str, str, bool]
+
+
+def _leaf_task(chunk: str) -> _Node:
+    key = _node_key('leaf', chunk)
+    summary = AI_MEMO.call(key, 'summarize_node', lambda: _summarize_leaf(chunk))
+    return key, summary, _fell_back()
+
+
+def _merge_task(children: List[_Node], final: bool) -> _Node:
+    payload = '|'.join(f"{k}:{hashlib.sha256(s.encode('utf-8')).hexdigest()}" for k, s, _ in children)
+    key = _node_key('merge', payload, final)
+    partial = any(fallback for _, _, fallback in children)
+
+    def compute():
+        summary = _summarize_merge([s for _, s, _ in children], final)
+        if partial:
+            _call_state.provider = None  # built on a heuristic child: short TTL
+        return summary
+    summary = AI_MEMO.call(key, 'summarize_node', compute)
+    return key, summary, _fell_back()
+
+
+class SummaryAborted(Exception):
+    """The `progress` callback of summarize_long_text asked to stop (e.g. the job lease was lost)."""
+
+
+def _run_level(tasks: List[Tuple[Callable, tuple]],
+               progress: Optional[Callable[[], bool]] = None) -> List[_Node]:
+    """Run one tree level concurrently (bounded by the summary pool), keeping order.
+    `progress()` runs after every SUMMARY_CONCURRENCY finished nodes and at the
+    end of the level; if it returns False the pending nodes are cancelled."""
+    if len(tasks) == 1:
+        fn, args = tasks[0]
+        level = [fn(*args)]
+    else:
+        futures = [_summary_executor().submit(fn, *args) for fn, args in tasks]
         try:
-            import json as _json
-            sysmsg = (
-                "Devuelve SOLO JSON con: summary, topics (array), tone, complexity, warnings (array), faqs (array)."
-            )
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": sysmsg},
-                    {"role": "user", "content": text[:8000]},
-                ],
-                temperature=0.3,
-            )
-            content = r.choices[0].message.content or "{}"
-            return _json.loads(content)
-        except Exception:
-            pass
+            for done, _ in enumerate(as_completed(futures), start=1):
+                if progress is not None and done % SUMMARY_CONCURRENCY == 0 and done < len(futures) \
+                        and not progress():
+                    raise SummaryAborted(f"stopped after {done}/{len(futures)} nodes")
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        level = [f.result() for f in futures]
+    if progress is not None and not progress():
+        raise SummaryAborted("stopped at the end of a level")
+    return level
 
-    # Heurística básica si no hay IA
+
+def summarize_long_text(text: str, chunk_tokens: int = SUMMARY_CHUNK_TOKENS,
+                        fanout: int = SUMMARY_FANOUT,
+                        progress: Optional[Callable[[], bool]] = None) -> Tuple[Optional[str], bool]:
+    """Summarize a whole book with a map-reduce tree. Text that fits one chunk
+    gets a single call (same prompt as summarize_text).
+    Returns (summary, fallback): `fallback` is True when any node of the tree
+    came from the local heuristic instead of a provider.
+    `progress()` is called regularly while the tree runs (to renew a job lease);
+    returning False raises SummaryAborted. Finished nodes stay memoized."""
+    if not text or not isinstance(text, str):
+        return None, False
+    chunks = split_for_summary(text, chunk_tokens)
+    if not chunks:
+        return None, False
+    fanout = max(2, fanout)
+    level = _run_level([(_leaf_task, (chunk,)) for chunk in chunks], progress)
+    level = [node for node in level if node[1]]
+    while len(level) > 1:
+        groups = [level[i:i + fanout] for i in range(0, len(level), fanout)]
+        final = len(groups) == 1
+        merged = _run_level([(_merge_task, (group, final)) for group in groups if len(group) > 1], progress)
+        # A trailing group of one moves up a level unchanged
+        level = [node for node in merged if node[1]] + (groups[-1] if len(groups[-1]) == 1 else [])
+    return (level[0][1], level[0][2]) if level else (None, False)
+
+
+def _heuristic_analysis(text: str) -> dict:
     lowered = text.lower()
     keywords = []
     for kw in ["historia", "ciencia", "tecnología", "arte", "biología", "novela", "cuento", "noticia", "aprendizaje"]:
@@ -212,101 +739,77 @@ def analyze_content(text: str) -> Optional[dict]:
     }
 
 
+def analyze_content(text: str) -> Optional[dict]:
+    """
+    Analiza contenido y devuelve un dict con campos:
+    - summary (string)
+    - topics (list[str])
+    - tone (string)
+    - complexity (string)
+    - warnings (list[str])
+    - faqs (list[str])
+    Usa Gemini u OpenAI si hay claves; si no, heurística básica.
+    """
+    if not text or not isinstance(text, str):
+        return None
+    attempts = _ask(
+        gemini_prompt=(
+            "Eres un analista. Devuelve JSON con: summary (3-4 líneas), topics (5 palabras clave), "
+            "tone (amigable/neutral/técnico/literario), complexity (baja/media/alta), warnings (si hay temas sensibles), "
+            "faqs (3-5 preguntas frecuentes). Responde SOLO JSON válido.\n\nTexto:\n" + text[:8000]
+        ),
+        openai_messages=[
+            {"role": "system", "content": (
+                "Devuelve SOLO JSON con: summary, topics (array), tone, complexity, warnings (array), faqs (array)."
+            )},
+            {"role": "user", "content": text[:8000]},
+        ],
+        parse=lambda raw: _parse_json(raw, dict),
+        temperature=0.3,
+    )
+    # Heurística básica si no hay IA
+    return _hedged('analyze_content', attempts, lambda: _heuristic_analysis(text))
+
+
 def expand_query(query: str) -> List[str]:
     """Expand a user query into related keywords using Gemini/OpenAI if available; else tokenized words."""
     if not query:
         return []
-    # Try Gemini
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                "Devuelve una lista separada por comas de 8-12 palabras/phrases relacionadas semánticamente con: "
-                f"'{query}'. SOLO la lista, sin explicaciones."
-            )
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            txt = None
-            try:
-                txt = resp.candidates[0].content.parts[0].text
-            except Exception:
-                txt = getattr(resp, "text", "")
-            if txt:
-                items = [w.strip() for w in txt.split(',') if w.strip()]
-                base = [t.strip() for t in query.lower().split() if t.strip()]
-                return list(dict.fromkeys(base + items))
-        except Exception:
-            pass
-    # Try OpenAI
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[{"role":"system","content":"Devuelve solo una lista separada por comas de keywords relacionadas."},
+    base = [t.strip() for t in query.lower().split() if t.strip()]
+
+    def parse(txt):
+        items = [w.strip() for w in (txt or '').split(',') if w.strip()]
+        return list(dict.fromkeys(base + items)) if items else None
+
+    attempts = _ask(
+        gemini_prompt=(
+            "Devuelve una lista separada por comas de 8-12 palabras/phrases relacionadas semánticamente con: "
+            f"'{query}'. SOLO la lista, sin explicaciones."
+        ),
+        openai_messages=[{"role":"system","content":"Devuelve solo una lista separada por comas de keywords relacionadas."},
                          {"role":"user","content":query}],
-                temperature=0.3,
-            )
-            txt = r.choices[0].message.content or ''
-            items = [w.strip() for w in txt.split(',') if w.strip()]
-            base = [t.strip() for t in query.lower().split() if t.strip()]
-            return list(dict.fromkeys(base + items))
-        except Exception:
-            pass
+        parse=parse,
+        temperature=0.3,
+    )
     # Fallback: tokens del query
-    return [t.strip() for t in query.lower().split() if t.strip()]
+    return _hedged('expand_query', attempts, lambda: base)
 
 
+@memoized(version=1, extra=lambda target_lang='en': target_lang)
 def translate_text(text: str, target_lang: str = 'en') -> Optional[str]:
     """Translate text via Gemini/OpenAI; returns None if unavailable."""
     if not text:
         return None
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = f"Traduce al {target_lang} conservando el sentido y tono:\n\n{text[:8000]}"
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            try:
-                out = resp.candidates[0].content.parts[0].text
-            except Exception:
-                out = getattr(resp, "text", None)
-            return out.strip() if out else None
-        except Exception:
-            pass
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[{"role":"system","content":f"Traduce al {target_lang}."},
+    attempts = _ask(
+        gemini_prompt=f"Traduce al {target_lang} conservando el sentido y tono:\n\n{text[:8000]}",
+        openai_messages=[{"role":"system","content":f"Traduce al {target_lang}."},
                          {"role":"user","content":text[:8000]}],
-                temperature=0.3,
-            )
-            return (r.choices[0].message.content or '').strip()
-        except Exception:
-            pass
-    return None
+        temperature=0.3,
+    )
+    return _hedged('translate_text', attempts)
 
 
-def detect_language(text: str) -> str:
-    """Very naive language detection; prefer AI if available."""
-    if not text:
-        return 'und'
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            resp = client.models.generate_content(
-                model="gemini-1.5-flash",
-                contents=f"Detecta el idioma (código ISO como es,en,pt,fr,de) y responde SOLO el código:\n\n{text[:2000]}"
-            )
-            code = None
-            try:
-                code = resp.candidates[0].content.parts[0].text
-            except Exception:
-                code = getattr(resp, "text", "und")
-            return code.strip().lower()[:5]
-        except Exception:
-            pass
-    # naive
+def _naive_language(text: str) -> str:
     s = text.lower()
     if any(w in s for w in [' el ', ' la ', ' de ', ' que ']):
         return 'es'
@@ -315,107 +818,46 @@ def detect_language(text: str) -> str:
     return 'und'
 
 
+@memoized(version=1, truncate=2000)
+def detect_language(text: str) -> str:
+    """Very naive language detection; prefer AI if available."""
+    if not text:
+        return 'und'
+    attempts = _ask(
+        gemini_prompt=f"Detecta el idioma (código ISO como es,en,pt,fr,de) y responde SOLO el código:\n\n{text[:2000]}",
+        parse=lambda code: code.strip().lower()[:5] if code and code.strip() else None,
+    )
+    return _hedged('detect_language', attempts, lambda: _naive_language(text))
+
+
+@memoized(version=1, extra=lambda n=5: n)
 def generate_quiz(text: str, n: int = 5) -> Optional[List[Dict[str, str]]]:
     """Generate simple Q&A pairs from text via Gemini/OpenAI; returns list of {q,a}."""
     if not text:
         return None
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                f"Genera {n} preguntas y respuestas cortas en español sobre el texto. Formato JSON array de objetos con 'q' y 'a'.\n\n{text[:8000]}"
-            )
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            raw = None
-            try:
-                raw = resp.candidates[0].content.parts[0].text
-            except Exception:
-                raw = getattr(resp, "text", "[]")
-            import json
-            return json.loads(raw)
-        except Exception:
-            pass
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            import json as _json
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[{"role":"system","content":"Devuelve SOLO JSON array con objetos {q,a}."},
+    attempts = _ask(
+        gemini_prompt=(
+            f"Genera {n} preguntas y respuestas cortas en español sobre el texto. Formato JSON array de objetos con 'q' y 'a'.\n\n{text[:8000]}"
+        ),
+        openai_messages=[{"role":"system","content":"Devuelve SOLO JSON array con objetos {q,a}."},
                          {"role":"user","content":text[:8000]}],
-                temperature=0.4,
-            )
-            return _json.loads(r.choices[0].message.content or '[]')
-        except Exception:
-            pass
+        parse=lambda raw: _parse_json(raw, list),
+        temperature=0.4,
+    )
     # Fallback heurístico: preguntas genéricas
-    return [{"q":"¿Cuál es la idea principal?","a":"Trata sobre los conceptos clave presentados en el texto."}]
+    return _hedged('generate_quiz', attempts,
+                   lambda: [{"q":"¿Cuál es la idea principal?","a":"Trata sobre los conceptos clave presentados en el texto."}])
 
 
-def generate_notes(text: str) -> Optional[List[str]]:
-    """
-    Genera notas de estudio orientadas al aprendizaje:
-    - 3-5 puntos clave (prefijo "Punto:")
-    - 2-3 preguntas educativas (prefijo "Pregunta:")
-    Usa Gemini/OpenAI si están disponibles; de lo contrario, heurística local.
-    Devuelve lista de strings (viñetas).
-    """
-    if not text:
-        return None
+def _bullets(out: Optional[str]) -> Optional[List[str]]:
+    """Líneas de la respuesta sin viñetas, recortadas a 7 (None si no hay)."""
+    lines = [l.strip() for l in (out or '').split('\n') if l.strip()]
+    # normalizar viñetas
+    bullets = [l.lstrip('-• ').strip() for l in lines]
+    return bullets[:7] if bullets else None
 
-    # 1) Gemini (preferido)
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                "Eres un tutor. Devuelve una lista en viñetas (una por línea) con 5-7 elementos en español.\n"
-                "Incluye: 3-5 puntos clave y 2-3 preguntas educativas de comprensión o aplicación.\n"
-                "Formato exacto por línea:\n"
-                "- Punto: <idea breve y concreta>\n"
-                "- Pregunta: <pregunta enfocada y útil>\n\n"
-                "Sé específico, claro y evita redundancias. Texto:\n\n" + text[:8000]
-            )
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            out = None
-            try:
-                out = resp.candidates[0].content.parts[0].text
-            except Exception:
-                out = getattr(resp, "text", None)
-            if out:
-                lines = [l.strip() for l in out.split('\n') if l.strip()]
-                # normalizar viñetas
-                bullets = []
-                for l in lines:
-                    l = l.lstrip('-• ').strip()
-                    bullets.append(l)
-                # recortar a 7
-                return bullets[:7] if bullets else None
-        except Exception:
-            pass
-
-    # 2) OpenAI como alternativa
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role":"system","content":(
-                        "Eres un tutor. Devuelve 5-7 líneas. Cada línea debe ser una viñeta con el formato: "
-                        "'Punto: ...' (ideas) o 'Pregunta: ...' (comprensión). Español, concreto, útil."
-                    )},
-                    {"role":"user","content":text[:8000]},
-                ],
-                temperature=0.4,
-            )
-            txt = (r.choices[0].message.content or '')
-            lines = [l.strip() for l in txt.split('\n') if l.strip()]
-            bullets = [l.lstrip('-• ').strip() for l in lines]
-            return bullets[:7] if bullets else None
-        except Exception:
-            pass
 
-    # 3) Fallback local (sin IA)
+def _heuristic_notes(text: str) -> List[str]:
     try:
         import re
         # Normalizar y segmentar oraciones
@@ -453,6 +895,40 @@ def generate_notes(text: str) -> Optional[List[str]]:
         return [text[:200] + ('…' if len(text) > 200 else '')]
 
 
+@memoized(version=1)
+def generate_notes(text: str) -> Optional[List[str]]:
+    """
+    Genera notas de estudio orientadas al aprendizaje:
+    - 3-5 puntos clave (prefijo "Punto:")
+    - 2-3 preguntas educativas (prefijo "Pregunta:")
+    Usa Gemini/OpenAI si están disponibles; de lo contrario, heurística local.
+    Devuelve lista de strings (viñetas).
+    """
+    if not text:
+        return None
+    attempts = _ask(
+        gemini_prompt=(
+            "Eres un tutor. Devuelve una lista en viñetas (una por línea) con 5-7 elementos en español.\n"
+            "Incluye: 3-5 puntos clave y 2-3 preguntas educativas de comprensión o aplicación.\n"
+            "Formato exacto por línea:\n"
+            "- Punto: <idea breve y concreta>\n"
+            "- Pregunta: <pregunta enfocada y útil>\n\n"
+            "Sé específico, claro y evita redundancias. Texto:\n\n" + text[:8000]
+        ),
+        openai_messages=[
+            {"role":"system","content":(
+                "Eres un tutor. Devuelve 5-7 líneas. Cada línea debe ser una viñeta con el formato: "
+                "'Punto: ...' (ideas) o 'Pregunta: ...' (comprensión). Español, concreto, útil."
+            )},
+            {"role":"user","content":text[:8000]},
+        ],
+        parse=_bullets,
+        temperature=0.4,
+    )
+    # Fallback local (sin IA)
+    return _hedged('generate_notes', attempts, lambda: _heuristic_notes(text))
+
+
 def _heuristic_complexity_metrics(text: str) -> Tuple[float, float]:
     """Return (avg_sentence_len, unique_ratio) as quick proxies for complexity."""
     import re
@@ -466,47 +942,7 @@ def _heuristic_complexity_metrics(text: str) -> Tuple[float, float]:
     return avg_len, unique_ratio
 
 
-def analyze_accessibility(text: str) -> Optional[Dict]:
-    """Analyze text for accessibility: complexity level, recommended speed, pause points, chapter summaries."""
-    if not text:
-        return None
-    # Try AI first for rich output
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                "Analiza el texto para accesibilidad. Devuelve JSON con: "
-                "complexity_level (baja|media|alta), recommended_speed (0.8-1.3), "
-                "pauses (array de frases o indicaciones breves), chapters (array de objetos {title, summary}). "
-                "Sé conciso, útil y claro. Texto:\n\n" + text[:8000]
-            )
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            raw = None
-            try:
-                raw = resp.candidates[0].content.parts[0].text
-            except Exception:
-                raw = getattr(resp, "text", "{}")
-            import json
-            data = json.loads(raw)
-            # basic guards
-            if isinstance(data, dict):
-                return data
-        except Exception:
-            pass
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            import json as _json
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[{"role":"system","content":"Devuelve SOLO JSON con keys: complexity_level, recommended_speed, pauses, chapters[{title,summary}]"},
-                         {"role":"user","content":text[:8000]}],
-                temperature=0.2,
-            )
-            return _json.loads(r.choices[0].message.content or '{}')
-        except Exception:
-            pass
-    # Heuristic fallback
+def _heuristic_accessibility(text: str) -> Dict:
     avg_len, uniq = _heuristic_complexity_metrics(text)
     if avg_len >= 25 or uniq >= 0.55: level = 'alta'
     elif avg_len >= 15 or uniq >= 0.45: level = 'media'
@@ -534,7 +970,8 @@ def analyze_accessibility(text: str) -> Optional[Dict]:
         if buffer:
             bl = ' '.join(buffer).strip()
             if bl:
-                summ = summarize_text(bl) or bl.split('.')[0][:220]
+                # Heuristic path: no provider calls here (the deadline already expired or none is configured)
+                summ = _heuristic_summary(bl) or bl.split('.')[0][:220]
                 chapters.append({'title': current_title or 'Sección', 'summary': summ})
             buffer = []
     for ln in lines:
@@ -552,35 +989,29 @@ def analyze_accessibility(text: str) -> Optional[Dict]:
     }
 
 
-def support_answer(message: str, context: Optional[str] = None) -> str:
-    """Answer support questions about using the app. AI if available; fallback FAQ-like text."""
-    if not message:
-        return "¿En qué puedo ayudarte? Puedes preguntar por conversión a audio, biblioteca, reproductor o recomendaciones."
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            sys = "Eres el asistente de soporte de SinSay. Sé claro, breve y práctico."
-            prompt = (context or sys) + "\n\nUsuario: " + message
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            try:
-                return resp.candidates[0].content.parts[0].text.strip()
-            except Exception:
-                return (getattr(resp, 'text', None) or '').strip()
-        except Exception:
-            pass
-    openai = _get_openai_client()
-    if openai is not None:
-        try:
-            r = openai.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[{"role":"system","content":"Eres el soporte de SinSay. Sé claro y breve."},
-                         {"role":"user","content":message}],
-                temperature=0.2,
-            )
-            return (r.choices[0].message.content or '').strip()
-        except Exception:
-            pass
-    # fallback
+@memoized(version=1)
+def analyze_accessibility(text: str) -> Optional[Dict]:
+    """Analyze text for accessibility: complexity level, recommended speed, pause points, chapter summaries."""
+    if not text:
+        return None
+    # Try AI first for rich output
+    attempts = _ask(
+        gemini_prompt=(
+            "Analiza el texto para accesibilidad. Devuelve JSON con: "
+            "complexity_level (baja|media|alta), recommended_speed (0.8-1.3), "
+            "pauses (array de frases o indicaciones breves), chapters (array de objetos {title, summary}). "
+            "Sé conciso, útil y claro. Texto:\n\n" + text[:8000]
+        ),
+        openai_messages=[{"role":"system","content":"Devuelve SOLO JSON con keys: complexity_level, recommended_speed, pauses, chapters[{title,summary}]"},
+                         {"role":"user","content":text[:8000]}],
+        parse=lambda raw: _parse_json(raw, dict),
+        temperature=0.2,
+    )
+    # Heuristic fallback
+    return _hedged('analyze_accessibility', attempts, lambda: _heuristic_accessibility(text))
+
+
+def _faq_answer(message: str) -> str:
     m = message.lower()
     if 'convert' in m or 'audio' in m:
         return "Para convertir un archivo a audio, ve a Reproductor > Generar audio, selecciona el archivo y elige una voz."
@@ -591,31 +1022,22 @@ def support_answer(message: str, context: Optional[str] = None) -> str:
     return "Puedo ayudarte con: convertir a audio, navegar la biblioteca, reproducir contenidos y recomendaciones personalizadas."
 
 
-def moderate_text(text: str) -> Dict:
-    """Moderate content: flags for inappropriate/sensitive/spam/quality issues; AI-backed with heuristic fallback."""
-    flags = { 'inappropriate': False, 'sensitive_content': False, 'spam': False, 'quality_issues': [] }
-    if not text:
-        return flags
-    client = _get_gemini_client()
-    if client is not None:
-        try:
-            prompt = (
-                "Analiza el texto y devuelve JSON con flags: inappropriate(bool), sensitive_content(bool), spam(bool), "
-                "quality_issues(array de strings breves). Sé estricto con lenguaje explícito/violencia extrema y datos personales. Texto:\n\n" + text[:8000]
-            )
-            resp = client.models.generate_content(model="gemini-1.5-flash", contents=prompt)
-            raw = None
-            try:
-                raw = resp.candidates[0].content.parts[0].text
-            except Exception:
-                raw = getattr(resp, 'text', '{}')
-            import json
-            data = json.loads(raw)
-            if isinstance(data, dict):
-                return {**flags, **data}
-        except Exception:
-            pass
-    # heuristic fallback
+def support_answer(message: str, context: Optional[str] = None) -> str:
+    """Answer support questions about using the app. AI if available; fallback FAQ-like text."""
+    if not message:
+        return "¿En qué puedo ayudarte? Puedes preguntar por conversión a audio, biblioteca, reproductor o recomendaciones."
+    sys = "Eres el asistente de soporte de SinSay. Sé claro, breve y práctico."
+    attempts = _ask(
+        gemini_prompt=(context or sys) + "\n\nUsuario: " + message,
+        openai_messages=[{"role":"system","content":"Eres el soporte de SinSay. Sé claro y breve."},
+                         {"role":"user","content":message}],
+        temperature=0.2,
+    )
+    # fallback
+    return _hedged('support_answer', attempts, lambda: _faq_answer(message))
+
+
+def _heuristic_moderation(text: str, flags: Dict) -> Dict:
     low = text.lower()
     bad_terms = ['odio', 'matar', 'violación', 'sexo explícito']
     if any(t in low for t in bad_terms): flags['inappropriate'] = True
@@ -629,6 +1051,170 @@ def moderate_text(text: str) -> Dict:
     return flags
 
 
+@memoized(version=1)
+def moderate_text(text: str) -> Dict:
+    """Moderate content: flags for inappropriate/sensitive/spam/quality issues; AI-backed with heuristic fallback."""
+    flags = { 'inappropriate': False, 'sensitive_content': False, 'spam': False, 'quality_issues': [] }
+    if not text:
+        return flags
+
+    def parse(raw):
+        data = _parse_json(raw, dict)
+        return {**flags, **data} if data is not None else None
+
+    attempts = _ask(
+        gemini_prompt=(
+            "Analiza el texto y devuelve JSON con flags: inappropriate(bool), sensitive_content(bool), spam(bool), "
+            "quality_issues(array de strings breves). Sé estricto con lenguaje explícito/violencia extrema y datos personales. Texto:\n\n" + text[:8000]
+        ),
+        parse=parse,
+    )
+    # heuristic fallback
+    return _hedged('moderate_text', attempts, lambda: _heuristic_moderation(text, dict(flags, quality_issues=[])))
+
+
+# ---------------------------------------------------------------------------
+# Combined book enrichment.
+# One structured call returns summary, analysis, notes, quiz, accessibility and
+# moderation for the same excerpt instead of six separate prompts. Every
+# section is validated; only the invalid or missing ones are asked for again
+# (once), and whatever still fails comes from the local heuristic of that
+# section. For books longer than the excerpt the caller passes the map-reduce
+# summary of the whole text (summarize_long_text): it becomes the summary
+# section and is given as context so the analysis covers the whole book. The
+# caller persists the result (book_details) so the panels only read.
+
+ENRICH_VERSION = 1
+ENRICH_TEXT_CHARS = 8000
+ENRICH_QUIZ_SIZE = 5
+_LEVELS = ('baja', 'media', 'alta')
+
+
+def _str_list(value, min_len: int = 0) -> bool:
+    return isinstance(value, list) and len(value) >= min_len and all(isinstance(v, str) and v.strip() for v in value)
+
+
+def _valid_summary(v) -> bool:
+    return isinstance(v, str) and bool(v.strip())
+
+
+def _valid_analysis(v) -> bool:
+    return (isinstance(v, dict) and _valid_summary(v.get('summary')) and _str_list(v.get('topics'), 1)
+            and isinstance(v.get('tone'), str) and v.get('complexity') in _LEVELS
+            and _str_list(v.get('warnings')) and _str_list(v.get('faqs'), 1))
+
+
+def _valid_notes(v) -> bool:
+    return _str_list(v, 3) and len(v) <= 10
+
+
+def _valid_quiz(v) -> bool:
+    return (isinstance(v, list) and len(v) >= 1
+            and all(isinstance(i, dict) and _valid_summary(i.get('q')) and _valid_summary(i.get('a')) for i in v))
+
+
+def _valid_accessibility(v) -> bool:
+    if not isinstance(v, dict) or v.get('complexity_level') not in _LEVELS:
+        return False
+    speed = v.get('recommended_speed')
+    if isinstance(speed, bool) or not isinstance(speed, (int, float)) or not 0.5 <= speed <= 2.0:
+        return False
+    chapters = v.get('chapters')
+    return (_str_list(v.get('pauses')) and isinstance(chapters, list)
+            and all(isinstance(c, dict) and isinstance(c.get('title'), str) and isinstance(c.get('summary'), str)
+                    for c in chapters))
+
+
+def _valid_moderation(v) -> bool:
+    return (isinstance(v, dict) and all(isinstance(v.get(k), bool) for k in ('inappropriate', 'sensitive_content', 'spam'))
+            and _str_list(v.get('quality_issues')))
+
+
+def _moderation_flags() -> Dict:
+    return {'inappropriate': False, 'sensitive_content': False, 'spam': False, 'quality_issues': []}
+
+
+# name -> (what to ask for, validator, heuristic(text))
+ENRICH_SECTIONS: "OrderedDict[str, Tuple[str, Callable[[object], bool], Callable[[str], object]]]" = OrderedDict([
+    ('summary', ("string: resumen de 3-4 líneas, claro y conciso, destacando ideas clave",
+                 _valid_summary, _heuristic_summary)),
+    ('analysis', ("objeto {summary (string, 3-4 líneas), topics (array de 5 palabras clave), "
+                  "tone (amigable|neutral|técnico|literario), complexity (baja|media|alta), "
+                  "warnings (array, temas sensibles; vacío si no hay), faqs (array de 3-5 preguntas frecuentes)}",
+                  _valid_analysis, _heuristic_analysis)),
+    ('notes', ("array de 5-7 strings: 3-5 con el formato 'Punto: <idea breve y concreta>' y 2-3 con "
+               "'Pregunta: <pregunta de comprensión o aplicación>'",
+               _valid_notes, _heuristic_notes)),
+    ('quiz', (f"array de {ENRICH_QUIZ_SIZE} objetos {{q, a}} con preguntas y respuestas cortas",
+              _valid_quiz,
+              lambda text: [{"q":"¿Cuál es la idea principal?","a":"Trata sobre los conceptos clave presentados en el texto."}])),
+    ('accessibility', ("objeto {complexity_level (baja|media|alta), recommended_speed (número 0.8-1.3), "
+                       "pauses (array de frases o indicaciones breves), chapters (array de objetos {title, summary})}",
+                       _valid_accessibility, _heuristic_accessibility)),
+    ('moderation', ("objeto {inappropriate (bool), sensitive_content (bool), spam (bool), "
+                    "quality_issues (array de strings breves)}; estricto con lenguaje explícito, "
+                    "violencia extrema y datos personales",
+                    _valid_moderation, lambda text: _heuristic_moderation(text, _moderation_flags()))),
+])
+
+
+def _enrich_prompt(sections: List[str]) -> str:
+    lines = [f"- {name}: {ENRICH_SECTIONS[name][0]}" for name in sections]
+    return ("Analiza el texto y devuelve SOLO un objeto JSON válido, en español, con estas claves:\n"
+            + "\n".join(lines))
+
+
+@memoized(version=ENRICH_VERSION, truncate=ENRICH_TEXT_CHARS,
+          extra=lambda overview=None, overview_fallback=False: [overview, overview_fallback])
+def enrich_book(text: str, overview: Optional[str] = None, overview_fallback: bool = False) -> Optional[Dict]:
+    """Summary, analysis, notes, quiz, accessibility and moderation in one structured call.
+    `overview`: summary of the whole book, used as the summary section and as context;
+    `overview_fallback`: it was (partly) built by the heuristic (see summarize_long_text).
+    Returns {section: value, 'sources': {section: provider|'heuristic'|'map-reduce'}}."""
+    if not text or not isinstance(text, str):
+        return None
+    excerpt = text[:ENRICH_TEXT_CHARS]
+    out: Dict = {}
+    sources: Dict[str, str] = {}
+    missing = list(ENRICH_SECTIONS)
+    context = ''
+    if overview:
+        out['summary'], sources['summary'] = overview, 'heuristic' if overview_fallback else 'map-reduce'
+        missing.remove('summary')
+        context = "\n\nResumen del libro completo (el texto siguiente es solo su comienzo):\n" + overview
+    for _ in range(2):  # combined call, then one retry with only the sections that failed
+        _call_state.provider = None
+        prompt = _enrich_prompt(missing) + context
+        data = _hedged('enrich_book', _ask(
+            gemini_prompt=prompt + "\n\nTexto:\n" + excerpt,
+            openai_messages=[{"role": "system", "content": prompt},
+                             {"role": "user", "content": excerpt}],
+            parse=lambda raw: _parse_json(raw, dict),
+            temperature=0.3,
+        ))
+        if data is None:
+            break
+        provider = getattr(_call_state, 'provider', None) or 'unknown'
+        for name in missing:
+            value = data.get(name)
+            if name == 'moderation' and isinstance(value, dict):
+                value = {**_moderation_flags(), **value}
+            if ENRICH_SECTIONS[name][1](value):
+                out[name] = value
+                sources[name] = provider
+        missing = [name for name in missing if name not in out]
+        if not missing:
+            break
+    for name in missing:
+        out[name] = ENRICH_SECTIONS[name][2](text)
+        sources[name] = 'heuristic'
+    # Memo: a partially heuristic result is kept only for the short fallback TTL
+    answered = [src for src in sources.values() if src not in ('heuristic', 'map-reduce')]
+    _call_state.provider = None if missing or overview_fallback or not answered else answered[0]
+    out['sources'] = sources
+    return out
+
+
 # --- Simple AI-ish cover generator (local, no external calls) ---
 _CATEGORY_STYLES = {
     'novela': {'bg': (37, 99, 235), 'fg': (255,255,255), 'emoji': '📖'},
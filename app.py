@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify, send_from_directory, send_file
+from flask import Flask, Request, Response, render_template, request, redirect, session, url_for, jsonify, send_from_directory, send_file
 try:
     from dotenv import load_dotenv  # type: ignore
 except Exception:
@@ -7,16 +7,21 @@ except Exception:
         return False
 from flask_bcrypt import Bcrypt
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import os
 import time
+import atexit
 import re
 import io
 import unicodedata
 import math
-import requests
 import json
 import threading
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 ELEVEN_AVAILABLE = False
 ELEVEN_USE_LEGACY = False
@@ -40,21 +45,63 @@ except Exception as _e_client:
 if not ELEVEN_AVAILABLE:
     print("⚠️  ElevenLabs no disponible: no se pudo cargar ni legacy ni client API")
 import docx
-import PyPDF2
+from pdf_extract import iter_pdf_pages
 from mutagen.mp3 import MP3  # Para obtener duración de archivos MP3
-from bson import ObjectId
 from ai_providers import (
-    summarize_text,
-    analyze_content,
-    expand_query,
     translate_text,
     detect_language,
-    generate_quiz,
-    generate_notes,
-    analyze_accessibility,
     support_answer,
     moderate_text,
+    enrich_book,
+    summarize_long_text,
+    SummaryAborted,
+    ENRICH_TEXT_CHARS,
+    ENRICH_VERSION,
     generate_cover_image_bytes,
+    set_provider_order_source,
+    set_memo_store,
+    memo_stats,
+    provider_stats,
+)
+from clients import eleven_client, google_tts_client, http_session, provider_timeout, registry as client_registry
+from tts_chunks import iter_split_text_for_tts, split_text_for_tts, synthesize_chunks, utf8_len
+from mp3_frames import join_mp3_parts
+from tts_cache import TTSCache, make_cache_key
+from tts_router import CircuitOpenError, TTSRouter
+from settings_store import SettingsStore
+from text_store import TextStore, normalize_text
+from library_listing import (
+    BLOCKED_FIELDS as LISTING_BLOCKED_FIELDS,
+    DEFAULT_LIMIT as LISTING_DEFAULT_LIMIT,
+    build_filter,
+    bump_library_version,
+    library_version,
+    list_books,
+    listing_etag,
+    parse_fields,
+)
+from book_ids import BookResolver, canonical_id, id_variants
+from write_behind import PlaybackBuffer
+from listening_state import ListeningState, playback_fields, state_book_id
+from book_details import BookDetails, CATALOG_PROJECTION, topics_of
+from search_index import LiveSearchIndex
+from vector_index import LiveVectorIndex
+from db_indexes import missing_indexes, report_startup as report_indexes, verify_query_plans
+from ingest import HashingSpoolFile, MAX_UPLOAD_BYTES, SourceFiles, discard_unclaimed, spooled_upload
+from jobs import (
+    JOB_DONE,
+    JOB_QUEUED,
+    JobPermanentError,
+    complete_job,
+    default_worker_id,
+    enqueue_job,
+    fail_job,
+    get_job,
+    lease_job,
+    process_job,
+    renew_lease,
+    serialize_job,
+    set_stage,
 )
 
 # Google Cloud TTS como fallback
@@ -69,59 +116,50 @@ except ImportError as e:
     print("⚠️  Ejecuta: pip install google-cloud-texttospeech")
 
 load_dotenv()  # Lee variables desde .env si existe
+
+
+class IngestRequest(Request):
+    """Los archivos multipart se escriben directamente en uploads/ con nombre único,
+    calculando SHA-256 y tamaño mientras llegan (ver ingest.py)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpoolFile(app.config['UPLOAD_FOLDER'], filename)
+
+
 app = Flask(__name__)
+app.request_class = IngestRequest
+# Margen para las cabeceras multipart y los demás campos del formulario
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
 app.secret_key = "sinsay_secret_key"
 bcrypt = Bcrypt(app)
 
-# Persistencia simple para la preferencia TTS (archivo local)
+
+@app.teardown_request
+def _discard_unclaimed_uploads(exc=None):
+    # request.files es un cached_property: solo si la vista lo parseó
+    files = request.__dict__.get('files')
+    if files:
+        discard_unclaimed(files)
+
+# Configuración de ejecución (TTS primario, voz/modelo, tamaños de fragmento,
+# orden de proveedores IA): snapshot en memoria, ver settings_store.py
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), 'settings.json')
-_settings_lock = threading.Lock()
 
-def _ensure_settings_file():
-    if not os.path.exists(SETTINGS_PATH):
-        try:
-            with open(SETTINGS_PATH, 'w', encoding='utf-8') as fh:
-                json.dump({'tts_primary': 'elevenlabs'}, fh, ensure_ascii=False)
-        except Exception:
-            pass
 
 def get_tts_primary():
-    """Devuelve la preferencia primaria de TTS (persistente en disk)."""
-    try:
-        if not os.path.exists(SETTINGS_PATH):
-            _ensure_settings_file()
-        with open(SETTINGS_PATH, 'r', encoding='utf-8') as fh:
-            data = json.load(fh) or {}
-            return (data.get('tts_primary') or 'elevenlabs').lower()
-    except Exception:
-        return 'elevenlabs'
+    """Devuelve la preferencia primaria de TTS (snapshot en memoria, sin I/O)."""
+    return SETTINGS.get('tts_primary') or 'elevenlabs'
 
-def set_tts_primary(value: str):
-    try:
-        with _settings_lock:
-            data = {}
-            if os.path.exists(SETTINGS_PATH):
-                try:
-                    with open(SETTINGS_PATH, 'r', encoding='utf-8') as fh:
-                        data = json.load(fh) or {}
-                except Exception:
-                    data = {}
-            data['tts_primary'] = (value or 'elevenlabs').lower()
-            with open(SETTINGS_PATH, 'w', encoding='utf-8') as fh:
-                json.dump(data, fh, ensure_ascii=False, indent=2)
-        return True
-    except Exception:
-        return False
 
-_ensure_settings_file()
-print(f"🎚️ TTS primario persistente: {get_tts_primary()}")
+def set_tts_primary(value: str):
+    return SETTINGS.set('tts_primary', (value or 'elevenlabs').lower())
 
-# Estado simple para diagnóstico de TTS
-LAST_TTS_STATUS = {
-    'engine': None,            # 'ElevenLabs' | 'Google Cloud TTS' | None
-    'fallback_reason': None,   # str | None
-    'timestamp': None          # int epoch | None
-}
+# Enrutador de motores TTS: latencia/errores por subruta, circuit breakers y
+# último resultado (engine, fallback_reason, timestamp) para diagnóstico
+TTS_ROUTER = TTSRouter({
+    'elevenlabs': ['client', 'http', 'legacy', 'stream'],
+    'google': ['grpc'],
+})
 
 # Configuración de archivos
 UPLOAD_FOLDER = 'uploads'
@@ -149,9 +187,14 @@ try:
     db = client["sinsay"]
     usuarios_collection = db["usuarios"]
     libros_collection = db["libros"]
+    jobs_collection = db["jobs"]
+    counters_collection = db["counters"]
+    # Índices declarados en db_indexes.py (crear con DB_AUTO_INDEXES=1, por defecto)
+    report_indexes(db, create=os.environ.get('DB_AUTO_INDEXES', '1') != '0')
     print(f"📊 Base de datos: {db.name}")
     print(f"📁 Colección: usuarios_collection")
     print(f"📚 Colección: libros_collection")
+    print(f"📬 Colección: jobs_collection")
 except Exception as e:
     print(f"❌ ERROR: No se pudo conectar a MongoDB: {e}")
     print("⚠️  Asegúrate de que MongoDB esté corriendo en localhost:27017")
@@ -159,6 +202,85 @@ except Exception as e:
     db = None
     usuarios_collection = None
     libros_collection = None
+    jobs_collection = None
+    counters_collection = None
+
+
+# Resolución de ids de libros: una consulta por _id + LRU (ver book_ids.py)
+BOOKS = BookResolver(libros_collection, db["migrations"] if db is not None else None)
+if libros_collection is not None and not BOOKS.normalized:
+    print("⚠️  _id/parent_id de libros sin normalizar; ejecuta: python book_ids.py")
+
+# Estado de escucha por (usuario, libro); el libro solo guarda contadores agregados
+listening_collection = db["listening_state"] if db is not None else None
+LISTENING = ListeningState(listening_collection, libros_collection)
+
+# Eventos de reproducción y play_count: se agrupan en memoria y se escriben en lote
+PLAYBACK_BUFFER = PlaybackBuffer(libros_collection, lambda book_id: BOOKS.id_filter(book_id),
+                                 state_collection=listening_collection)
+if libros_collection is not None:
+    PLAYBACK_BUFFER.start()
+    atexit.register(PLAYBACK_BUFFER.stop)
+
+
+def _library_changed(*book_ids):
+    """Llamar tras cualquier alta/edición/borrado visible en los listados de libros.
+    `book_ids`: libros a reindexar en la búsqueda (los borrados salen del índice)."""
+    bump_library_version(counters_collection)
+    for book_id in book_ids:
+        SEARCH_INDEX.upsert(book_id)
+        VECTORS.touch(book_id)
+
+
+# Archivos fuente por contenido (sha256): texto extraído y audios por voz
+SOURCE_FILES = SourceFiles(db["source_files"] if db is not None else None)
+# Textos normalizados y comprimidos (compartidos por contenido, ver text_store.py)
+TEXTS = TextStore(db["texts"] if db is not None else None)
+# Resumen/análisis/accesibilidad/moderación por libro, fuera del catálogo `libros`
+BOOK_DETAILS = BookDetails(db["book_details"] if db is not None else None)
+# Índices en memoria para /api/search (BM25) y /api/autocomplete (prefijos);
+# se construyen en segundo plano al arrancar
+SEARCH_INDEX = LiveSearchIndex(libros_collection, BOOK_DETAILS.collection,
+                               version_fn=lambda: library_version(counters_collection))
+if libros_collection is not None:
+    SEARCH_INDEX.start()
+# Búsqueda semántica local: vectores TF-IDF hasheados en disco (requiere numpy).
+# TextStore propio sin LRU para no desplazar los textos calientes al vectorizar.
+VECTORS = LiveVectorIndex(libros_collection, BOOK_DETAILS.collection,
+                          TextStore(db["texts"], lru_size=0) if db is not None else None,
+                          version_fn=lambda: library_version(counters_collection))
+if libros_collection is not None:
+    if VECTORS.available:
+        VECTORS.start()
+    else:
+        print("⚠️  numpy no disponible: búsqueda semántica local desactivada (pip install numpy)")
+
+
+def book_text(doc):
+    """Texto completo de un libro: desde `texts` por text_id, o el campo `text` de libros antiguos."""
+    if not doc:
+        return ''
+    return TEXTS.get(doc.get('text_id')) or doc.get('text') or ''
+
+SETTINGS = SettingsStore(
+    SETTINGS_PATH,
+    collection=db["settings"] if db is not None else None,
+    refresh_seconds=float(os.environ.get('SETTINGS_REFRESH_SECONDS', '2')),
+)
+SETTINGS.start()
+set_provider_order_source(lambda: SETTINGS.get('ai_provider_order'))
+# Resultados de IA (quiz, notas, accesibilidad, moderación, idioma, traducción) memoizados
+set_memo_store(db["ai_cache"] if db is not None else None,
+               stats_collection=db["cache_stats"] if db is not None else None)
+print(f"🎚️ TTS primario persistente: {get_tts_primary()}")
+
+# Caché de audio TTS direccionada por contenido (por fragmento y por documento)
+TTS_CACHE = TTSCache(
+    db["tts_cache"] if db is not None else None,
+    os.path.join(AUDIO_FOLDER, 'tts_cache'),
+    max_bytes=int(os.environ.get('TTS_CACHE_MAX_MB', '2048')) * 1024 * 1024,
+    stats_collection=db["cache_stats"] if db is not None else None,
+)
 
 # ElevenLabs API (principal TTS)
 ELEVEN_API_KEY = os.environ.get("ELEVEN_API_KEY")
@@ -168,10 +290,10 @@ if ELEVEN_AVAILABLE:
         # Si tenemos la clave y estamos usando la API legacy, configurarla.
         if ELEVEN_API_KEY and ELEVEN_USE_LEGACY:
             el_set_api_key(ELEVEN_API_KEY)
-        # Inicializar cliente singleton si es posible
+        # Inicializar cliente compartido (registro con pool keep-alive) si es posible
         if ELEVEN_CLIENT_AVAILABLE and ELEVEN_API_KEY:
             try:
-                ELEVEN_CLIENT = ElevenLabs(api_key=ELEVEN_API_KEY)
+                ELEVEN_CLIENT = eleven_client(ELEVEN_API_KEY)
                 print("🔧 ElevenLabs client singleton inicializado")
             except Exception as _e:
                 ELEVEN_CLIENT = None
@@ -209,27 +331,29 @@ def _to_roman(num: int) -> str:
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text_from_file(filepath):
-    """Extrae texto de archivos PDF, DOCX o TXT"""
+def iter_text_pages(filepath):
+    """Genera el texto del archivo por páginas (PDF) o de una vez (TXT/DOCX/BRF).
+    Los PDF se extraen en paralelo por rangos de páginas (ver pdf_extract.py),
+    así que el consumidor puede empezar antes de que termine la extracción.
+    """
     ext = filepath.rsplit('.', 1)[1].lower()
-    
+
     if ext == 'txt' or ext == 'brf':
         with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    
+            yield f.read()
+
     elif ext == 'docx':
         doc = docx.Document(filepath)
-        return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-    
+        yield '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+
     elif ext == 'pdf':
-        text = ""
-        with open(filepath, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
-    
-    return ""
+        for page in iter_pdf_pages(filepath):
+            yield page.text
+
+
+def extract_text_from_file(filepath):
+    """Extrae texto de archivos PDF, DOCX o TXT"""
+    return ''.join(iter_text_pages(filepath))
 
 def generate_audio_with_google_tts(text, language_code='es-ES', output_file=None):
     """
@@ -242,25 +366,17 @@ def generate_audio_with_google_tts(text, language_code='es-ES', output_file=None
     print("🔄 Usando Google Cloud TTS como respaldo...")
     
     try:
-        # Inicializar cliente con API key desde variable de entorno
+        # Cliente compartido del registro: un solo canal gRPC por proceso
         api_key = os.environ.get('GOOGLE_API_KEY')
         if not api_key:
             raise Exception("GOOGLE_API_KEY no está configurada en las variables de entorno")
-        
-        print(f"🔑 Usando API Key de Google Cloud (primeros 10 caracteres): {api_key[:10]}...")
-        
-        # Crear cliente con API key
-        from google.api_core import client_options as client_options_lib
-        client_opts = client_options_lib.ClientOptions(api_key=api_key)
-        client = texttospeech.TextToSpeechClient(client_options=client_opts)
-        
-        print("✅ Cliente de Google Cloud TTS inicializado correctamente")
-        
+        client = google_tts_client(api_key)
+
     except Exception as auth_error:
         print(f"⚠️  Error al inicializar cliente Google: {auth_error}")
         print("⚠️  Intentando con configuración por defecto...")
         try:
-            client = texttospeech.TextToSpeechClient()
+            client = google_tts_client(None)
         except Exception as fallback_error:
             raise Exception(f"No se pudo inicializar Google Cloud TTS: {fallback_error}")
     
@@ -282,11 +398,12 @@ def generate_audio_with_google_tts(text, language_code='es-ES', output_file=None
     )
     
     # Generar el audio
-    response = client.synthesize_speech(
+    response = TTS_ROUTER.call('google', 'grpc', lambda: client.synthesize_speech(
         input=synthesis_input,
         voice=voice,
-        audio_config=audio_config
-    )
+        audio_config=audio_config,
+        timeout=provider_timeout('google_tts')[1]
+    ), chars=len(text))
     
     print("✅ Audio generado con Google Cloud TTS")
     return response.audio_content
@@ -295,14 +412,16 @@ def generate_audio_with_google_tts(text, language_code='es-ES', output_file=None
 def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str = None) -> bytes:
     """Genera audio con ElevenLabs y devuelve bytes MP3.
     Intenta primero el Client API (acepta voice_id); si falla, intenta Legacy API.
+    Cada subruta pasa por TTS_ROUTER: las que tienen el circuito abierto se omiten
+    al instante en lugar de esperar su timeout.
     """
     # Permitir usar la ruta HTTP directa incluso si las librerías/SDK no están instaladas,
     # siempre que exista una clave en `ELEVEN_API_KEY`.
     if not ELEVEN_AVAILABLE and not ELEVEN_API_KEY:
         raise Exception("ElevenLabs no está disponible y no hay ELEVEN_API_KEY configurada")
 
-    voice = voice_id or os.environ.get('ELEVEN_VOICE_ID') or 'Rachel'
-    mdl = model or os.environ.get('ELEVEN_MODEL', 'eleven_multilingual_v2')
+    voice = voice_id or SETTINGS.get('eleven_voice_id')
+    mdl = model or SETTINGS.get('eleven_model')
     print(f"🎙️  Usando ElevenLabs preferentemente vía Client API: voice={voice}, model={mdl}")
 
     last_error = None
@@ -320,7 +439,7 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str =
             'text': txt,
             'model_id': mdl,
         }
-        resp = requests.post(url, headers=headers, data=_json.dumps(payload), timeout=120)
+        resp = http_session('eleven').post(url, headers=headers, data=_json.dumps(payload), timeout=provider_timeout('eleven'))
         if resp.status_code >= 400:
             raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
         content = resp.content or b''
@@ -330,8 +449,8 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str =
 
     # 1) Client API (preferido para voice_id)
     if ELEVEN_CLIENT_AVAILABLE:
-        try:
-            client = ELEVEN_CLIENT if ELEVEN_CLIENT is not None else ElevenLabs(api_key=ELEVEN_API_KEY)
+        def _client_tts() -> bytes:
+            client = ELEVEN_CLIENT if ELEVEN_CLIENT is not None else eleven_client(ELEVEN_API_KEY)
             response = client.text_to_speech.convert(
                 voice_id=voice,
                 optimize_streaming_latency=0,
@@ -346,14 +465,15 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str =
             if not audio:
                 raise Exception("Respuesta vacía del Client API")
             return audio
+        try:
+            return TTS_ROUTER.call('elevenlabs', 'client', _client_tts, chars=len(text))
         except Exception as e:
             last_error = e
             print(f"⚠️  ElevenLabs (client) falló: {e}")
 
     # 2) HTTP directo (independiente del SDK)
     try:
-        audio_http = _http_eleven_tts(ELEVEN_API_KEY, voice, text, mdl)
-        return audio_http
+        return TTS_ROUTER.call('elevenlabs', 'http', lambda: _http_eleven_tts(ELEVEN_API_KEY, voice, text, mdl), chars=len(text))
     except Exception as e:
         last_error = e
         print(f"⚠️  ElevenLabs (HTTP) falló: {e}")
@@ -370,10 +490,12 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str =
                     print(f"ℹ️  Legacy API: voice_id detectado; usando nombre de voz '{use_voice}'")
             except Exception:
                 pass
-            audio_bytes = el_generate(text=text, voice=use_voice, model=mdl)
-            if not audio_bytes:
-                raise Exception("Respuesta vacía del Legacy API")
-            return audio_bytes
+            def _legacy_tts() -> bytes:
+                audio_bytes = el_generate(text=text, voice=use_voice, model=mdl)
+                if not audio_bytes:
+                    raise Exception("Respuesta vacía del Legacy API")
+                return audio_bytes
+            return TTS_ROUTER.call('elevenlabs', 'legacy', _legacy_tts, chars=len(text))
         except Exception as e:
             last_error = e
             print(f"⚠️  ElevenLabs (legacy) falló: {e}")
@@ -381,6 +503,133 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str = None, model: str =
     # Si llegó aquí, ambos intentos fallaron
     raise Exception(f"ElevenLabs no pudo generar audio: {last_error}")
 
+
+# Latencia de streaming de ElevenLabs (0 = máxima calidad … 4 = mínima latencia)
+ELEVEN_STREAMING_LATENCY = int(os.environ.get('ELEVEN_STREAMING_LATENCY', '3'))
+
+
+def stream_audio_with_elevenlabs(text: str, voice_id: str = None, model: str = None, latency: int = None):
+    """Generador de bytes MP3 a medida que ElevenLabs los produce.
+    Intenta el streaming del Client API y, si no está disponible, el endpoint HTTP /stream.
+    La subruta 'stream' del router registra latencia y errores; con el circuito
+    abierto lanza CircuitOpenError antes de contactar al proveedor.
+    """
+    if not TTS_ROUTER.allow('elevenlabs', 'stream'):
+        raise CircuitOpenError("circuito abierto: elevenlabs/stream")
+    t0 = time.monotonic()
+    try:
+        for chunk in _stream_eleven_raw(text, voice_id, model, latency):
+            yield chunk
+    except GeneratorExit:
+        # El cliente cortó la descarga: no es un fallo del proveedor
+        TTS_ROUTER.release('elevenlabs', 'stream')
+        raise
+    except Exception as e:
+        TTS_ROUTER.record('elevenlabs', 'stream', False, time.monotonic() - t0, len(text), e)
+        raise
+    TTS_ROUTER.record('elevenlabs', 'stream', True, time.monotonic() - t0, len(text))
+
+
+def _stream_eleven_raw(text: str, voice_id: str = None, model: str = None, latency: int = None):
+    if not ELEVEN_AVAILABLE and not ELEVEN_API_KEY:
+        raise Exception("ElevenLabs no está disponible y no hay ELEVEN_API_KEY configurada")
+    voice = voice_id or SETTINGS.get('eleven_voice_id')
+    mdl = model or SETTINGS.get('eleven_model')
+    lat = ELEVEN_STREAMING_LATENCY if latency is None else int(latency)
+
+    if ELEVEN_CLIENT_AVAILABLE:
+        client = ELEVEN_CLIENT if ELEVEN_CLIENT is not None else eleven_client(ELEVEN_API_KEY)
+        # SDK v2 expone .stream(); v1 expone .convert_as_stream()
+        stream_fn = getattr(client.text_to_speech, 'stream', None) or getattr(client.text_to_speech, 'convert_as_stream', None)
+        if stream_fn is not None:
+            try:
+                iterator = iter(stream_fn(
+                    voice_id=voice,
+                    optimize_streaming_latency=lat,
+                    output_format="mp3_44100_128",
+                    model_id=mdl,
+                    text=text,
+                ))
+                first = next(iterator)
+            except StopIteration:
+                first = None
+                iterator = None
+            except Exception as e:
+                print(f"⚠️  ElevenLabs streaming (client) falló: {e}")
+                iterator = None
+            if iterator is not None:
+                if first:
+                    yield first
+                for chunk in iterator:
+                    if chunk:
+                        yield chunk
+                return
+
+    # HTTP directo con cuerpo en streaming
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice}/stream"
+    headers = {
+        'xi-api-key': ELEVEN_API_KEY,
+        'Accept': 'audio/mpeg',
+        'Content-Type': 'application/json',
+    }
+    params = {'optimize_streaming_latency': lat, 'output_format': 'mp3_44100_128'}
+    with http_session('eleven').post(url, headers=headers, params=params, data=json.dumps({'text': text, 'model_id': mdl}),
+                                     timeout=provider_timeout('eleven'), stream=True) as resp:
+        if resp.status_code >= 400:
+            raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        for chunk in resp.iter_content(chunk_size=4096):
+            if chunk:
+                yield chunk
+
+
+# Límites por petición de cada motor: (clave de configuración, medida).
+# ElevenLabs cuenta caracteres; Google Cloud TTS limita a 5000 bytes UTF-8.
+TTS_CHUNK_LIMITS = {
+    'elevenlabs': ('eleven_chunk_chars', len),
+    'google': ('google_tts_chunk_bytes', utf8_len),
+}
+TTS_MAX_WORKERS = int(os.environ.get('TTS_MAX_WORKERS', '4'))
+TTS_CHUNK_RETRIES = int(os.environ.get('TTS_CHUNK_RETRIES', '2'))
+
+
+def _tts_chunk_limit(engine: str):
+    """(tamaño máximo, medida) vigentes para fragmentar texto de un motor."""
+    key, measure = TTS_CHUNK_LIMITS[engine]
+    return SETTINGS.get(key), measure
+
+
+def _tts_voice_and_model(engine: str, voice_id: str = None):
+    """Voz y modelo efectivos de un motor (forman parte de la clave de caché)."""
+    if engine == 'elevenlabs':
+        return voice_id or SETTINGS.get('eleven_voice_id'), SETTINGS.get('eleven_model')
+    return 'es-ES-Neural2-A', 'google-neural2-mp3'
+
+
+def synthesize_long_text(text: str, engine: str, voice_id: str = None) -> bytes:
+    """Sintetiza un texto de cualquier longitud con un motor.
+    Se divide en fragmentos por párrafos/oraciones, se sintetizan en paralelo
+    (pool acotado, reintentando solo los fallidos) y se unen a nivel de frame MP3.
+    Todos los fragmentos usan el mismo motor para no mezclar voces ni frecuencias.
+    Cada fragmento pasa por TTS_CACHE: un libro editado solo vuelve a narrar
+    los párrafos que cambiaron, y uno repetido se arma entero desde la caché.
+    El documento unido no se cachea (serían los mismos bytes dos veces).
+    """
+    voice, model = _tts_voice_and_model(engine, voice_id)
+    max_len, measure = _tts_chunk_limit(engine)
+    chunks = split_text_for_tts(text, max_len=max_len, measure=measure)
+    if not chunks:
+        raise Exception("Texto vacío para TTS")
+    if engine == 'elevenlabs':
+        synth = lambda t: generate_audio_with_elevenlabs(t, voice_id=voice_id)
+    else:
+        synth = lambda t: generate_audio_with_google_tts(t, language_code='es-ES')
+    synth = TTS_CACHE.wrap(synth, voice, model, engine)
+    if len(chunks) == 1:
+        return synth(chunks[0])
+    print(f"✂️  Texto dividido en {len(chunks)} fragmentos para {engine} (máx. {TTS_MAX_WORKERS} en paralelo)")
+    parts = synthesize_chunks(chunks, synth, max_workers=TTS_MAX_WORKERS, retries=TTS_CHUNK_RETRIES)
+    return join_mp3_parts(parts)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     print("\n🔐 LOGIN - Solicitud recibida")
@@ -523,6 +772,10 @@ def register():
         
         return redirect(url_for('home'))
         
+    except DuplicateKeyError:
+        # Registro simultáneo con el mismo correo (índice único usuarios.correo)
+        print(f"⚠️  El correo ya está registrado")
+        return render_template('login.html', error="El correo ya está registrado", instituciones=instituciones)
     except Exception as e:
         print(f"❌ ERROR en register: {e}")
         import traceback
@@ -619,127 +872,150 @@ def subir_libro():
 
 @app.route('/api/libros', methods=['GET'])
 def obtener_libros():
-    """API para obtener todos los libros de la biblioteca"""
+    """API para obtener todos los libros de la biblioteca (sin texto; ver /api/v2/libros para paginar)"""
     try:
         if libros_collection is None:
             return jsonify({'error': 'No hay conexión a la base de datos'}), 500
-        
-        # Traer también el _id para poder navegar a un libro específico
-        libros = list(libros_collection.find({}))
-        
+
+        # Traer también el _id para poder navegar a un libro específico (sin blobs pesados)
+        libros = list(libros_collection.find({}, {f: 0 for f in LISTING_BLOCKED_FIELDS}))
+
         # Agregar ID numérico para cada libro
         for idx, libro in enumerate(libros, start=1):
             # Conservar un id incremental para la UI
             libro['id'] = idx
-            # Exponer el ObjectId como string para navegación directa
-            if '_id' in libro:
-                libro['_id'] = str(libro['_id'])
-            # Normalizar parent_id si existe
-            if 'parent_id' in libro and libro['parent_id']:
-                try:
-                    libro['parent_id'] = str(libro['parent_id'])
-                except Exception:
-                    pass
+            _serialize_listing_book(libro)
 
-            # Normalizar audio_url: si no existe o es relativo, intentar construirlo a partir de audio_filename
-            try:
-                au = libro.get('audio_url') or ''
-                filename = libro.get('audio_filename') or ''
-                if not au and filename:
-                    au = f"/audio_files/{filename}"
-                    libro['audio_url'] = au
-
-                # Si la ruta es relativa (empieza con '/') devolver también la URL absoluta para evitar problemas de origin
-                if isinstance(au, str) and au.startswith('/'):
-                    host = (request.host_url or '').rstrip('/')
-                    libro['audio_url_absolute'] = f"{host}{au}"
-                else:
-                    libro['audio_url_absolute'] = libro.get('audio_url')
-            except Exception:
-                # No fallar la API por un libro mal formado
-                libro['audio_url_absolute'] = libro.get('audio_url')
-        
         return jsonify({'libros': libros}), 200
     except Exception as e:
         print(f"❌ ERROR al obtener libros: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+def _serialize_listing_book(libro):
+    """Ajusta un documento de libro para JSON: ids como string y audio_url absoluta."""
+    # Exponer el ObjectId como string para navegación directa
+    if '_id' in libro:
+        libro['_id'] = str(libro['_id'])
+    # Normalizar parent_id si existe
+    if 'parent_id' in libro and libro['parent_id']:
+        try:
+            libro['parent_id'] = str(libro['parent_id'])
+        except Exception:
+            pass
+
+    # Normalizar audio_url: si no existe o es relativo, intentar construirlo a partir de audio_filename
+    if 'audio_url' not in libro and 'audio_filename' not in libro:
+        return libro
+    try:
+        au = libro.get('audio_url') or ''
+        filename = libro.get('audio_filename') or ''
+        if not au and filename:
+            au = f"/audio_files/{filename}"
+            libro['audio_url'] = au
+
+        # Si la ruta es relativa (empieza con '/') devolver también la URL absoluta para evitar problemas de origin
+        if isinstance(au, str) and au.startswith('/'):
+            host = (request.host_url or '').rstrip('/')
+            libro['audio_url_absolute'] = f"{host}{au}"
+        else:
+            libro['audio_url_absolute'] = libro.get('audio_url')
+    except Exception:
+        # No fallar la API por un libro mal formado
+        libro['audio_url_absolute'] = libro.get('audio_url')
+    return libro
+
+
+@app.route('/api/v2/libros', methods=['GET'])
+def api_v2_libros():
+    """Listado paginado de la biblioteca.
+    Query: limit (1-100), cursor (de next_cursor), fields=a,b,c, category, level,
+    is_chapter=true|false, parent_id. Responde 304 si el ETag no cambió.
+    """
+    if libros_collection is None:
+        return jsonify({'error': 'No hay conexión a la base de datos'}), 500
+    try:
+        etag = listing_etag(library_version(counters_collection), request.args.items(multi=True))
+        if request.if_none_match.contains_weak(etag):
+            return '', 304
+        is_chapter = request.args.get('is_chapter')
+        query = build_filter(
+            category=(request.args.get('category') or '').strip() or None,
+            level=(request.args.get('level') or '').strip() or None,
+            is_chapter=None if is_chapter in (None, '') else _is_truthy(is_chapter),
+            parent_id=(request.args.get('parent_id') or '').strip() or None,
+        )
+        try:
+            limit = int(request.args.get('limit') or LISTING_DEFAULT_LIMIT)
+            docs, next_cursor = list_books(libros_collection, query, parse_fields(request.args.get('fields')),
+                                           limit=limit, cursor=request.args.get('cursor') or None)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        resp = jsonify({
+            'libros': [_serialize_listing_book(d) for d in docs],
+            'next_cursor': next_cursor,
+        })
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp, 200
+    except Exception as e:
+        print(f"❌ ERROR en /api/v2/libros: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/autocomplete', methods=['GET'])
 def api_autocomplete():
-    """Devuelve sugerencias rápidas para el buscador (títulos y categorías)."""
+    """Devuelve sugerencias rápidas para el buscador (títulos, subtítulos y categorías)."""
     try:
         if libros_collection is None:
             return jsonify({'suggestions': []})
         q = (request.args.get('q') or '').strip()
         if not q:
             return jsonify({'suggestions': []})
-        # Traer un subconjunto razonable (hasta 200) para sugerencias
-        docs = list(libros_collection.find({}, {'title': 1, 'subtitle': 1, 'category': 1, 'categoryLabel': 1}).sort('uploaded_at', -1).limit(200))
-        ql = q.lower()
-        # Preferimos los que empiezan con el query, luego los que contienen
-        titles = []
-        for d in docs:
-            t = str(d.get('title') or '')
-            if t:
-                titles.append(t)
-        # Únicos, preservando orden
-        seen = set()
-        titles_unique = []
-        for t in titles:
-            if t not in seen:
-                seen.add(t)
-                titles_unique.append(t)
-        starts = [t for t in titles_unique if t.lower().startswith(ql)]
-        contains = [t for t in titles_unique if ql in t.lower() and t not in starts]
-        # Añadir categorías relacionadas
-        cats = list({(d.get('categoryLabel') or d.get('category') or '') for d in docs})
-        cat_contains = [c for c in cats if ql and ql in str(c).lower()]
-        # Limitar
-        suggestions = (starts + contains + cat_contains)[:10]
-        return jsonify({'suggestions': suggestions})
+        # Índice de prefijos en memoria (search_index.py): sin consultas por tecla
+        limit = max(1, min(20, request.args.get('limit', 10, type=int) or 10))
+        return jsonify({'suggestions': SEARCH_INDEX.suggest(q, limit)})
     except Exception as e:
         print(f"❌ ERROR autocomplete: {e}")
         return jsonify({'suggestions': []})
 
 
+# Constante de reciprocal rank fusion para combinar BM25 y vectores
+RRF_K = 60
+
+
 @app.route('/api/search', methods=['GET'])
 def api_search():
-    """Búsqueda semántica ligera por título, subtítulo, categoría, topics (si existen)."""
+    """Búsqueda BM25 (search_index.py) y semántica local (vector_index.py)."""
     try:
         if libros_collection is None:
             return jsonify({'libros': []})
         q = (request.args.get('q') or '').strip()
         if not q:
             # sin query: devolver recientes
-            docs = list(libros_collection.find({}).sort('uploaded_at', -1).limit(50))
+            docs = list(libros_collection.find({}, CATALOG_PROJECTION).sort('uploaded_at', -1).limit(50))
             for d in docs:
                 d['_id'] = str(d['_id'])
             return jsonify({'libros': docs})
-        # expandir query con IA si está disponible
-        keywords = expand_query(q)
-        kws = [k.lower() for k in keywords]
-        # traer un conjunto de documentos y rankear en Python
-        docs = list(libros_collection.find({}).limit(500))
-        def score(doc):
-            s = 0
-            t = str(doc.get('title') or '').lower()
-            sub = str(doc.get('subtitle') or '').lower()
-            cat = str(doc.get('category') or '').lower() + ' ' + str(doc.get('categoryLabel') or '').lower()
-            topics = ' '.join((doc.get('analysis', {}) or {}).get('topics', [])).lower()
-            # pesos simples
-            for k in kws:
-                if k in t: s += 3
-                if k in sub: s += 2
-                if k in cat: s += 2
-                if k and k in topics: s += 2
-            return s
-        ranked = sorted(docs, key=score, reverse=True)
-        top = [
-            {**d, '_id': str(d.get('_id'))}
-            for d in ranked[:30]
-            if score(d) > 0
-        ]
+        # BM25 (coincidencia léxica) + vectores locales (similitud semántica),
+        # combinados por posición (reciprocal rank fusion); sin IA por consulta
+        k = max(1, min(100, request.args.get('limit', 30, type=int) or 30))
+        fused = {}
+        for results in (SEARCH_INDEX.search(q, k), VECTORS.search(q, k)):
+            for rank, (doc_id, _score) in enumerate(results):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        ranked = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        if not ranked:
+            return jsonify({'libros': []})
+        ids = [i for doc_id, _score in ranked for i in id_variants(doc_id)]
+        by_id = {str(d['_id']): d for d in libros_collection.find({'_id': {'$in': ids}}, CATALOG_PROJECTION)}
+        top = []
+        for doc_id, score in ranked:
+            d = by_id.get(doc_id)
+            if d is not None:
+                if d.get('parent_id') is not None:
+                    d['parent_id'] = str(d['parent_id'])
+                top.append({**d, '_id': doc_id, 'score': round(score, 4)})
         return jsonify({'libros': top})
     except Exception as e:
         print(f"❌ ERROR search: {e}")
@@ -755,32 +1031,23 @@ def reproductor(book_id):
         return redirect(url_for('biblioteca'))
 
     try:
-        # Soportar búsqueda por ObjectId o por string _id (datos antiguos o inconsistencias)
-        query = {'$or': []}
-        try:
-            query['$or'].append({'_id': ObjectId(book_id)})
-        except Exception:
-            pass
-        query['$or'].append({'_id': book_id})
-        libro = libros_collection.find_one(query)
+        libro = _resolve_book(book_id)
         if not libro:
             return redirect(url_for('biblioteca'))
 
-        # Registrar última reproducción para "Recientes"
+        # Registrar última reproducción para "Recientes" (write-behind)
         try:
             now = datetime.utcnow()
-            libros_collection.update_one({'_id': ObjectId(book_id)}, {
-                '$set': {
-                    'last_played_at': now,
-                    'last_played_by': str(session.get('usuario_id', ''))
-                },
-                '$inc': { 'play_count': 1 }
-            })
+            user = str(session.get('usuario_id', ''))
+            PLAYBACK_BUFFER.add(user, state_book_id(libro['_id']), playback_fields('view', 0, 0, now, libro['_id']),
+                                inc={'play_count': 1}, at=now)
+            SEARCH_INDEX.add_plays(libro['_id'])
         except Exception as _e:
             print(f"⚠️  No se pudo registrar last_played_at: {_e}")
 
         # Convertir _id para evitar problemas en la plantilla y asegurar campos esperados
         libro['_id'] = str(libro['_id'])
+        libro['text'] = book_text(libro)
         return render_template('reproductor.html', libro=libro)
     except Exception as e:
         print(f"❌ ERROR en reproductor({book_id}): {e}")
@@ -810,36 +1077,25 @@ def api_playback_event():
         position = float(data.get('position') or 0)
         duration = float(data.get('duration') or 0)
         now = datetime.utcnow()
-        updates = {
-            '$set': {
-                'last_played_at': now,
-                'last_played_by': str(session.get('usuario_id', '')),
-            },
-            '$inc': { 'play_count': 1 } if event == 'start' else {}
+        user = str(session.get('usuario_id', ''))
+        # Estado del oyente en listening_state; en el libro solo contadores agregados
+        fields = playback_fields(event, position, duration, now, book_id)
+        counters = {
+            'play_count': 1 if event == 'start' else 0,
+            'completion_count': 1 if event == 'ended' else 0,
         }
-        # calcular progreso si hay duración > 0
-        prog = None
-        if duration and duration > 0:
-            p = int(max(0, min(100, round((position / duration) * 100))))
-            prog = p
-            updates['$set']['progress'] = p
-            updates['$set']['last_position_sec'] = int(max(0, round(position)))
-            updates['$set']['duration_seconds'] = int(max(0, round(duration)))
-        if event == 'ended':
-            updates['$set']['progress'] = 100
-            updates['$set']['completed_at'] = now
-        # limpiar inc vacío
-        if not updates['$inc']:
-            updates.pop('$inc', None)
-        libros_collection.update_one({'_id': ObjectId(book_id)}, updates)
-        return jsonify({'ok': True, 'progress': prog if prog is not None else None})
+        # Se escribe en lote (PLAYBACK_BUFFER); la respuesta no espera a MongoDB
+        PLAYBACK_BUFFER.add(user, state_book_id(book_id), fields, inc=counters, at=now)
+        if counters['play_count']:
+            SEARCH_INDEX.add_plays(state_book_id(book_id))
+        return jsonify({'ok': True, 'progress': fields.get('progress')})
     except Exception as e:
         print(f"❌ ERROR playback/event: {e}")
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 @app.route('/recientes')
 def recientes():
-    """Lista de libros reproducidos en las últimas 24 horas."""
+    """Lista de libros reproducidos por el usuario en las últimas 24 horas."""
     if 'usuario_id' not in session:
         return redirect(url_for('login'))
     try:
@@ -847,10 +1103,16 @@ def recientes():
             return render_template('recientes.html', recientes=[], total=0, completed=0, in_progress=0, today_count=0)
         now = datetime.utcnow()
         from_dt = now - timedelta(hours=24)
-        cursor = libros_collection.find({ 'last_played_at': { '$gte': from_dt } }).sort('last_played_at', -1)
+        today_start = datetime(now.year, now.month, now.day)
+        try:
+            page = int(request.args.get('page') or 1)
+        except ValueError:
+            page = 1
+        # Tarjetas de la página y métricas (total, completados, en progreso, hoy) en una agregación
+        summary = LISTENING.recent_summary(session['usuario_id'], from_dt, today_start, page=page)
         recientes = []
-        for d in cursor:
-            d['_id'] = str(d.get('_id'))
+        for d in summary['cards']:
+            d = dict(d)
             # Normalizar campos usados en la UI
             d['title'] = d.get('title') or 'Sin título'
             d['subtitle'] = d.get('subtitle') or ''
@@ -861,339 +1123,695 @@ def recientes():
             d['last_played_at'] = d.get('last_played_at')
             d['completed_at'] = d.get('completed_at')
             recientes.append(d)
-        # Métricas: total, completados, en progreso, hoy
-        today_date = now.date()
-        total = len(recientes)
-        # Completados: terminados en las últimas 24h (completed_at dentro de la ventana)
-        completed = 0
-        in_progress = 0
-        today_count = 0
-        for d in recientes:
-            prog = int(d.get('progress') or 0)
-            c_at = d.get('completed_at')
-            # completados en 24h
-            if c_at and c_at >= from_dt:
-                completed += 1
-                # hoy = completados cuya fecha es hoy
-                try:
-                    if c_at.date() == today_date:
-                        today_count += 1
-                except Exception:
-                    pass
-            else:
-                # en progreso en la ventana si no están completos
-                if 0 < prog < 100:
-                    in_progress += 1
-        return render_template('recientes.html', recientes=recientes, total=total, completed=completed, in_progress=in_progress, today_count=today_count)
+        return render_template('recientes.html', recientes=recientes, total=summary['total'],
+                               completed=summary['completed'], in_progress=summary['in_progress'],
+                               today_count=summary['today'], page=summary['page'], pages=summary['pages'])
     except Exception as e:
         print(f"❌ ERROR en /recientes: {e}")
         return render_template('recientes.html', recientes=[], total=0, completed=0, in_progress=0, today_count=0)
 
-@app.route('/upload', methods=['POST'])
-def upload():
-    print("\n🎵 UPLOAD - Solicitud de conversión de texto a audio")
+def _listening_limit(default=20):
     try:
-        print("📁 Verificando archivo...")
-        if 'file' not in request.files:
-            print("❌ No se encontró ningún archivo en la solicitud")
-            return jsonify({'error': 'No se encontró ningún archivo'}), 400
-        
-        file = request.files['file']
-        print(f"📄 Archivo recibido: {file.filename}")
-        
-        if file.filename == '':
-            print("❌ El nombre del archivo está vacío")
-            return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
-        
-        if not allowed_file(file.filename):
-            print(f"❌ Tipo de archivo no permitido: {file.filename}")
-            return jsonify({'error': 'Tipo de archivo no permitido. Usa: .txt, .pdf, .docx, .brf'}), 400
-        
-        # Guardar archivo
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        print(f"💾 Guardando archivo en: {filepath}")
-        file.save(filepath)
-        print("✅ Archivo guardado")
-        
-    # Extraer texto
-        print("📖 Extrayendo texto del archivo...")
-        text = extract_text_from_file(filepath)
-        print(f"✅ Texto extraído: {len(text)} caracteres")
-        print(f"📝 Primeros 100 caracteres: {text[:100]}...")
-        
-        if not text or len(text.strip()) == 0:
-            print("❌ No se pudo extraer texto del archivo")
-            os.remove(filepath)
-            return jsonify({'error': 'No se pudo extraer texto del archivo o está vacío'}), 400
-        
-        # Enriquecimiento IA: resumen (opcional)
-        ai_summary = None
-        try:
-            ai_summary = summarize_text(text)
-            if ai_summary:
-                print(f"🧠 Resumen IA generado ({len(ai_summary)} chars)")
-        except Exception as se:
-            print(f"⚠️  No se pudo generar resumen IA: {se}")
-
-        # Obtener la voz seleccionada
-        voice_id = request.form.get('voice', 'rpqlUOplj0Q0PIilat8h')
-        print(f"🎤 Voz seleccionada: {voice_id}")
-        
-        # Limitar texto si es muy largo
-        MAX_CHARS = 5000
-        if len(text) > MAX_CHARS:
-            print(f"⚠️  Texto muy largo ({len(text)} chars), limitando a {MAX_CHARS}")
-            text = text[:MAX_CHARS] + "..."
-        
-        # TTS: usar preferencia persistente, ElevenLabs por defecto
-        audio = None
-        tts_engine_used = None
-        primary = get_tts_primary()
-        engines = []
-        if primary == 'elevenlabs':
-            engines = ['elevenlabs', 'google']
-        elif primary == 'google':
-            engines = ['google', 'elevenlabs']
-        else:
-            engines = ['elevenlabs', 'google']
+        return int(request.args.get('limit') or default)
+    except (TypeError, ValueError):
+        return default
 
-        last_err = None
-        for eng in engines:
-            if eng == 'elevenlabs':
-                    try:
-                        audio = generate_audio_with_elevenlabs(text, voice_id=voice_id)
-                        tts_engine_used = 'ElevenLabs'
-                        print("✅ Audio generado con ElevenLabs")
-                        break
-                    except Exception as e:
-                        print(f"⚠️  ElevenLabs falló: {e}")
-                        last_err = e
-            elif eng == 'google':
-                if GOOGLE_TTS_AVAILABLE:
-                    try:
-                        audio = generate_audio_with_google_tts(text, language_code='es-ES')
-                        tts_engine_used = 'Google Cloud TTS'
-                        print("✅ Audio generado con Google Cloud TTS")
-                        break
-                    except Exception as e:
-                        print(f"⚠️  Google TTS falló: {e}")
-                        last_err = e
-                else:
-                    print("ℹ️  Google TTS no disponible; saltando…")
 
-        if audio is None:
-            os.remove(filepath)
-            return jsonify({'error': f'No se pudo generar audio (último error: {last_err})'}), 500
-        
-        # Guardar audio
-        audio_filename = f"audio_{int(time.time())}.mp3"
-        audio_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename)
-        print(f"💾 Guardando audio en: {audio_path}")
-        
-        with open(audio_path, 'wb') as f:
-            f.write(audio)
-        
-        file_size = os.path.getsize(audio_path)
-        print(f"✅ Audio guardado: {audio_filename} ({file_size} bytes)")
-        print(f"🎙️  Motor TTS utilizado: {tts_engine_used}")
+@app.route('/api/listening/recent', methods=['GET'])
+def api_listening_recent():
+    """Libros escuchados recientemente por el usuario. ?hours=24 limita la ventana."""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'No autenticado'}), 401
+    try:
+        hours = request.args.get('hours')
+        since = datetime.utcnow() - timedelta(hours=float(hours)) if hours else None
+        libros = LISTENING.recent(session['usuario_id'], since=since, limit=_listening_limit())
+        return jsonify({'libros': [_serialize_listing_book(b) for b in libros]})
+    except ValueError:
+        return jsonify({'error': 'hours inválido'}), 400
+    except Exception as e:
+        print(f"❌ ERROR listening/recent: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        # Calcular duración del audio generado (siempre) para sincronización
-        try:
-            audio_mp3 = MP3(audio_path)
-            duration_seconds = int(audio_mp3.info.length)
-            print(f"⏱️  Duración del audio generado: {duration_seconds}s")
-        except Exception as e:
-            print(f"⚠️  No se pudo calcular la duración del audio generado: {e}")
-            duration_seconds = 0
-        
-        # Limpiar archivo subido
-        os.remove(filepath)
-        print("🗑️  Archivo temporal eliminado")
-        
-        audio_url = f'/audio_files/{audio_filename}'
-        print(f"✅ Conversión completada. URL: {audio_url}")
-        # Actualizar diagnóstico
-        try:
-            LAST_TTS_STATUS['engine'] = tts_engine_used
-            # Normalizar comparación de motor primario vs usado
-            primary_norm = engines[0]
-            used_norm = 'elevenlabs' if tts_engine_used == 'ElevenLabs' else ('google' if tts_engine_used == 'Google Cloud TTS' else None)
-            LAST_TTS_STATUS['fallback_reason'] = None if (used_norm == primary_norm) else (str(last_err) if last_err else 'fallback')
-            LAST_TTS_STATUS['timestamp'] = int(time.time())
-        except Exception:
-            pass
-        
-        # ¿Guardar automáticamente en biblioteca?
-        save_to_library = request.form.get('saveToLibrary') in ['true', 'True', '1', 'on', 'yes']
-        saved_doc_id = None
-        if save_to_library:
-            print("📚 Opción 'Guardar en Biblioteca' activada")
-            title = request.form.get('title', '').strip()
-            subtitle = request.form.get('subtitle', '').strip()
-            category = request.form.get('category', '').strip()
-            level = request.form.get('level', '').strip()
-            save_as_chapter = request.form.get('saveAsChapter') in ['true','True','1','on','yes']
-            parent_book_id = (request.form.get('parentBookId') or '').strip()
-            chapter_title = (request.form.get('chapterTitle') or '').strip()
-
-            # Validación mínima cuando se desea guardar
-            if not save_as_chapter:
-                if not all([title, subtitle, category, level]):
-                    print("❌ Datos incompletos para guardar en biblioteca")
-                    return jsonify({'error': 'Faltan campos para guardar en biblioteca (título, descripción, categoría, nivel).', 'audio_url': audio_url}), 400
-            else:
-                # Guardar como capítulo de libro existente
-                if not parent_book_id:
-                    return jsonify({'error': 'Debes seleccionar el libro al que pertenece el capítulo.', 'audio_url': audio_url}), 400
-                parent_doc = None
-                try:
-                    parent_doc = libros_collection.find_one({'_id': ObjectId(parent_book_id)}) if libros_collection is not None else None
-                except Exception:
-                    parent_doc = None
-                if not parent_doc:
-                    return jsonify({'error': 'Libro padre no encontrado.', 'audio_url': audio_url}), 404
-                # Heredar categoría/nivel si no se proporcionan
-                if not category:
-                    category = parent_doc.get('category', '')
-                if not level:
-                    level = parent_doc.get('level', '')
-                # Título por defecto si no viene
-                if not title:
-                    # Construir: "<Título padre> — Capítulo <ROMAN>" (+ opcional subtítulo con chapter_title)
-                    # Número se calculará más abajo, placeholder temporal
-                    title = parent_doc.get('title', 'Libro')
-
-            # Formatear duración reutilizando duration_seconds ya calculado
-            if duration_seconds > 0:
-                if duration_seconds < 60:
-                    duration = f"{duration_seconds} seg"
-                elif duration_seconds < 3600:
-                    minutes = duration_seconds // 60
-                    seconds = duration_seconds % 60
-                    duration = f"{minutes} min {seconds} seg" if seconds > 0 else f"{minutes} min"
-                else:
-                    hours = duration_seconds // 3600
-                    minutes = (duration_seconds % 3600) // 60
-                    duration = f"{hours}h {minutes}min" if minutes > 0 else f"{hours}h"
-            else:
-                duration = "Duración no disponible"
 
-            # Etiquetas
-            category_labels = {
-                'historia': 'Historia', 'cuentos': 'Cuentos', 'novelas': 'Novelas', 'aprendizaje': 'Aprendizaje',
-                'biologia': 'Biología', 'ciencia': 'Ciencia', 'tecnologia': 'Tecnología', 'arte': 'Arte', 'noticias': 'Noticias'
-            }
-            level_labels = { 'facil': 'Fácil', 'medio': 'Medio', 'alta': 'Alta' }
-
-            # Documento
-            libro_data = {
-                'title': title,
-                'subtitle': subtitle,
-                'category': category,
-                'categoryLabel': category_labels.get(category, category.title()) if isinstance(category, str) else str(category),
-                'level': level,
-                'levelLabel': level_labels.get(level, level.title()) if isinstance(level, str) else str(level),
-                'duration': duration,
-                'duration_seconds': duration_seconds,
-                'audio_filename': audio_filename,
-                'audio_url': audio_url,
-                'voice_id': voice_id,
-                'tts_engine': tts_engine_used,
-                # Guardar el texto que realmente se usó para el TTS (posiblemente truncado)
-                'text': text,
-                'summary': ai_summary,
-                'uploaded_by': session.get('usuario_id'),
-                'uploaded_at': int(time.time()),
-                'created_at': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
+@app.route('/api/listening/continue', methods=['GET'])
+def api_listening_continue():
+    """Libros empezados y sin terminar, del más reciente al más antiguo."""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'No autenticado'}), 401
+    try:
+        libros = LISTENING.continue_listening(session['usuario_id'], limit=_listening_limit(10))
+        return jsonify({'libros': [_serialize_listing_book(b) for b in libros]})
+    except Exception as e:
+        print(f"❌ ERROR listening/continue: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/listening/<book_id>', methods=['GET'])
+def api_listening_position(book_id):
+    """Posición de reanudación del usuario en un libro."""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'No autenticado'}), 401
+    try:
+        state = LISTENING.position(session['usuario_id'], book_id) or {}
+        return jsonify({
+            'book_id': book_id,
+            'position_sec': state.get('position_sec') or 0,
+            'duration_sec': state.get('duration_sec'),
+            'progress': state.get('progress') or 0,
+            'completed': bool(state.get('completed_at')) and not state.get('in_progress'),
+            'last_played_at': state.get('last_played_at'),
+        })
+    except Exception as e:
+        print(f"❌ ERROR listening/position: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+class ConversionError(Exception):
+    """Error de la conversión con código HTTP y cuerpo JSON para el cliente."""
 
-            # Portada: si es libro raíz, generar una portada local; si es capítulo, heredar del padre
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.payload = {'error': message, **extra}
+
+
+def _is_truthy(value) -> bool:
+    return str(value) in ['true', 'True', '1', 'on', 'yes']
+
+
+def _conversion_hooks(filepath, on_stage=None, remove_source=True):
+    """Devuelve (stage, cleanup): reporte de etapa tolerante a fallos y borrado del archivo fuente."""
+    def stage(name):
+        if on_stage is not None:
             try:
-                cover_url = None
-                if save_as_chapter:
-                    if parent_doc:
-                        cover_url = parent_doc.get('cover_image_url')
-                else:
-                    # Generar portada simple basada en categoría/título
-                    cov_bytes = generate_cover_image_bytes(
-                        category=libro_data.get('categoryLabel') or libro_data.get('category'),
-                        title=libro_data.get('title'),
-                        subtitle=libro_data.get('subtitle') or libro_data.get('summary')
-                    )
-                    if cov_bytes:
-                        cname = f"cover_{int(time.time())}.jpg"
-                        cpath = os.path.join(app.config['COVERS_FOLDER'], cname)
-                        with open(cpath, 'wb') as cf:
-                            cf.write(cov_bytes)
-                        cover_url = f"/static/covers/{cname}"
-                if cover_url:
-                    libro_data['cover_image_url'] = cover_url
-            except Exception as ce:
-                print(f"⚠️  No se pudo generar/asignar portada: {ce}")
+                on_stage(name)
+            except Exception:
+                pass
 
-            # Si es capítulo, calcular numeración y completar campos
-            if save_as_chapter:
+    def cleanup():
+        if remove_source:
+            try:
+                os.remove(filepath)
+            except Exception:
+                pass
+    return stage, cleanup
+
+
+def _extract_conversion_text(filepath, stage, cleanup):
+    """Extrae y normaliza el texto del archivo fuente, guardándolo en `texts`.
+    Devuelve (text_id, texto) o lanza ConversionError si está vacío.
+    """
+    stage('extracting')
+    print("📖 Extrayendo texto del archivo...")
+    text_id, text = TEXTS.put_pages(iter_text_pages(filepath))
+    print(f"✅ Texto extraído: {len(text)} caracteres")
+    print(f"📝 Primeros 100 caracteres: {text[:100]}...")
+
+    if not text or len(text.strip()) == 0:
+        print("❌ No se pudo extraer texto del archivo")
+        cleanup()
+        raise ConversionError('No se pudo extraer texto del archivo o está vacío', 400)
+    return text_id, text
+
+
+def run_conversion(filepath, options, user_id=None, on_stage=None, remove_source=True, source=None):
+    """Pipeline de conversión texto→audio compartido por /upload y el worker de jobs.
+    - filepath: archivo subido ya guardado en disco
+    - options: dict con los campos del formulario (voice, saveToLibrary, title, ...)
+    - on_stage: callback opcional stage -> None para reportar avance
+    - source: {'sha256', 'size', 'filename'} del archivo; si el contenido ya se
+      procesó antes se reutilizan su texto y audio (misma voz/modelo)
+    Devuelve el dict de respuesta de /upload o lanza ConversionError.
+    """
+    options = options or {}
+    stage, cleanup = _conversion_hooks(filepath, on_stage, remove_source)
+    known = SOURCE_FILES.touch(source)
+    text_id = (known or {}).get('text_id')
+    text = TEXTS.get(text_id)
+    if text:
+        stage('extracting')
+        print(f"♻️  Archivo ya conocido (sha256 {source['sha256'][:12]}…): se reutiliza el texto extraído")
+    else:
+        text_id, text = _extract_conversion_text(filepath, stage, cleanup)
+    # El resumen y demás análisis IA no retrasan la conversión: los calcula el
+    # trabajo 'enrich' después de guardar el libro (ver _schedule_enrichment)
+    if source:
+        SOURCE_FILES.record_text(source['sha256'], text_id)
+
+    # Obtener la voz seleccionada
+    voice_id = options.get('voice') or 'rpqlUOplj0Q0PIilat8h'
+    print(f"🎤 Voz seleccionada: {voice_id}")
+
+    # TTS: preferencia persistente (ElevenLabs por defecto), reordenada por el router
+    # según salud (circuit breakers) y latencia observada de cada motor
+    stage('synthesizing')
+    audio = None
+    tts_engine_used = None
+    primary = get_tts_primary()
+    if primary not in ('elevenlabs', 'google'):
+        primary = 'elevenlabs'
+    engines = TTS_ROUTER.order(primary, ['elevenlabs', 'google'])
+    if engines[0] != primary:
+        print(f"🧭 Router TTS: {primary} → {engines[0]} (salud/latencia)")
+
+    last_err = None
+    synthesized_with = None
+    for eng in engines:
+        reuse = SOURCE_FILES.find_audio(known, eng, *_tts_voice_and_model(eng, voice_id),
+                                        audio_folder=app.config['AUDIO_FOLDER'])
+        if reuse:
+            try:
+                with open(reuse['path'], 'rb') as fh:
+                    audio = fh.read()
+                tts_engine_used = reuse.get('tts_engine')
+                print(f"♻️  Audio reutilizado de {reuse['audio_filename']} ({tts_engine_used})")
+                break
+            except OSError:
+                audio = None
+        if eng == 'elevenlabs':
                 try:
-                    existing = 0
-                    if libros_collection is not None:
-                        or_conds = []
-                        try:
-                            or_conds.append({'parent_id': ObjectId(parent_book_id)})
-                        except Exception:
-                            pass
-                        or_conds.append({'parent_id': parent_book_id})
-                        existing = libros_collection.count_documents({'$or': or_conds})
-                    chap_num = int(existing) + 1
-                except Exception:
-                    chap_num = 1
-                chap_roman = _to_roman(chap_num)
-                # Ajustar título si es placeholder
-                if parent_doc and (title == parent_doc.get('title') or not title):
-                    base = parent_doc.get('title', 'Libro')
-                    if chapter_title:
-                        libro_data['title'] = f"{base} — Capítulo {chap_roman}: {chapter_title}"
-                    else:
-                        libro_data['title'] = f"{base} — Capítulo {chap_roman}"
-                libro_data.update({
-                    'is_chapter': True,
-                    'parent_id': ObjectId(parent_book_id),
-                    'chapter_number': chap_num,
-                    'chapter_roman': chap_roman,
-                    'chapter_title': chapter_title or None,
-                })
-
-            if libros_collection is not None:
+                    audio = synthesize_long_text(text, 'elevenlabs', voice_id=voice_id)
+                    tts_engine_used = 'ElevenLabs'
+                    synthesized_with = eng
+                    print("✅ Audio generado con ElevenLabs")
+                    break
+                except Exception as e:
+                    print(f"⚠️  ElevenLabs falló: {e}")
+                    last_err = e
+        elif eng == 'google':
+            if GOOGLE_TTS_AVAILABLE:
                 try:
-                    result = libros_collection.insert_one(libro_data)
-                    saved_doc_id = str(result.inserted_id)
-                    print(f"✅ Libro guardado automáticamente en biblioteca con ID: {saved_doc_id}")
+                    audio = synthesize_long_text(text, 'google')
+                    tts_engine_used = 'Google Cloud TTS'
+                    synthesized_with = eng
+                    print("✅ Audio generado con Google Cloud TTS")
+                    break
                 except Exception as e:
-                    print(f"❌ Error al guardar automáticamente en biblioteca: {e}")
+                    print(f"⚠️  Google TTS falló: {e}")
+                    last_err = e
+            else:
+                print("ℹ️  Google TTS no disponible; saltando…")
+
+    if audio is None:
+        cleanup()
+        raise ConversionError(f'No se pudo generar audio (último error: {last_err})', 500)
+
+    # Normalizar comparación de motor primario vs usado para el diagnóstico
+    used_norm = 'elevenlabs' if tts_engine_used == 'ElevenLabs' else ('google' if tts_engine_used == 'Google Cloud TTS' else None)
+    fallback_reason = None if (used_norm == primary) else (str(last_err) if last_err else 'router')
+    result = finish_conversion(audio, text, options, user_id, voice_id, tts_engine_used,
+                               fallback_reason, stage, cleanup, text_id=text_id)
+    if source and synthesized_with:
+        SOURCE_FILES.record_audio(source['sha256'], synthesized_with, *_tts_voice_and_model(synthesized_with, voice_id),
+                                  audio_filename=result['audio_url'].rsplit('/', 1)[-1], tts_engine_label=tts_engine_used)
+    return result
+
+
+def _new_audio_filename():
+    # Sufijo aleatorio: varias conversiones concurrentes pueden terminar en el mismo segundo
+    return f"audio_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp3"
+
+
+def finish_conversion(audio, text, options, user_id, voice_id, tts_engine_used,
+                      fallback_reason, stage, cleanup, audio_filename=None, text_id=None):
+    """Etapas finales comunes: guardar MP3, duración, diagnóstico y alta en biblioteca."""
+    # Guardar audio
+    stage('saving_audio')
+    audio_filename = audio_filename or _new_audio_filename()
+    audio_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename)
+    print(f"💾 Guardando audio en: {audio_path}")
+
+    with open(audio_path, 'wb') as f:
+        f.write(audio)
+
+    file_size = os.path.getsize(audio_path)
+    print(f"✅ Audio guardado: {audio_filename} ({file_size} bytes)")
+    print(f"🎙️  Motor TTS utilizado: {tts_engine_used}")
+
+    # Calcular duración del audio generado (siempre) para sincronización
+    stage('probing_duration')
+    try:
+        audio_mp3 = MP3(audio_path)
+        duration_seconds = int(audio_mp3.info.length)
+        print(f"⏱️  Duración del audio generado: {duration_seconds}s")
+    except Exception as e:
+        print(f"⚠️  No se pudo calcular la duración del audio generado: {e}")
+        duration_seconds = 0
+
+    # Limpiar archivo subido
+    cleanup()
+    print("🗑️  Archivo temporal eliminado")
+
+    audio_url = f'/audio_files/{audio_filename}'
+    print(f"✅ Conversión completada. URL: {audio_url}")
+    # Actualizar diagnóstico
+    TTS_ROUTER.note_result(tts_engine_used, fallback_reason)
+
+    # ¿Guardar automáticamente en biblioteca?
+    save_to_library = _is_truthy(options.get('saveToLibrary'))
+    saved_doc_id = None
+    if save_to_library:
+        stage('saving_library')
+        print("📚 Opción 'Guardar en Biblioteca' activada")
+        title = (options.get('title') or '').strip()
+        subtitle = (options.get('subtitle') or '').strip()
+        category = (options.get('category') or '').strip()
+        level = (options.get('level') or '').strip()
+        save_as_chapter = _is_truthy(options.get('saveAsChapter'))
+        parent_book_id = (options.get('parentBookId') or '').strip()
+        chapter_title = (options.get('chapterTitle') or '').strip()
+
+        # Validación mínima cuando se desea guardar
+        if not save_as_chapter:
+            if not all([title, subtitle, category, level]):
+                print("❌ Datos incompletos para guardar en biblioteca")
+                raise ConversionError('Faltan campos para guardar en biblioteca (título, descripción, categoría, nivel).', 400, audio_url=audio_url)
+        else:
+            # Guardar como capítulo de libro existente
+            if not parent_book_id:
+                raise ConversionError('Debes seleccionar el libro al que pertenece el capítulo.', 400, audio_url=audio_url)
+            parent_doc = _resolve_book(parent_book_id, CATALOG_PROJECTION)
+            if not parent_doc:
+                raise ConversionError('Libro padre no encontrado.', 404, audio_url=audio_url)
+            # Heredar categoría/nivel si no se proporcionan
+            if not category:
+                category = parent_doc.get('category', '')
+            if not level:
+                level = parent_doc.get('level', '')
+            # Título por defecto si no viene
+            if not title:
+                # Construir: "<Título padre> — Capítulo <ROMAN>" (+ opcional subtítulo con chapter_title)
+                # Número se calculará más abajo, placeholder temporal
+                title = parent_doc.get('title', 'Libro')
+
+        # Formatear duración reutilizando duration_seconds ya calculado
+        if duration_seconds > 0:
+            if duration_seconds < 60:
+                duration = f"{duration_seconds} seg"
+            elif duration_seconds < 3600:
+                minutes = duration_seconds // 60
+                seconds = duration_seconds % 60
+                duration = f"{minutes} min {seconds} seg" if seconds > 0 else f"{minutes} min"
             else:
-                print("❌ No hay conexión a la base de datos para guardar el libro")
+                hours = duration_seconds // 3600
+                minutes = (duration_seconds % 3600) // 60
+                duration = f"{hours}h {minutes}min" if minutes > 0 else f"{hours}h"
+        else:
+            duration = "Duración no disponible"
 
-        return jsonify({
-            'success': True,
+        # Etiquetas
+        category_labels = {
+            'historia': 'Historia', 'cuentos': 'Cuentos', 'novelas': 'Novelas', 'aprendizaje': 'Aprendizaje',
+            'biologia': 'Biología', 'ciencia': 'Ciencia', 'tecnologia': 'Tecnología', 'arte': 'Arte', 'noticias': 'Noticias'
+        }
+        level_labels = { 'facil': 'Fácil', 'medio': 'Medio', 'alta': 'Alta' }
+
+        # Documento
+        libro_data = {
+            'title': title,
+            'subtitle': subtitle,
+            'category': category,
+            'categoryLabel': category_labels.get(category, category.title()) if isinstance(category, str) else str(category),
+            'level': level,
+            'levelLabel': level_labels.get(level, level.title()) if isinstance(level, str) else str(level),
+            'duration': duration,
+            'duration_seconds': duration_seconds,
+            'audio_filename': audio_filename,
             'audio_url': audio_url,
-            'message': f'Conversión exitosa con {tts_engine_used}',
+            'voice_id': voice_id,
             'tts_engine': tts_engine_used,
-            'audio_size': file_size,
-            'text_length': len(text),
-            # Devolver el texto utilizado para permitir sincronización en el reproductor sin necesidad de guardar
-            'text': text,
-            'summary': ai_summary,
-            'duration_seconds': duration_seconds,
-            'saved_to_library': bool(saved_doc_id),
-            'libro_id': saved_doc_id
-        })
-    
+            # Texto completo narrado: vive en `texts`; inline solo si no se pudo guardar allí
+            'text_id': text_id,
+            'text': None if text_id else text,
+            'uploaded_by': user_id,
+            'uploaded_at': int(time.time()),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+        # Portada: si es libro raíz, generar una portada local; si es capítulo, heredar del padre
+        stage('generating_cover')
+        try:
+            cover_url = None
+            if save_as_chapter:
+                if parent_doc:
+                    cover_url = parent_doc.get('cover_image_url')
+            else:
+                # Generar portada simple basada en categoría/título
+                cov_bytes = generate_cover_image_bytes(
+                    category=libro_data.get('categoryLabel') or libro_data.get('category'),
+                    title=libro_data.get('title'),
+                    subtitle=libro_data.get('subtitle')
+                )
+                if cov_bytes:
+                    cname = f"cover_{int(time.time())}.jpg"
+                    cpath = os.path.join(app.config['COVERS_FOLDER'], cname)
+                    with open(cpath, 'wb') as cf:
+                        cf.write(cov_bytes)
+                    cover_url = f"/static/covers/{cname}"
+            if cover_url:
+                libro_data['cover_image_url'] = cover_url
+        except Exception as ce:
+            print(f"⚠️  No se pudo generar/asignar portada: {ce}")
+
+        # Si es capítulo, calcular numeración y completar campos
+        if save_as_chapter:
+            try:
+                existing = 0
+                if libros_collection is not None:
+                    existing = libros_collection.count_documents(BOOKS.id_filter(parent_book_id, 'parent_id'))
+                chap_num = int(existing) + 1
+            except Exception:
+                chap_num = 1
+            chap_roman = _to_roman(chap_num)
+            # Ajustar título si es placeholder
+            if parent_doc and (title == parent_doc.get('title') or not title):
+                base = parent_doc.get('title', 'Libro')
+                if chapter_title:
+                    libro_data['title'] = f"{base} — Capítulo {chap_roman}: {chapter_title}"
+                else:
+                    libro_data['title'] = f"{base} — Capítulo {chap_roman}"
+            libro_data.update({
+                'is_chapter': True,
+                'parent_id': parent_doc['_id'] if parent_doc else canonical_id(parent_book_id),
+                'chapter_number': chap_num,
+                'chapter_roman': chap_roman,
+                'chapter_title': chapter_title or None,
+            })
+
+        stage('saving_library')
+        if libros_collection is not None:
+            try:
+                result = libros_collection.insert_one(libro_data)
+                saved_doc_id = str(result.inserted_id)
+                _library_changed(result.inserted_id)
+                _schedule_enrichment(result.inserted_id, user_id)
+                print(f"✅ Libro guardado automáticamente en biblioteca con ID: {saved_doc_id}")
+            except Exception as e:
+                print(f"❌ Error al guardar automáticamente en biblioteca: {e}")
+        else:
+            print("❌ No hay conexión a la base de datos para guardar el libro")
+
+    return {
+        'success': True,
+        'audio_url': audio_url,
+        'message': f'Conversión exitosa con {tts_engine_used}',
+        'tts_engine': tts_engine_used,
+        'audio_size': file_size,
+        'text_length': len(text),
+        # Devolver el texto utilizado para permitir sincronización en el reproductor sin necesidad de guardar
+        'text': text,
+        'duration_seconds': duration_seconds,
+        'saved_to_library': bool(saved_doc_id),
+        'libro_id': saved_doc_id
+    }
+
+
+def _save_uploaded_file():
+    """Valida el archivo de `request.files['file']`, ya escrito en uploads/ con nombre único.
+    Devuelve (filepath, source, None) o (None, None, (respuesta_json, status));
+    `source` = {'sha256', 'size', 'filename'} del contenido subido.
+    """
+    print("📁 Verificando archivo...")
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        print("❌ Archivo demasiado grande")
+        return None, None, (jsonify({'error': f'El archivo supera el máximo de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413)
+    if 'file' not in files:
+        print("❌ No se encontró ningún archivo en la solicitud")
+        return None, None, (jsonify({'error': 'No se encontró ningún archivo'}), 400)
+
+    file = request.files['file']
+    print(f"📄 Archivo recibido: {file.filename}")
+
+    if file.filename == '':
+        print("❌ El nombre del archivo está vacío")
+        return None, None, (jsonify({'error': 'No se seleccionó ningún archivo'}), 400)
+
+    if not allowed_file(file.filename):
+        print(f"❌ Tipo de archivo no permitido: {file.filename}")
+        return None, None, (jsonify({'error': 'Tipo de archivo no permitido. Usa: .txt, .pdf, .docx, .brf'}), 400)
+
+    spool = spooled_upload(file)
+    if spool is None:
+        # Archivo en memoria (petición sin IngestRequest): guardarlo sin deduplicación
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(file.filename)}")
+        file.save(filepath)
+        print(f"✅ Archivo guardado: {filepath}")
+        return filepath, None, None
+    filepath = spool.claim()
+    source = {'sha256': spool.sha256, 'size': spool.size, 'filename': file.filename}
+    print(f"✅ Archivo guardado: {filepath} ({spool.size} bytes, sha256 {spool.sha256[:12]}…)")
+    return filepath, source, None
+
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    print("\n🎵 UPLOAD - Solicitud de conversión de texto a audio")
+    try:
+        filepath, source, err = _save_uploaded_file()
+        if err:
+            return err
+        result = run_conversion(filepath, request.form.to_dict(), user_id=session.get('usuario_id'), source=source)
+        return jsonify(result)
+    except ConversionError as ce:
+        return jsonify(ce.payload), ce.status
     except Exception as e:
         print(f"❌ ERROR en upload: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Error al procesar el archivo: {str(e)}'}), 500
 
+
+def handle_convert_job(job, stage_cb):
+    """Handler del worker para trabajos 'convert' (ver worker.py)."""
+    payload = job.get('payload') or {}
+    filepath = payload.get('filepath')
+    last_attempt = int(job.get('attempts') or 0) >= int(job.get('max_attempts') or 1)
+    if not filepath or not os.path.isfile(filepath):
+        raise JobPermanentError('El archivo subido ya no está disponible')
+    try:
+        result = run_conversion(filepath, payload.get('options') or {}, user_id=job.get('user_id'),
+                                on_stage=stage_cb, remove_source=False, source=payload.get('source'))
+    except ConversionError as ce:
+        _remove_quietly(filepath)
+        raise JobPermanentError(ce.payload.get('error') or str(ce))
+    except Exception:
+        if last_attempt:
+            _remove_quietly(filepath)
+        raise
+    _remove_quietly(filepath)
+    return result
+
+
+def _remove_quietly(path):
+    try:
+        if path and os.path.isfile(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+@app.route('/api/jobs/convert', methods=['POST'])
+def api_jobs_convert():
+    """Encola una conversión y responde de inmediato con el id del trabajo.
+    Acepta los mismos campos multipart que /upload.
+    """
+    if jobs_collection is None:
+        return jsonify({'error': 'No hay conexión a la base de datos'}), 503
+    try:
+        filepath, source, err = _save_uploaded_file()
+        if err:
+            return err
+        # stream=true: el navegador reclamará el trabajo en /api/tts/stream/<job>;
+        # si no lo hace en STREAM_CLAIM_SECONDS, un worker lo procesa normalmente.
+        streaming = _is_truthy(request.form.get('stream'))
+        job_id = enqueue_job(jobs_collection, 'stream' if streaming else 'convert', {
+            'filepath': filepath,
+            'source': source,
+            'options': request.form.to_dict(),
+        }, user_id=session.get('usuario_id'), delay_seconds=STREAM_CLAIM_SECONDS if streaming else 0)
+        print(f"📬 Trabajo de conversión encolado: {job_id}")
+        body = {'job_id': job_id, 'status': JOB_QUEUED, 'status_url': url_for('api_job_status', job_id=job_id)}
+        if streaming:
+            body['stream_url'] = url_for('api_tts_stream', job_id=job_id)
+        return jsonify(body), 202
+    except Exception as e:
+        print(f"❌ ERROR al encolar conversión: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+STREAM_CLAIM_SECONDS = int(os.environ.get('STREAM_CLAIM_SECONDS', '30'))
+
+
+@app.route('/api/tts/stream/<job_id>')
+def api_tts_stream(job_id):
+    """Reproduce un trabajo 'stream' mientras se sintetiza.
+    Los bytes MP3 de ElevenLabs se envían al navegador según llegan y se copian
+    a disco; al terminar se arma la copia de biblioteca con el pipeline normal.
+    """
+    if jobs_collection is None:
+        return jsonify({'error': 'No hay conexión a la base de datos'}), 503
+    existing = get_job(jobs_collection, job_id)
+    if not existing:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if existing.get('user_id') and existing.get('user_id') != session.get('usuario_id'):
+        return jsonify({'error': 'No tienes permisos para ver este trabajo'}), 403
+    if not TTS_ROUTER.is_healthy('elevenlabs'):
+        # Circuito abierto: no hay streaming; un worker lo resuelve con fallback a Google
+        jobs_collection.update_one({'_id': existing['_id'], 'status': JOB_QUEUED},
+                                   {'$set': {'available_at': datetime.utcnow()}})
+        return jsonify({'error': 'Streaming no disponible; el trabajo se procesará en segundo plano',
+                        'status_url': f"/api/jobs/{job_id}"}), 503
+    stream_worker = f"web:{default_worker_id()}"
+    job = lease_job(jobs_collection, stream_worker, kinds=['stream'], job_id=job_id)
+    if job is None:
+        existing = get_job(jobs_collection, job_id) or existing
+        audio_url = (existing.get('result') or {}).get('audio_url')
+        if existing.get('status') == JOB_DONE and audio_url:
+            return redirect(audio_url)
+        return jsonify({'error': 'El trabajo ya está en proceso', 'status': existing.get('status')}), 409
+
+    payload = job.get('payload') or {}
+    options = payload.get('options') or {}
+    filepath = payload.get('filepath')
+    user_id = job.get('user_id')
+
+    def stage_cb(name):
+        set_stage(jobs_collection, job['_id'], name, worker_id=stream_worker)
+
+    stage, cleanup = _conversion_hooks(filepath, stage_cb, remove_source=True)
+    voice_id = options.get('voice') or 'rpqlUOplj0Q0PIilat8h'
+    voice, model = _tts_voice_and_model('elevenlabs', voice_id)
+    max_len, measure = _tts_chunk_limit('elevenlabs')
+
+    # El texto se extrae por páginas y se fragmenta sobre la marcha: el primer
+    # fragmento suena antes de que termine la extracción de un PDF largo
+    pages = []
+    source = payload.get('source')
+    known = SOURCE_FILES.touch(source)
+    known_text = TEXTS.get((known or {}).get('text_id'))
+
+    def collect_pages():
+        # Contenido ya conocido: su texto extraído evita releer el archivo
+        for page_text in ([known_text] if known_text else iter_text_pages(filepath)):
+            page_text = normalize_text(page_text)
+            pages.append(page_text)
+            yield page_text
+
+    stage('extracting')
+    chunk_iter = iter_split_text_for_tts(collect_pages(), max_len=max_len, measure=measure)
+    try:
+        first_chunk = next(chunk_iter, None)
+    except Exception as e:
+        fail_job(jobs_collection, job['_id'], e, retry=True)
+        return jsonify({'error': str(e)}), 500
+    if first_chunk is None:
+        cleanup()
+        error = 'No se pudo extraer texto del archivo o está vacío'
+        fail_job(jobs_collection, job['_id'], error, retry=False)
+        return jsonify({'error': error}), 400
+
+    audio_filename = _new_audio_filename()
+    part_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename + '.part')
+
+    def finalize(parts):
+        try:
+            # Solo quien conserva el lease da de alta el libro (si venció, un worker ya lo convirtió)
+            if not renew_lease(jobs_collection, job['_id'], stream_worker):
+                print(f"⚠️  Stream {job_id}: lease perdido; no se guarda en biblioteca")
+                return
+            if known_text:
+                text_id, text = known['text_id'], known_text
+            else:
+                text_id, text = TEXTS.put_pages(pages)
+            result = finish_conversion(join_mp3_parts(parts), text, options, user_id, voice_id, 'ElevenLabs',
+                                       None, stage, cleanup, audio_filename=audio_filename,
+                                       text_id=text_id)
+            if source:
+                SOURCE_FILES.record_text(source['sha256'], text_id)
+                SOURCE_FILES.record_audio(source['sha256'], 'elevenlabs', voice, model,
+                                          audio_filename=audio_filename, tts_engine_label='ElevenLabs')
+            complete_job(jobs_collection, job['_id'], result, worker_id=stream_worker)
+        except ConversionError as ce:
+            fail_job(jobs_collection, job['_id'], ce.payload.get('error'), retry=False, worker_id=stream_worker)
+        except Exception as e:
+            print(f"❌ ERROR al finalizar stream {job_id}: {e}")
+            fail_job(jobs_collection, job['_id'], e, retry=True, worker_id=stream_worker)
+        finally:
+            _remove_quietly(part_path)
+
+    def generate():
+        parts = []
+        owned = True
+        stage('synthesizing')
+        try:
+            with open(part_path, 'wb') as tee:
+                for chunk_text in itertools.chain([first_chunk], chunk_iter):
+                    # Con backpressure del cliente el stream puede durar más que el lease:
+                    # renovarlo por fragmento evita que un worker retome el trabajo
+                    if owned and not renew_lease(jobs_collection, job['_id'], stream_worker):
+                        owned = False
+                        print(f"⚠️  Stream {job_id}: lease perdido; se sigue sirviendo el audio sin guardarlo")
+                    key = make_cache_key(chunk_text, voice, model, 'elevenlabs')
+                    data = TTS_CACHE.get(key)
+                    if data:
+                        tee.write(data)
+                        yield data
+                    else:
+                        buf = bytearray()
+                        for piece in stream_audio_with_elevenlabs(chunk_text, voice_id=voice_id, model=model):
+                            buf.extend(piece)
+                            tee.write(piece)
+                            tee.flush()
+                            yield piece
+                        data = bytes(buf)
+                        TTS_CACHE.put(key, data, engine='elevenlabs', voice_id=voice, model=model, chars=len(chunk_text))
+                    parts.append(data)
+        except GeneratorExit:
+            # Cliente desconectado: el trabajo vuelve a la cola y un worker lo completa
+            print(f"ℹ️  Stream {job_id} cerrado por el cliente; se devuelve a la cola")
+            fail_job(jobs_collection, job['_id'], 'Cliente desconectado durante el streaming', retry=True,
+                     backoff_seconds=0, worker_id=stream_worker)
+            _remove_quietly(part_path)
+            raise
+        except Exception as e:
+            # p.ej. ElevenLabs caído: un worker reintentará con el pipeline completo (con fallback a Google)
+            print(f"⚠️  Streaming TTS falló para {job_id}: {e}")
+            fail_job(jobs_collection, job['_id'], e, retry=True, worker_id=stream_worker)
+            _remove_quietly(part_path)
+            return
+        if not owned:
+            _remove_quietly(part_path)
+            return
+        # La copia de biblioteca (cabecera Xing, duración, portada, Mongo) no bloquea la respuesta
+        threading.Thread(target=finalize, args=(parts,), daemon=True).start()
+
+    return Response(generate(), mimetype='audio/mpeg', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """Estado de un trabajo con historial de etapas."""
+    if jobs_collection is None:
+        return jsonify({'error': 'No hay conexión a la base de datos'}), 503
+    try:
+        job = get_job(jobs_collection, job_id)
+        if not job:
+            return jsonify({'error': 'Trabajo no encontrado'}), 404
+        owner = job.get('user_id')
+        if owner and owner != session.get('usuario_id'):
+            return jsonify({'error': 'No tienes permisos para ver este trabajo'}), 403
+        return jsonify(serialize_job(job))
+    except Exception as e:
+        print(f"❌ ERROR al consultar trabajo {job_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/audio_files/<filename>')
 def serve_audio(filename):
     """Sirve archivos de audio generados"""
@@ -1256,20 +1874,9 @@ def api_get_chapters(book_id):
     try:
         if libros_collection is None:
             return jsonify({'error': 'No hay conexión a la base de datos'}), 500
-        # Soportar parent_id como ObjectId o string
-        conds = [{ 'parent_id': book_id }]
-        try:
-            conds.append({ 'parent_id': ObjectId(book_id) })
-        except Exception:
-            pass
-        # Incluir variaciones antiguas: is_chapter como string 'True' o 1
-        q = {
-            '$and': [
-                { '$or': conds },
-                { '$or': [ { 'is_chapter': True }, { 'is_chapter': 'True' }, { 'is_chapter': 1 } ] }
-            ]
-        }
-        chapters = list(libros_collection.find(q).sort('chapter_number', 1))
+        # Sin normalizar aún: parent_id ObjectId o string e is_chapter True/'True'/1
+        q = BOOKS.chapters_filter(book_id)
+        chapters = list(libros_collection.find(q, CATALOG_PROJECTION).sort('chapter_number', 1))
         for ch in chapters:
             ch['_id'] = str(ch['_id'])
             if 'parent_id' in ch and ch['parent_id']:
@@ -1298,47 +1905,23 @@ def api_reparent_book(book_id):
         if not parent_id_in:
             return jsonify({'error': 'parentBookId es requerido'}), 400
 
-        # Resolver child por ObjectId o string
-        oid_child = None
-        try:
-            oid_child = ObjectId(book_id)
-        except Exception:
-            oid_child = None
-        q_child = {'$or': []}
-        if oid_child is not None:
-            q_child['$or'].append({'_id': oid_child})
-        q_child['$or'].append({'_id': book_id})
-        child = libros_collection.find_one(q_child)
+        child = _resolve_book(book_id, CATALOG_PROJECTION)
         if not child:
             return jsonify({'error': 'Libro a convertir no encontrado'}), 404
 
-        # Resolver parent
-        oid_parent = None
-        try:
-            oid_parent = ObjectId(parent_id_in)
-        except Exception:
-            oid_parent = None
-        q_parent = {'$or': []}
-        if oid_parent is not None:
-            q_parent['$or'].append({'_id': oid_parent})
-        q_parent['$or'].append({'_id': parent_id_in})
-        parent = libros_collection.find_one(q_parent)
+        parent = _resolve_book(parent_id_in, CATALOG_PROJECTION)
         if not parent:
             return jsonify({'error': 'Libro padre no encontrado'}), 404
 
-        # Contar capítulos existentes del padre (ambos tipos de parent_id)
-        child_or = []
-        if oid_parent is not None:
-            child_or.append({'parent_id': oid_parent})
-        child_or.append({'parent_id': parent_id_in})
-        existing = libros_collection.count_documents({'$or': child_or})
+        # Contar capítulos existentes del padre
+        existing = libros_collection.count_documents(BOOKS.id_filter(parent['_id'], 'parent_id'))
         chap_num = int(existing) + 1
         chap_roman = _to_roman(chap_num)
 
         # Preparar actualización
         update = {
             'is_chapter': True,
-            'parent_id': oid_parent if oid_parent is not None else parent_id_in,
+            'parent_id': parent['_id'],
             'chapter_number': chap_num,
             'chapter_roman': chap_roman,
         }
@@ -1370,7 +1953,8 @@ def api_reparent_book(book_id):
                 update['title'] = f"{base} — Capítulo {chap_roman}"
 
         libros_collection.update_one({'_id': child['_id']}, {'$set': update})
-        child = libros_collection.find_one({'_id': child['_id']})
+        _library_changed(child['_id'])
+        child = libros_collection.find_one({'_id': child['_id']}, CATALOG_PROJECTION)
         # Normalizar salida
         child['_id'] = str(child['_id'])
         if 'parent_id' in child and child['parent_id']:
@@ -1402,7 +1986,8 @@ def api_list_orphan_audios():
         # Recolectar nombres en DB
         referenced = set()
         try:
-            for d in libros_collection.find({}, {'audio_filename': 1}).limit(100000):
+            # Consulta cubierta por el índice audio_filename (no lee los documentos)
+            for d in libros_collection.find({'audio_filename': {'$gt': ''}}, {'audio_filename': 1, '_id': 0}).limit(100000):
                 fn = d.get('audio_filename')
                 if fn:
                     referenced.add(str(fn))
@@ -1428,14 +2013,15 @@ def api_backfill_covers():
     try:
         created = 0
         inherited = 0
-        # Traer candidatos sin portada
+        # Traer candidatos sin portada (sin texto ni análisis; el resumen solo si sigue embebido)
+        light = {k: v for k, v in CATALOG_PROJECTION.items() if k != 'summary'}
         candidates = list(libros_collection.find({
             '$or': [
                 { 'cover_image_url': { '$exists': False } },
                 { 'cover_image_url': None },
                 { 'cover_image_url': '' }
             ]
-        }).limit(5000))
+        }, light).limit(5000))
         for d in candidates:
             try:
                 is_ch = bool(d.get('is_chapter'))
@@ -1444,20 +2030,13 @@ def api_backfill_covers():
                     pid = d.get('parent_id')
                     parent = None
                     if pid is not None:
-                        # soportar ObjectId/string
-                        q = {'$or': []}
-                        try:
-                            q['$or'].append({'_id': ObjectId(str(pid))})
-                        except Exception:
-                            pass
-                        q['$or'].append({'_id': str(pid)})
-                        parent = libros_collection.find_one(q)
+                        parent = _resolve_book(pid, light)
                     if parent:
                         p_cover = parent.get('cover_image_url')
                         if not p_cover:
                             # generar para el padre primero
                             cat = parent.get('categoryLabel') or parent.get('category')
-                            cov = generate_cover_image_bytes(cat, parent.get('title'), parent.get('subtitle') or parent.get('summary'))
+                            cov = generate_cover_image_bytes(cat, parent.get('title'), parent.get('subtitle') or BOOK_DETAILS.get_field(parent, 'summary'))
                             if cov:
                                 cname = f"cover_{str(parent.get('_id'))}_{int(time.time())}.jpg"
                                 cpath = os.path.join(app.config['COVERS_FOLDER'], cname)
@@ -1471,7 +2050,7 @@ def api_backfill_covers():
                     continue
                 # libro raíz: generar
                 cat = d.get('categoryLabel') or d.get('category')
-                cov = generate_cover_image_bytes(cat, d.get('title'), d.get('subtitle') or d.get('summary'))
+                cov = generate_cover_image_bytes(cat, d.get('title'), d.get('subtitle') or BOOK_DETAILS.get_field(d, 'summary'))
                 if cov:
                     cname = f"cover_{str(d.get('_id'))}_{int(time.time())}.jpg"
                     cpath = os.path.join(app.config['COVERS_FOLDER'], cname)
@@ -1482,6 +2061,8 @@ def api_backfill_covers():
             except Exception as _e:
                 print(f"⚠️  Backfill cover error para {d.get('_id')}: {_e}")
                 continue
+        if created or inherited:
+            _library_changed()
         return jsonify({'success': True, 'created': created, 'inherited': inherited})
     except Exception as e:
         print(f"❌ ERROR backfill covers: {e}")
@@ -1516,13 +2097,112 @@ def api_tts_status():
             'eleven_api_mode': ('legacy' if ELEVEN_USE_LEGACY else ('client' if ELEVEN_AVAILABLE else None)),
             'google_available': bool(GOOGLE_TTS_AVAILABLE),
             'tts_primary': get_tts_primary(),
-            'last': LAST_TTS_STATUS,
+            'last': TTS_ROUTER.last,
+            'engines_healthy': {eng: TTS_ROUTER.is_healthy(eng) for eng in ('elevenlabs', 'google')},
+            'pooled_clients': client_registry.names(),
         }
         return jsonify(status)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/admin/tts-router', methods=['GET', 'POST'])
+def api_tts_router():
+    """Estado del router TTS por motor y subruta: ventana de latencia (p50/p95 en
+    segundos por 1000 caracteres), tasa de error y estado del circuit breaker.
+    POST {"engine": "elevenlabs"|"google"|null} reinicia los breakers.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            engine = data.get('engine')
+            if engine not in (None, 'elevenlabs', 'google'):
+                return jsonify({'error': 'engine inválido'}), 400
+            TTS_ROUTER.reset(engine)
+        snap = TTS_ROUTER.snapshot()
+        snap['tts_primary'] = get_tts_primary()
+        snap['order'] = TTS_ROUTER.order(snap['tts_primary'], ['elevenlabs', 'google'])
+        return jsonify(snap)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/playback-buffer', methods=['GET', 'POST'])
+def api_admin_playback_buffer():
+    """Estado del buffer write-behind de reproducción. POST lo vacía ahora."""
+    try:
+        if request.method == 'POST':
+            PLAYBACK_BUFFER.flush()
+        return jsonify(PLAYBACK_BUFFER.snapshot())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/search-index', methods=['GET', 'POST'])
+def api_admin_search_index():
+    """Estado de los índices de búsqueda. POST reconstruye el BM25 y pide compactar los vectores."""
+    try:
+        if request.method == 'POST':
+            SEARCH_INDEX.rebuild()
+            VECTORS.request_compaction()
+        return jsonify(dict(SEARCH_INDEX.snapshot(), vectors=VECTORS.snapshot()))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/indexes', methods=['GET'])
+def api_admin_indexes():
+    """Índices de MongoDB que faltan y plan (explain) de cada consulta caliente."""
+    if db is None:
+        return jsonify({'error': 'No hay conexión a la base de datos'}), 500
+    try:
+        missing = [f"{s.collection}.{s.name}" for s in missing_indexes(db)]
+        plans = verify_query_plans(db)
+        return jsonify({
+            'missing': missing,
+            'plans': plans,
+            'ok': not missing and all(p['ok'] is not False for p in plans),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/settings', methods=['GET', 'POST'])
+def api_admin_settings():
+    """Configuración de ejecución. POST con un subconjunto de claves la actualiza;
+    el resto de procesos la ven en a lo sumo SETTINGS_REFRESH_SECONDS.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                return jsonify(SETTINGS.update(data))
+            except ValueError as ve:
+                return jsonify({'error': str(ve)}), 400
+        return jsonify(SETTINGS.snapshot())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/tts-cache')
+def api_tts_cache_stats():
+    """Estadísticas de la caché TTS: aciertos, fallos, desalojos, entradas y bytes."""
+    try:
+        return jsonify(TTS_CACHE.stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/ai-cache')
+def api_ai_cache_stats():
+    """Aciertos/fallos de la caché de resultados de IA (proceso y global) y
+    contadores de las llamadas con cobertura (victorias por proveedor, plazos vencidos)."""
+    try:
+        return jsonify(dict(memo_stats(), providers=provider_stats()))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/admin/orphan-audios/<path:filename>/save', methods=['POST'])
 def api_save_orphan_audio(filename):
     """Guarda un archivo de audio huérfano como libro mínimo en la DB.
@@ -1595,8 +2275,6 @@ def api_save_orphan_audio(filename):
             'audio_url': audio_url,
                 'voice_id': None,
                 'tts_engine': get_tts_primary(),
-            'text': '',
-            'summary': None,
             'uploaded_by': session.get('usuario_id'),
             'uploaded_at': int(time.time()),
             'created_at': time.strftime('%Y-%m-%d %H:%M:%S')
@@ -1619,6 +2297,7 @@ def api_save_orphan_audio(filename):
             print(f"⚠️  No se pudo generar portada para huérfano: {_ce}")
 
         result = libros_collection.insert_one(libro_data)
+        _library_changed(result.inserted_id)
         return jsonify({'success': True, 'libro_id': str(result.inserted_id), 'audio_url': audio_url})
     except Exception as e:
         print(f"❌ ERROR al guardar huérfano {filename}: {e}")
@@ -1626,22 +2305,23 @@ def api_save_orphan_audio(filename):
 
 @app.route('/api/summarize/<book_id>', methods=['POST'])
 def api_summarize(book_id):
-    """Genera y guarda un resumen IA para un libro existente (si tiene texto)."""
+    """Resumen IA del libro (precalculado por el trabajo 'enrich'; 202 mientras se genera)."""
     if 'usuario_id' not in session:
         return jsonify({'error': 'No autenticado'}), 401
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = doc.get('text') or ''
-        if not text.strip():
+        enriched, pending = _book_artifacts(doc, 'summary')
+        if pending is not None:
+            return pending
+        if enriched is None:
             return jsonify({'error': 'Este libro no tiene texto almacenado para resumir'}), 400
-        summary = summarize_text(text)
+        summary = enriched.get('summary')
         if not summary:
             return jsonify({'error': 'No se pudo generar resumen (falta clave o proveedor no disponible)'}), 500
-        libros_collection.update_one({'_id': ObjectId(book_id)}, {'$set': {'summary': summary}})
         return jsonify({'success': True, 'summary': summary})
     except Exception as e:
         print(f"❌ ERROR resumen IA: {e}")
@@ -1656,32 +2336,8 @@ def api_delete_book(book_id):
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        # Resolver documento por ObjectId o por _id string (soporta datos antiguos)
-        oid = None
-        try:
-            oid = ObjectId(book_id)
-        except Exception:
-            oid = None
-        query_main = {'$or': []}
-        if oid is not None:
-            query_main['$or'].append({'_id': oid})
-        query_main['$or'].append({'_id': book_id})
-
         print(f"🗑️  DELETE solicitado para ID: {book_id}")
-        doc = libros_collection.find_one(query_main)
-        if not doc:
-            # Fallback: escanear un subconjunto y comparar str(_id)
-            try:
-                cursor = libros_collection.find({}, {'_id': 1}).sort('uploaded_at', -1).limit(2000)
-                for d in cursor:
-                    try:
-                        if str(d.get('_id')) == book_id:
-                            doc = libros_collection.find_one({'_id': d.get('_id')})
-                            break
-                    except Exception:
-                        continue
-            except Exception as scan_err:
-                print(f"⚠️  Error en fallback de escaneo: {scan_err}")
+        doc = _resolve_book(book_id, CATALOG_PROJECTION)
         if not doc:
             print("❌ Libro no encontrado para eliminar")
             return jsonify({'error': 'Libro no encontrado'}), 404
@@ -1723,15 +2379,15 @@ def api_delete_book(book_id):
         # Si es libro raíz, borrar capítulos primero (cascada)
         if not doc.get('is_chapter'):
             try:
-                # Buscar hijos por parent_id como ObjectId o string
-                child_or = []
-                if oid is not None:
-                    child_or.append({'parent_id': oid})
-                child_or.append({'parent_id': book_id})
-                children = list(libros_collection.find({'$or': child_or}))
+                children = list(libros_collection.find(BOOKS.id_filter(doc['_id'], 'parent_id'), {'_id': 1, 'audio_filename': 1}))
                 for ch in children:
                     _delete_audio_file(ch.get('audio_filename'))
                     libros_collection.delete_one({'_id': ch['_id']})
+                    BOOK_DETAILS.delete(ch['_id'])
+                    LISTENING.forget_book(ch['_id'])
+                    SEARCH_INDEX.remove(ch['_id'])
+                    VECTORS.touch(ch['_id'])
+                    BOOKS.forget(ch['_id'])
                     deleted += 1
             except Exception as ce:
                 print(f"⚠️  Error al borrar capítulos en cascada: {ce}")
@@ -1740,48 +2396,225 @@ def api_delete_book(book_id):
         _delete_audio_file(doc.get('audio_filename'))
         # Borrar principal por su _id exacto
         libros_collection.delete_one({'_id': doc['_id']})
+        BOOK_DETAILS.delete(doc['_id'])
+        LISTENING.forget_book(doc['_id'])
+        SEARCH_INDEX.remove(doc['_id'])
+        VECTORS.touch(doc['_id'])
+        BOOKS.forget(book_id, doc['_id'])
         deleted += 1
+        _library_changed()
 
         return jsonify({'success': True, 'deleted_docs': deleted, 'deleted_audio_files': audio_deleted})
     except Exception as e:
         print(f"❌ ERROR al eliminar libro: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Enriquecimiento tras guardar un libro: trabajo 'enrich' en la cola `jobs`.
+# Lo ejecuta en segundo plano un pool del propio proceso web (tomándolo por id)
+# o, si este no llega, cualquier worker.py. El estado de cada etapa queda en
+# `enrichment_stages` del libro; los endpoints devuelven lo ya calculado o 202.
+ENRICH_STAGES = ('summary', 'analysis', 'moderation', 'accessibility', 'notes', 'quiz', 'subtitles')
+_AI_STAGES = ENRICH_STAGES[:-1]  # las da una sola llamada a enrich_book
+ENRICH_INLINE_WORKERS = int(os.environ.get('ENRICH_INLINE_WORKERS', '2'))
+ENRICH_RETRY_AFTER = int(os.environ.get('ENRICH_RETRY_AFTER', '3'))
+_ENRICH_POOL = ThreadPoolExecutor(max_workers=ENRICH_INLINE_WORKERS, thread_name_prefix='enrich') \
+    if ENRICH_INLINE_WORKERS > 0 else None
+
+
+def _set_enrichment_stages(book_id, stages, status):
+    try:
+        libros_collection.update_one({'_id': book_id}, {'$set': {f'enrichment_stages.{s}': status for s in stages}})
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar el estado de enriquecimiento de {book_id}: {e}")
+
+
+def _run_enrich_inline(job_id):
+    """Toma el trabajo si sigue en cola (si no, ya lo tiene otro proceso)."""
+    try:
+        worker_id = f"web:{default_worker_id()}"
+        job = lease_job(jobs_collection, worker_id, kinds=['enrich'], job_id=job_id)
+        if job is not None:
+            process_job(jobs_collection, job, handle_enrich_job, worker_id=worker_id)
+    except Exception as e:
+        print(f"⚠️  Error en enriquecimiento {job_id}: {e}")
+
+
+def _schedule_enrichment(book_id, user_id=None):
+    """Encola el enriquecimiento de un libro y lo arranca en el pool local."""
+    if jobs_collection is None or libros_collection is None:
+        return None
+    try:
+        job_id = enqueue_job(jobs_collection, 'enrich', {'book_id': str(book_id)}, user_id=user_id)
+    except Exception as e:
+        print(f"⚠️  No se pudo encolar el enriquecimiento de {book_id}: {e}")
+        return None
+    try:
+        libros_collection.update_one({'_id': book_id}, {'$set': dict(
+            {f'enrichment_stages.{s}': 'pending' for s in ENRICH_STAGES}, enrichment_job=job_id)})
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar el estado de enriquecimiento de {book_id}: {e}")
+    if _ENRICH_POOL is not None:
+        _ENRICH_POOL.submit(_run_enrich_inline, job_id)
+    print(f"🧠 Enriquecimiento encolado para {book_id}: {job_id}")
+    return job_id
+
+
+def handle_enrich_job(job, stage_cb):
+    """Handler de trabajos 'enrich': subtítulos WebVTT y secciones IA del libro."""
+    payload = job.get('payload') or {}
+    doc = _resolve_book(payload.get('book_id'))
+    if not doc:
+        raise JobPermanentError('Libro no encontrado')
+    book_id = doc['_id']
+    text = book_text(doc).strip()
+    if not text:
+        _set_enrichment_stages(book_id, ENRICH_STAGES, 'skipped')
+        return {'book_id': str(book_id), 'skipped': True}
+    running = ('subtitles',)
+    try:
+        # Primero lo local (rápido); luego la llamada a IA
+        stage_cb('subtitles')
+        _set_enrichment_stages(book_id, running, 'running')
+        BOOK_DETAILS.set(book_id, {'subtitles': {'text_id': doc.get('text_id'), 'vtt': build_webvtt(text)}})
+        _set_enrichment_stages(book_id, running, 'done')
+        running = _AI_STAGES
+        _set_enrichment_stages(book_id, running, 'running')
+        overview, overview_fallback = None, False
+        if len(text) > ENRICH_TEXT_CHARS:
+            # Libro largo: resumen map-reduce del texto completo, no solo del comienzo.
+            # Puede durar más que el lease: se renueva por tanda de fragmentos
+            stage_cb('summarizing')
+            overview, overview_fallback = summarize_long_text(
+                text, progress=lambda: renew_lease(jobs_collection, job['_id'], job.get('worker_id')))
+        if not stage_cb('enriching'):
+            raise SummaryAborted('lease perdido antes de enriquecer')
+        result = enrich_book(text, overview=overview, overview_fallback=overview_fallback)
+        if not result:
+            raise RuntimeError('enrich_book no devolvió resultado')
+        _save_enrichment(doc, result)
+        _set_enrichment_stages(book_id, running, 'done')
+    except SummaryAborted as e:
+        # Otro worker retomó el trabajo: no tocar su estado; los nodos ya resumidos quedan en caché
+        print(f"⚠️  Enriquecimiento de {book_id} abandonado: {e}")
+        return {'book_id': str(book_id), 'aborted': True}
+    except Exception:
+        last_attempt = int(job.get('attempts') or 0) >= int(job.get('max_attempts') or 1)
+        _set_enrichment_stages(book_id, running, 'failed' if last_attempt else 'pending')
+        raise
+    return {'book_id': str(book_id), 'stages': list(ENRICH_STAGES), 'sources': result.get('sources') or {}}
+
+
+def _save_enrichment(doc, result):
+    """Guarda todas las secciones de enrich_book en book_details (y los topics en el catálogo)."""
+    sections = {k: v for k, v in result.items() if k != 'sources'}
+    meta = {'text_id': doc.get('text_id'), 'version': ENRICH_VERSION, 'sources': result.get('sources') or {},
+            'at': datetime.utcnow()}
+    BOOK_DETAILS.set(doc['_id'], dict(sections, enrichment=meta))
+    libros_collection.update_one({'_id': doc['_id']}, {
+        '$set': {'topics': topics_of(sections.get('analysis'))},
+        '$unset': {'summary': '', 'analysis': '', 'accessibility': '', 'moderation': ''},
+    })
+    # Los topics cambian listados y búsqueda: versión nueva para todos los procesos
+    _library_changed(doc['_id'])
+
+
+def _book_artifacts(doc, *fields):
+    """Secciones ya calculadas del libro: (secciones, None). Si faltan, o el texto
+    cambió desde que se generaron (otro text_id), (None, respuesta 202) y se encola
+    el enriquecimiento si no está en curso. (None, None) si el libro no tiene texto."""
+    stored = BOOK_DETAILS.get(doc, list(fields) + ['enrichment'])
+    meta = stored.get('enrichment')
+    fresh = not meta or (meta.get('text_id') == doc.get('text_id') and meta.get('version') == ENRICH_VERSION)
+    if fresh and all(f in stored for f in fields):
+        return stored, None
+    if not (doc.get('text_id') or doc.get('text')):
+        return None, None
+    stages = doc.get('enrichment_stages') or {}
+    if any(stages.get(f) in ('pending', 'running') for f in fields):
+        # Por si el proceso que lo encoló murió antes de tomarlo
+        if _ENRICH_POOL is not None and doc.get('enrichment_job'):
+            _ENRICH_POOL.submit(_run_enrich_inline, doc['enrichment_job'])
+    else:
+        _schedule_enrichment(doc['_id'], session.get('usuario_id'))
+        stages = {f: 'pending' for f in fields}
+    resp = jsonify({'status': 'pending', 'stages': {f: stages.get(f) or 'pending' for f in fields},
+                    'retry_after': ENRICH_RETRY_AFTER})
+    resp.status_code = 202
+    resp.headers['Retry-After'] = str(ENRICH_RETRY_AFTER)
+    return None, resp
+
+
 @app.route('/api/analyze/<book_id>', methods=['POST'])
 def api_analyze(book_id):
-    """Analiza y guarda metadatos IA (topics, tone, complexity, warnings, faqs)."""
+    """Metadatos IA del libro (topics, tone, complexity, warnings, faqs); 202 mientras se generan."""
     if 'usuario_id' not in session:
         return jsonify({'error': 'No autenticado'}), 401
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = doc.get('text') or ''
-        if not text.strip():
+        enriched, pending = _book_artifacts(doc, 'analysis')
+        if pending is not None:
+            return pending
+        if enriched is None:
             return jsonify({'error': 'Este libro no tiene texto almacenado para analizar'}), 400
-        analysis = analyze_content(text)
+        analysis = enriched.get('analysis')
         if not analysis:
             return jsonify({'error': 'No se pudo analizar contenido (falta clave o proveedor no disponible)'}), 500
-        libros_collection.update_one({'_id': ObjectId(book_id)}, {'$set': {'analysis': analysis}})
         return jsonify({'success': True, 'analysis': analysis})
     except Exception as e:
         print(f"❌ ERROR análisis IA: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def build_webvtt(content):
+    """WebVTT básico: bloques de ~12 palabras con duración estimada por palabras/segundo."""
+    words = content.replace('\n', ' ').split()
+    wps = 2.5  # palabras por segundo aproximado
+    # segmentar en bloques de ~12 palabras (≈ 4-5s)
+    segments = []
+    step = 12
+    for i in range(0, len(words), step):
+        seg_words = words[i:i+step]
+        if not seg_words: break
+        segments.append(' '.join(seg_words))
+    def fmt_time(ms):
+        h = ms//3600000; ms%=3600000
+        m = ms//60000; ms%=60000
+        s = ms//1000; cs = ms%1000
+        return f"{h:02d}:{m:02d}:{s:02d}.{cs:03d}"
+    cur_ms = 0
+    vtt_lines = ["WEBVTT", ""]
+    for idx, seg in enumerate(segments, start=1):
+        dur_sec = max(2.0, min(7.0, len(seg.split())/wps))
+        start = fmt_time(int(cur_ms))
+        end = fmt_time(int(cur_ms + dur_sec*1000))
+        vtt_lines.append(str(idx))
+        vtt_lines.append(f"{start} --> {end}")
+        vtt_lines.append(seg)
+        vtt_lines.append("")
+        cur_ms += int(dur_sec*1000)
+    return "\n".join(vtt_lines)
+
+
 @app.route('/api/subtitles/<book_id>')
 def api_subtitles(book_id):
-    """Genera WebVTT básico a partir del texto del libro; opcional traducción con ?lang=xx o lang=auto."""
+    """WebVTT básico a partir del texto del libro; opcional traducción con ?lang=xx o lang=auto.
+    Sin traducción se sirve el precalculado por el trabajo 'enrich' cuando existe."""
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
         target = (request.args.get('lang') or 'auto').lower()
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
+        if target == 'auto':
+            stored = BOOK_DETAILS.get_field(doc, 'subtitles') or {}
+            if stored.get('vtt') and stored.get('text_id') == doc.get('text_id'):
+                return Response(stored['vtt'], mimetype='text/vtt')
+        text = book_text(doc).strip()
         if not text:
             return jsonify({'error': 'Este libro no tiene texto almacenado para generar subtítulos'}), 400
         # detectar idioma si auto
@@ -1792,36 +2625,7 @@ def api_subtitles(book_id):
                 tr = translate_text(text, target)
                 if tr:
                     content = tr
-        # construir VTT
-        import re
-        words = content.replace('\n', ' ').split()
-        wps = 2.5  # palabras por segundo aproximado
-        # segmentar en bloques de ~12 palabras (≈ 4-5s)
-        segments = []
-        step = 12
-        for i in range(0, len(words), step):
-            seg_words = words[i:i+step]
-            if not seg_words: break
-            segments.append(' '.join(seg_words))
-        def fmt_time(ms):
-            h = ms//3600000; ms%=3600000
-            m = ms//60000; ms%=60000
-            s = ms//1000; cs = ms%1000
-            return f"{h:02d}:{m:02d}:{s:02d}.{cs:03d}"
-        cur_ms = 0
-        vtt_lines = ["WEBVTT", ""]
-        for idx, seg in enumerate(segments, start=1):
-            dur_sec = max(2.0, min(7.0, len(seg.split())/wps))
-            start = fmt_time(int(cur_ms))
-            end = fmt_time(int(cur_ms + dur_sec*1000))
-            vtt_lines.append(str(idx))
-            vtt_lines.append(f"{start} --> {end}")
-            vtt_lines.append(seg)
-            vtt_lines.append("")
-            cur_ms += int(dur_sec*1000)
-        vtt_text = "\n".join(vtt_lines)
-        from flask import Response
-        return Response(vtt_text, mimetype='text/vtt')
+        return Response(build_webvtt(content), mimetype='text/vtt')
     except Exception as e:
         print(f"❌ ERROR subtitles: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1829,18 +2633,19 @@ def api_subtitles(book_id):
 
 @app.route('/api/quiz/<book_id>')
 def api_quiz(book_id):
-    """Genera preguntas/respuestas cortas sobre el libro."""
+    """Preguntas/respuestas cortas sobre el libro (precalculadas; 202 mientras se generan)."""
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
-        if not text:
+        enriched, pending = _book_artifacts(doc, 'quiz')
+        if pending is not None:
+            return pending
+        if enriched is None:
             return jsonify({'error': 'Este libro no tiene texto almacenado para generar preguntas'}), 400
-        quiz = generate_quiz(text, n=5) or []
-        return jsonify({'quiz': quiz})
+        return jsonify({'quiz': enriched.get('quiz') or []})
     except Exception as e:
         print(f"❌ ERROR quiz: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1848,18 +2653,19 @@ def api_quiz(book_id):
 
 @app.route('/api/notes/<book_id>')
 def api_notes(book_id):
-    """Genera notas/resumen en viñetas sobre el libro."""
+    """Notas en viñetas sobre el libro (precalculadas; 202 mientras se generan)."""
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
-        if not text:
+        enriched, pending = _book_artifacts(doc, 'notes')
+        if pending is not None:
+            return pending
+        if enriched is None:
             return jsonify({'error': 'Este libro no tiene texto almacenado para generar notas'}), 400
-        notes = generate_notes(text) or []
-        return jsonify({'notes': notes})
+        return jsonify({'notes': enriched.get('notes') or []})
     except Exception as e:
         print(f"❌ ERROR notes: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1867,20 +2673,20 @@ def api_notes(book_id):
 
 @app.route('/api/accessibility/<book_id>')
 def api_accessibility(book_id):
-    """Analiza accesibilidad: complejidad, velocidad recomendada, pausas y resúmenes por secciones."""
+    """Accesibilidad: complejidad, velocidad recomendada, pausas y resúmenes por secciones
+    (precalculada; 202 mientras se genera)."""
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
-        if not text:
+        enriched, pending = _book_artifacts(doc, 'accessibility')
+        if pending is not None:
+            return pending
+        if enriched is None:
             return jsonify({'error': 'Este libro no tiene texto almacenado para analizar'}), 400
-        acc = analyze_accessibility(text)
-        if acc:
-            libros_collection.update_one({'_id': ObjectId(book_id)}, {'$set': {'accessibility': acc}})
-        return jsonify({'accessibility': acc or {}})
+        return jsonify({'accessibility': enriched.get('accessibility') or {}})
     except Exception as e:
         print(f"❌ ERROR accessibility: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1888,16 +2694,17 @@ def api_accessibility(book_id):
 
 @app.route('/api/moderate/<book_id>')
 def api_moderate(book_id):
-    """Modera el texto del libro y guarda flags."""
+    """Flags de moderación del libro (precalculados; 202 mientras se generan)."""
     if libros_collection is None:
         return jsonify({'error': 'No hay conexión a la base de datos'}), 500
     try:
-        doc = libros_collection.find_one({'_id': ObjectId(book_id)})
+        doc = _resolve_book(book_id)
         if not doc:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
-        flags = moderate_text(text or '')
-        libros_collection.update_one({'_id': ObjectId(book_id)}, {'$set': {'moderation': flags}})
+        enriched, pending = _book_artifacts(doc, 'moderation')
+        if pending is not None:
+            return pending
+        flags = (enriched or {}).get('moderation') or moderate_text('')
         return jsonify({'moderation': flags})
     except Exception as e:
         print(f"❌ ERROR moderation: {e}")
@@ -1912,7 +2719,7 @@ def api_playlists_smart():
             return jsonify({'libros': []})
         mood = (request.args.get('mood') or 'mix').lower()
         size = int(request.args.get('size') or 10)
-        all_docs = list(libros_collection.find({}).sort('uploaded_at', -1).limit(500))
+        all_docs = list(libros_collection.find({}, CATALOG_PROJECTION).sort('uploaded_at', -1).limit(500))
         def pick(cats):
             return [d for d in all_docs if (d.get('category') or '').lower() in cats]
         if mood == 'relax': sel = pick(['novelas','cuentos','arte'])
@@ -2204,38 +3011,15 @@ def _char_to_braille_bits(ch: str, in_number: bool):
         return [0], False
 
 
-def _resolve_book(book_id):
-    """Resuelve un documento de `libros_collection` tolerando:
-    - un ObjectId (hex string)
-    - un _id almacenado como string
-    - fallback escaneando documentos y comparando str(_id)
-    Retorna el documento o None si no se encuentra.
+def _resolve_book(book_id, projection=None):
+    """Documento de `libros` para un id de la URL (ObjectId hex o _id string), o None.
+    Una sola consulta indexada por _id; ver BookResolver.
     """
-    if libros_collection is None:
-        return None
-    # 1) intentar como ObjectId
-    try:
-        oid = ObjectId(book_id)
-        doc = libros_collection.find_one({'_id': oid})
-        if doc:
-            return doc
-    except Exception:
-        pass
-    # 2) intentar como string _id
     try:
-        doc = libros_collection.find_one({'_id': book_id})
-        if doc:
-            return doc
-    except Exception:
-        pass
-    # 3) fallback: escanear y comparar str(_id)
-    try:
-        for d in libros_collection.find({}):
-            if str(d.get('_id')) == str(book_id):
-                return d
-    except Exception:
+        return BOOKS.resolve(book_id, projection)
+    except Exception as e:
+        print(f"⚠️  Error resolviendo libro {book_id}: {e}")
         return None
-    return None
 
 
 def _generate_braille_pdf_response(text: str, title: str):
@@ -2322,7 +3106,7 @@ def api_braille_pdf_book(book_id):
         doc = _resolve_book(book_id)
         if doc is None:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
+        text = book_text(doc).strip()
         if not text:
             return jsonify({'error': 'Este libro no tiene texto almacenado'}), 400
         title = (doc.get('title') or 'contenido').strip()
@@ -2430,7 +3214,7 @@ def api_braille_brf_book(book_id):
         doc = _resolve_book(book_id)
         if doc is None:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
+        text = book_text(doc).strip()
         if not text:
             return jsonify({'error': 'Este libro no tiene texto almacenado'}), 400
         title = (doc.get('title') or 'contenido').strip()
@@ -2526,7 +3310,7 @@ def api_braille_stl_book(book_id):
         doc = _resolve_book(book_id)
         if doc is None:
             return jsonify({'error': 'Libro no encontrado'}), 404
-        text = (doc.get('text') or '').strip()
+        text = book_text(doc).strip()
         if not text:
             return jsonify({'error': 'Este libro no tiene texto almacenado'}), 400
         title = (doc.get('title') or 'contenido').strip()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Datos pesados de cada libro, fuera del catálogo.
+
+`libros` queda como catálogo ligero (título, categoría, audio, portada…).
+Lo pesado vive en colecciones aparte con la misma clave que el libro:
+  - texto completo → `texts` (vía text_id, ver text_store.py)
+  - summary, analysis, accessibility, moderation → `book_details` (_id = _id del libro)
+  - notes, quiz, subtitles (WebVTT) y `enrichment` (text_id/versión con que se
+    generaron) → `book_details`, escritos por el trabajo 'enrich' tras guardar el libro
+Del análisis solo se copian los `topics` al catálogo, que usa la búsqueda.
+
+Los libros antiguos todavía pueden tener esos campos embebidos; BookDetails los
+sigue leyendo de ahí hasta que se ejecute la migración:
+
+  python book_details.py                 # migrar en lotes (reanudable)
+  python book_details.py --batch 100     # tamaño de lote
+  python book_details.py --status        # solo mostrar el progreso
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+
+HEAVY_FIELDS = ('text', 'summary', 'analysis', 'accessibility', 'moderation')
+DETAIL_FIELDS = ('summary', 'analysis', 'accessibility', 'moderation', 'notes', 'quiz', 'subtitles', 'enrichment')
+# Proyección para consultas de catálogo (listados, búsqueda, playlists…)
+CATALOG_PROJECTION = {f: 0 for f in HEAVY_FIELDS}
+
+MIGRATION_ID = 'split_heavy_fields'
+DEFAULT_BATCH = 200
+
+
+def topics_of(analysis) -> list:
+    topics = (analysis or {}).get('topics') if isinstance(analysis, dict) else None
+    return [str(t) for t in topics][:20] if isinstance(topics, list) else []
+
+
+class BookDetails:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, book: Optional[dict], fields: Iterable[str] = DETAIL_FIELDS) -> Dict:
+        """Campos pesados del libro: los embebidos (libros sin migrar) o los de `book_details`."""
+        if not book:
+            return {}
+        fields = list(fields)
+        out = {f: book[f] for f in fields if book.get(f) is not None}
+        missing = [f for f in fields if f not in out]
+        if missing and self.collection is not None and book.get('_id') is not None:
+            try:
+                doc = self.collection.find_one({'_id': book['_id']}, {f: 1 for f in missing}) or {}
+            except Exception as e:
+                print(f"⚠️  Error leyendo book_details: {e}")
+                doc = {}
+            out.update({f: doc[f] for f in missing if doc.get(f) is not None})
+        return out
+
+    def get_field(self, book: Optional[dict], field: str):
+        return self.get(book, (field,)).get(field)
+
+    def set(self, book_id, values: Dict) -> bool:
+        values = {k: v for k, v in (values or {}).items() if k in DETAIL_FIELDS}
+        if self.collection is None or book_id is None or not values:
+            return False
+        try:
+            self.collection.update_one(
+                {'_id': book_id},
+                {'$set': dict(values, updated_at=datetime.utcnow())},
+                upsert=True,
+            )
+            return True
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar book_details de {book_id}: {e}")
+            return False
+
+    def delete(self, book_id):
+        if self.collection is None or book_id is None:
+            return
+        try:
+            self.collection.delete_one({'_id': book_id})
+        except Exception as e:
+            print(f"⚠️  No se pudo borrar book_details de {book_id}: {e}")
+
+
+def _pending_filter() -> dict:
+    return {'$or': [{f: {'$exists': True}} for f in HEAVY_FIELDS]}
+
+
+def _after(last_id) -> dict:
+    if last_id is None:
+        return {}
+    if isinstance(last_id, ObjectId):
+        return {'_id': {'$gt': last_id}}
+    # En orden BSON los string van antes que los ObjectId; $gt solo compara con el mismo tipo
+    return {'$or': [{'_id': {'$gt': last_id}}, {'_id': {'$type': 'objectId'}}]}
+
+
+def migrate_book(libros, details: BookDetails, texts, doc: dict) -> bool:
+    """Mueve los campos pesados de un libro. Idempotente: primero escribe en las
+    colecciones laterales y solo después los quita del catálogo."""
+    unset = {f: '' for f in HEAVY_FIELDS if f in doc}
+    set_fields = {}
+    text = doc.get('text')
+    if isinstance(text, str) and text.strip() and not doc.get('text_id'):
+        text_id = texts.put(text)
+        if not text_id:
+            return False
+        set_fields['text_id'] = text_id
+    extra = {f: doc[f] for f in DETAIL_FIELDS if doc.get(f) is not None}
+    if extra and not details.set(doc['_id'], extra):
+        return False
+    if doc.get('analysis') is not None:
+        set_fields['topics'] = topics_of(doc.get('analysis'))
+    update = {'$unset': unset}
+    if set_fields:
+        update['$set'] = set_fields
+    libros.update_one({'_id': doc['_id']}, update)
+    return True
+
+
+def migrate(libros, details: BookDetails, texts, state=None, batch_size: int = DEFAULT_BATCH,
+            max_batches: Optional[int] = None) -> dict:
+    """Migra en lotes ordenados por _id guardando el último procesado en `state`
+    (colección `migrations`), de modo que una ejecución interrumpida continúa donde iba."""
+    progress = (state.find_one({'_id': MIGRATION_ID}) if state is not None else None) or {}
+    last_id = progress.get('last_id')
+    migrated = int(progress.get('migrated') or 0)
+    failed = int(progress.get('failed') or 0)
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        query = _pending_filter()
+        after = _after(last_id)
+        if after:
+            query = {'$and': [query, after]}
+        docs = list(libros.find(query, {f: 1 for f in HEAVY_FIELDS + ('text_id',)})
+                    .sort('_id', 1).limit(batch_size))
+        if not docs:
+            break
+        for doc in docs:
+            try:
+                ok = migrate_book(libros, details, texts, doc)
+            except Exception as e:
+                print(f"⚠️  No se pudo migrar {doc.get('_id')}: {e}")
+                ok = False
+            if ok:
+                migrated += 1
+            else:
+                failed += 1
+        last_id = docs[-1]['_id']
+        batches += 1
+        if state is not None:
+            state.update_one({'_id': MIGRATION_ID}, {'$set': {
+                'last_id': last_id, 'migrated': migrated, 'failed': failed, 'updated_at': datetime.utcnow(),
+            }}, upsert=True)
+        print(f"📦 Lote {batches}: {len(docs)} libros (migrados {migrated}, con error {failed})")
+    done = max_batches is None or batches < max_batches
+    if state is not None and done:
+        # Terminado: la próxima ejecución vuelve a recorrer desde el principio (reintenta errores)
+        state.update_one({'_id': MIGRATION_ID}, {'$set': {'last_id': None, 'done_at': datetime.utcnow()}},
+                         upsert=True)
+    return {'migrated': migrated, 'failed': failed, 'batches': batches, 'done': done}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Mueve texto, resumen y análisis de `libros` a colecciones laterales")
+    p.add_argument('--uri', default="mongodb://localhost:27017/", help='URI de MongoDB')
+    p.add_argument('--db', default="sinsay", help='Base de datos')
+    p.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='Libros por lote')
+    p.add_argument('--status', action='store_true', help='Solo mostrar el progreso')
+    args = p.parse_args()
+
+    from pymongo import MongoClient
+    from text_store import TextStore
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print(f"ERROR: no se pudo conectar a MongoDB: {e}", file=sys.stderr)
+        sys.exit(2)
+    db = client[args.db]
+
+    pending = db['libros'].count_documents(_pending_filter())
+    progress = db['migrations'].find_one({'_id': MIGRATION_ID}) or {}
+    print(f"📚 Libros con campos pesados embebidos: {pending}")
+    if progress:
+        print(f"   migrados {progress.get('migrated', 0)}, con error {progress.get('failed', 0)}, "
+              f"último _id {progress.get('last_id')}")
+    if args.status or not pending:
+        return
+    result = migrate(db['libros'], BookDetails(db['book_details']), TextStore(db['texts']),
+                     state=db['migrations'], batch_size=max(1, args.batch))
+    print(f"✅ Migración terminada: {result['migrated']} migrados, {result['failed']} con error")
+    sys.exit(1 if result['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Identificadores de libros: normalización y resolución.
+
+Históricamente `_id` y `parent_id` se guardaron a veces como ObjectId y a veces
+como string (y `is_chapter` como True, 'True' o 1). La migración de este módulo
+convierte todo al tipo canónico (ObjectId cuando el valor es un hex de 24
+caracteres; bool para is_chapter) y registra la versión de esquema en la
+colección `migrations`:
+
+  python book_ids.py              # migrar (reanudable: cada lote busca lo pendiente)
+  python book_ids.py --status     # solo mostrar lo que falta
+
+BookResolver resuelve un id recibido por la URL con una sola consulta indexada
+por _id (exacta si el esquema ya está normalizado, `$in` de las dos variantes si
+no) y recuerda en un LRU a qué _id real corresponde cada id pedido. Mientras el
+esquema no esté normalizado vuelve a leer su versión cada SCHEMA_RECHECK_SECONDS,
+así que los procesos en marcha pasan a la consulta exacta sin reiniciar. Al
+terminar, la migración sube la versión de la biblioteca (counters.libros) para
+que los demás procesos reindexen y se invaliden los ETag de listados.
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+SCHEMA_DOC_ID = 'libros_schema'
+IDS_SCHEMA_VERSION = 1
+RESOLVER_LRU_SIZE = 512
+SCHEMA_RECHECK_SECONDS = 30
+DEFAULT_BATCH = 200
+
+_HEX_ID = '^[0-9a-fA-F]{24}$'
+_TRUE_VALUES = ['True', 'true', '1', 1]
+_FALSE_VALUES = ['False', 'false', '0', 0, '', None]
+
+
+def canonical_id(value):
+    """ObjectId si `value` lo representa; si no, el string tal cual (None si vacío)."""
+    if isinstance(value, ObjectId):
+        return value
+    s = str(value).strip() if value is not None else ''
+    if not s:
+        return None
+    return ObjectId(s) if ObjectId.is_valid(s) and len(s) == 24 else s
+
+
+def id_variants(value) -> List:
+    """Valores con los que un id puede estar guardado en datos sin normalizar."""
+    cid = canonical_id(value)
+    if cid is None:
+        return []
+    return [cid, str(cid)] if isinstance(cid, ObjectId) else [cid]
+
+
+def schema_version(state) -> int:
+    if state is None:
+        return 0
+    try:
+        return int((state.find_one({'_id': SCHEMA_DOC_ID}) or {}).get('ids_version') or 0)
+    except Exception:
+        return 0
+
+
+class BookResolver:
+    def __init__(self, collection, state=None, lru_size: int = RESOLVER_LRU_SIZE):
+        self.collection = collection
+        self.state = state
+        self._lru: "OrderedDict[str, object]" = OrderedDict()
+        self._lru_size = lru_size
+        self._lock = threading.Lock()
+        self._normalized = schema_version(state) >= IDS_SCHEMA_VERSION
+        self._checked_at = time.monotonic()
+
+    @property
+    def normalized(self) -> bool:
+        """El esquema normalizado no se revierte: solo se relee mientras no lo esté."""
+        if not self._normalized and time.monotonic() - self._checked_at >= SCHEMA_RECHECK_SECONDS:
+            self._checked_at = time.monotonic()
+            if schema_version(self.state) >= IDS_SCHEMA_VERSION:
+                with self._lock:
+                    # Los _id string recordados pueden haberse movido a ObjectId
+                    self._lru.clear()
+                self._normalized = True
+        return self._normalized
+
+    def id_filter(self, value, field: str = '_id') -> dict:
+        """Filtro indexado para `field` == id (ambas variantes si el esquema no está normalizado)."""
+        variants = id_variants(value)
+        if not variants:
+            # Id vacío: no debe coincidir con nada ({field: None} casaría con los libros sin padre)
+            return {field: {'$in': []}}
+        if self.normalized or len(variants) == 1:
+            return {field: variants[0]}
+        return {field: {'$in': variants}}
+
+    def chapters_filter(self, parent_id) -> dict:
+        if self.normalized:
+            return dict(self.id_filter(parent_id, 'parent_id'), is_chapter=True)
+        return {'$and': [self.id_filter(parent_id, 'parent_id'),
+                         {'is_chapter': {'$in': [True] + _TRUE_VALUES}}]}
+
+    def _remember(self, key: str, _id):
+        with self._lock:
+            self._lru[key] = _id
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._lru_size:
+                self._lru.popitem(last=False)
+
+    def forget(self, *book_ids):
+        with self._lock:
+            for b in book_ids:
+                self._lru.pop(str(b), None)
+
+    def resolve(self, book_id, projection: Optional[dict] = None) -> Optional[dict]:
+        """Documento del libro o None. Siempre una única consulta por _id."""
+        if self.collection is None or book_id is None:
+            return None
+        key = str(book_id).strip()
+        if not key:
+            return None
+        with self._lock:
+            known = self._lru.get(key, self)
+            if known is not self:
+                self._lru.move_to_end(key)
+        query = {'_id': known} if known is not self else self.id_filter(key)
+        doc = self.collection.find_one(query, projection)
+        if doc is None and known is not self:
+            # El _id recordado ya no existe (p.ej. la migración lo pasó a ObjectId)
+            doc = self.collection.find_one(self.id_filter(key), projection)
+        if doc is None:
+            self.forget(key)
+            return None
+        self._remember(key, doc['_id'])
+        return doc
+
+
+def _move_string_ids(libros, details, batch_size: int, report: dict):
+    """_id string con forma de ObjectId → ObjectId (insertar copia y borrar el original)."""
+    skipped = []
+    while True:
+        query = {'_id': {'$type': 'string', '$regex': _HEX_ID}}
+        if skipped:
+            query['_id']['$nin'] = skipped
+        docs = list(libros.find(query).limit(batch_size))
+        if not docs:
+            return
+        for doc in docs:
+            old = doc['_id']
+            new = ObjectId(old)
+            try:
+                libros.insert_one(dict(doc, _id=new))
+            except DuplicateKeyError:
+                print(f"⚠️  {old}: ya existe un libro con _id ObjectId igual; se deja sin migrar")
+                skipped.append(old)
+                report['conflicts'] += 1
+                continue
+            libros.delete_one({'_id': old})
+            if details is not None:
+                extra = details.find_one({'_id': old})
+                if extra:
+                    details.update_one({'_id': new}, {'$setOnInsert': {k: v for k, v in extra.items() if k != '_id'}},
+                                       upsert=True)
+                    details.delete_one({'_id': old})
+            report['ids'] += 1
+        print(f"🔑 _id normalizados: {report['ids']}")
+
+
+def _normalize_parent_ids(libros, batch_size: int, report: dict):
+    while True:
+        docs = list(libros.find({'parent_id': {'$type': 'string', '$regex': _HEX_ID}}, {'parent_id': 1})
+                    .limit(batch_size))
+        if not docs:
+            return
+        for doc in docs:
+            libros.update_one({'_id': doc['_id'], 'parent_id': doc['parent_id']},
+                              {'$set': {'parent_id': ObjectId(doc['parent_id'])}})
+            report['parent_ids'] += 1
+        print(f"🔗 parent_id normalizados: {report['parent_ids']}")
+
+
+def _normalize_is_chapter(libros, report: dict):
+    r = libros.update_many({'is_chapter': {'$in': _TRUE_VALUES}}, {'$set': {'is_chapter': True}})
+    report['is_chapter'] += r.modified_count
+    r = libros.update_many({'is_chapter': {'$in': _FALSE_VALUES, '$exists': True}}, {'$set': {'is_chapter': False}})
+    report['is_chapter'] += r.modified_count
+
+
+def pending_counts(libros) -> dict:
+    return {
+        'ids': libros.count_documents({'_id': {'$type': 'string', '$regex': _HEX_ID}}),
+        'parent_ids': libros.count_documents({'parent_id': {'$type': 'string', '$regex': _HEX_ID}}),
+        'is_chapter': libros.count_documents({'is_chapter': {'$in': _TRUE_VALUES + _FALSE_VALUES, '$exists': True}}),
+    }
+
+
+def migrate(libros, details=None, state=None, batch_size: int = DEFAULT_BATCH, counters=None) -> dict:
+    """Normaliza _id, parent_id e is_chapter. Cada paso consulta solo lo pendiente,
+    así que se puede interrumpir y volver a lanzar. Al terminar sin conflictos
+    registra ids_version en `migrations`; si cambió algo sube la versión de la
+    biblioteca en `counters`."""
+    from library_listing import bump_library_version  # library_listing importa este módulo
+    report = {'ids': 0, 'parent_ids': 0, 'is_chapter': 0, 'conflicts': 0}
+    _move_string_ids(libros, details, batch_size, report)
+    _normalize_parent_ids(libros, batch_size, report)
+    _normalize_is_chapter(libros, report)
+    if state is not None:
+        fields = {'ids_report': report, 'ids_updated_at': datetime.utcnow()}
+        if not report['conflicts']:
+            fields['ids_version'] = IDS_SCHEMA_VERSION
+        state.update_one({'_id': SCHEMA_DOC_ID}, {'$set': fields}, upsert=True)
+    if report['ids'] or report['parent_ids'] or report['is_chapter']:
+        bump_library_version(counters)
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="Normaliza _id/parent_id/is_chapter de `libros`")
+    p.add_argument('--uri', default="mongodb://localhost:27017/", help='URI de MongoDB')
+    p.add_argument('--db', default="sinsay", help='Base de datos')
+    p.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='Libros por lote')
+    p.add_argument('--status', action='store_true', help='Solo mostrar lo pendiente')
+    args = p.parse_args()
+
+    from pymongo import MongoClient
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print(f"ERROR: no se pudo conectar a MongoDB: {e}", file=sys.stderr)
+        sys.exit(2)
+    db = client[args.db]
+
+    print(f"📚 Pendiente: {pending_counts(db['libros'])} (versión de esquema {schema_version(db['migrations'])})")
+    if args.status:
+        return
+    report = migrate(db['libros'], db['book_details'], db['migrations'], batch_size=max(1, args.batch),
+                     counters=db['counters'])
+    print(f"✅ Normalización terminada: {report}")
+    sys.exit(1 if report['conflicts'] else 0)
+
+
+if __name__ == '__main__':
+    main()
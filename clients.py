@@ -0,0 +1,172 @@
+import os
+import importlib
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Registro de clientes salientes de larga vida (ElevenLabs, Google TTS, Gemini, OpenAI).
+# Cada cliente se construye una sola vez por proceso (y por API key), con pool de
+# conexiones keep-alive y timeouts por proveedor, y se reutiliza desde cualquier hilo.
+#
+# Variables de entorno:
+#   HTTP_POOL_SIZE            conexiones keep-alive por host (por defecto 10)
+#   <PROVIDER>_TIMEOUT        timeout de lectura en segundos, p.ej. ELEVEN_TIMEOUT=120
+#   <PROVIDER>_CONNECT_TIMEOUT timeout de conexión en segundos (por defecto 5)
+
+_DEFAULT_TIMEOUTS = {
+    'eleven': 120.0,
+    'google_tts': 60.0,
+    'gemini': 30.0,
+    'openai': 30.0,
+}
+
+
+def pool_size() -> int:
+    try:
+        return max(1, int(os.environ.get('HTTP_POOL_SIZE', '10')))
+    except ValueError:
+        return 10
+
+
+def provider_timeout(provider: str) -> Tuple[float, float]:
+    """(connect, read) en segundos para un proveedor."""
+    env = provider.upper()
+    try:
+        read = float(os.environ.get(f'{env}_TIMEOUT', _DEFAULT_TIMEOUTS.get(provider, 30.0)))
+    except ValueError:
+        read = _DEFAULT_TIMEOUTS.get(provider, 30.0)
+    try:
+        connect = float(os.environ.get(f'{env}_CONNECT_TIMEOUT', '5'))
+    except ValueError:
+        connect = 5.0
+    return connect, read
+
+
+class ClientRegistry:
+    """Cache thread-safe de clientes por (nombre, clave)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, Optional[str]], object] = {}
+
+    def get(self, name: str, key: Optional[str], factory: Callable[[], object]):
+        ck = (name, key)
+        client = self._clients.get(ck)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(ck)
+            if client is None:
+                client = factory()
+                if client is not None:
+                    self._clients[ck] = client
+            return client
+
+    def clear(self):
+        with self._lock:
+            for client in self._clients.values():
+                close = getattr(client, 'close', None)
+                if callable(close):
+                    try:
+                        close()
+                    except Exception:
+                        pass
+            self._clients.clear()
+
+    def names(self):
+        return sorted({name for name, _ in self._clients.keys()})
+
+
+registry = ClientRegistry()
+
+
+def http_session(provider: str) -> requests.Session:
+    """Sesión requests keep-alive con pool dimensionado para uso concurrente."""
+    def factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size(), pool_maxsize=pool_size())
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    return registry.get(f'http:{provider}', None, factory)
+
+
+def eleven_client(api_key: Optional[str]):
+    """Cliente ElevenLabs (SDK) compartido, con pool httpx si está disponible."""
+    def factory():
+        try:
+            from elevenlabs.client import ElevenLabs  # type: ignore
+        except Exception:
+            return None
+        connect, read = provider_timeout('eleven')
+        try:
+            httpx = importlib.import_module('httpx')
+            http_client = httpx.Client(
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=pool_size(), max_keepalive_connections=pool_size()),
+            )
+            return ElevenLabs(api_key=api_key, httpx_client=http_client)
+        except Exception:
+            return ElevenLabs(api_key=api_key)
+    return registry.get('eleven', api_key, factory)
+
+
+def google_tts_client(api_key: Optional[str]):
+    """TextToSpeechClient compartido (un único canal gRPC por proceso).
+    Con API key usa client_options; sin ella, las credenciales por defecto.
+    """
+    def factory():
+        from google.cloud import texttospeech  # type: ignore
+        if api_key:
+            from google.api_core import client_options as client_options_lib  # type: ignore
+            return texttospeech.TextToSpeechClient(
+                client_options=client_options_lib.ClientOptions(api_key=api_key)
+            )
+        return texttospeech.TextToSpeechClient()
+    return registry.get('google_tts', api_key, factory)
+
+
+def gemini_client(api_key: Optional[str]):
+    """Cliente google-genai compartido o None si falta la librería/clave."""
+    if not api_key:
+        return None
+
+    def factory():
+        try:
+            genai = importlib.import_module("google.genai")
+        except Exception:
+            return None
+        _, read = provider_timeout('gemini')
+        try:
+            # HttpOptions.timeout está en milisegundos
+            return genai.Client(api_key=api_key, http_options={'timeout': int(read * 1000)})
+        except Exception:
+            try:
+                return genai.Client(api_key=api_key)
+            except Exception:
+                return None
+    return registry.get('gemini', api_key, factory)
+
+
+def openai_client(api_key: Optional[str]):
+    """Cliente OpenAI compartido (expone .chat.completions como el módulo) o None."""
+    if not api_key:
+        return None
+
+    def factory():
+        try:
+            openai = importlib.import_module("openai")
+        except Exception:
+            return None
+        _, read = provider_timeout('openai')
+        client_cls = getattr(openai, 'OpenAI', None)
+        if client_cls is None:
+            # openai<1.0: solo API a nivel de módulo
+            return openai
+        try:
+            return client_cls(api_key=api_key, timeout=read, max_retries=1)
+        except Exception:
+            return openai
+    return registry.get('openai', api_key, factory)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Registro de índices de MongoDB.
+
+Declara en un solo lugar los índices que necesitan las consultas calientes de
+la app (biblioteca, capítulos, recientes, login, cola de trabajos, cachés TTS e IA),
+los crea de forma idempotente y comprueba con explain() que cada consulta
+caliente se resuelve con un índice y no con un COLLSCAN.
+
+La app llama a ensure_indexes() al arrancar (desactivable con
+DB_AUTO_INDEXES=0) y avisa de los que falten. También se puede usar a mano:
+
+  python db_indexes.py                # crear los que falten y verificar planes
+  python db_indexes.py --check        # solo informar (no crea nada)
+  python db_indexes.py --uri mongodb://host:27017/ --db sinsay
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+DEFAULT_URI = "mongodb://localhost:27017/"
+DEFAULT_DB = "sinsay"
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: str
+    unique: bool = False
+    reason: str = ''
+    # Índice TTL: segundos tras el valor del campo (0 = expira en esa fecha)
+    expire_after: Optional[int] = None
+
+
+class HotQuery(NamedTuple):
+    collection: str
+    name: str
+    # Construye el cursor a explicar (recibe la colección)
+    build: Callable
+
+
+REQUIRED_INDEXES: List[IndexSpec] = [
+    # libros: listados, búsqueda, autocompletado y playlists ordenan por uploaded_at
+    IndexSpec('libros', [('uploaded_at', -1), ('_id', -1)], 'listing_recent',
+              reason='listados por fecha (keyset de /api/v2/libros, búsqueda, playlists)'),
+    IndexSpec('libros', [('category', 1), ('uploaded_at', -1), ('_id', -1)], 'listing_category',
+              reason='listado filtrado por categoría'),
+    IndexSpec('libros', [('parent_id', 1), ('chapter_number', 1)], 'chapters',
+              reason='capítulos de un libro y numeración de capítulos nuevos'),
+    IndexSpec('libros', [('audio_filename', 1)], 'audio_filename',
+              reason='detección de audios huérfanos'),
+    IndexSpec('libros', [('vector_dirty_at', 1)], 'vector_dirty',
+              reason='libros pendientes de revectorizar (vector_index.py)'),
+    # usuarios: login/registro; único para que dos registros simultáneos no dupliquen cuenta
+    IndexSpec('usuarios', [('correo', 1)], 'correo_unique', unique=True,
+              reason='login y registro'),
+    # listening_state: un documento por (usuario, libro); recientes y "continuar escuchando"
+    IndexSpec('listening_state', [('user_id', 1), ('book_id', 1)], 'user_book', unique=True,
+              reason='upsert del estado y posición de reanudación'),
+    IndexSpec('listening_state', [('user_id', 1), ('last_played_at', -1)], 'user_recent',
+              reason='/recientes y /api/listening/recent'),
+    IndexSpec('listening_state', [('user_id', 1), ('in_progress', 1), ('last_played_at', -1)], 'user_continue',
+              reason='/api/listening/continue'),
+    IndexSpec('listening_state', [('book_id', 1)], 'book',
+              reason='borrado del estado al eliminar un libro'),
+    # jobs: lease de la cola y recuperación de leases vencidos
+    IndexSpec('jobs', [('status', 1), ('kind', 1), ('available_at', 1), ('created_at', 1)], 'lease_queued',
+              reason='lease de trabajos encolados'),
+    IndexSpec('jobs', [('status', 1), ('lease_expires_at', 1)], 'lease_expired',
+              reason='recuperación de leases vencidos'),
+    # tts_cache: expulsión LRU
+    IndexSpec('tts_cache', [('last_used_at', 1)], 'lru',
+              reason='expulsión LRU de la caché de audio'),
+    # ai_cache: resultados memoizados de la IA (ai_providers.py)
+    IndexSpec('ai_cache', [('expires_at', 1)], 'ttl', expire_after=0,
+              reason='caducidad de resultados de IA'),
+    IndexSpec('ai_cache', [('last_used_at', 1)], 'lru',
+              reason='expulsión LRU de la caché de IA'),
+]
+
+
+def _sample_id():
+    return ObjectId()
+
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery('libros', 'recientes por uploaded_at',
+             lambda c: c.find({}).sort('uploaded_at', -1).limit(50)),
+    HotQuery('libros', 'listado por categoría',
+             lambda c: c.find({'category': 'x'}).sort([('uploaded_at', -1), ('_id', -1)]).limit(25)),
+    HotQuery('listening_state', '/recientes (user_id, last_played_at)',
+             lambda c: c.find({'user_id': 'x', 'last_played_at': {'$gte': datetime.utcnow() - timedelta(hours=24)}})
+             .sort('last_played_at', -1)),
+    HotQuery('listening_state', 'continuar escuchando',
+             lambda c: c.find({'user_id': 'x', 'in_progress': True}).sort('last_played_at', -1).limit(10)),
+    HotQuery('listening_state', 'posición de reanudación',
+             lambda c: c.find({'user_id': 'x', 'book_id': 'y'}).limit(1)),
+    HotQuery('libros', 'capítulos por parent_id',
+             lambda c: c.find({'parent_id': {'$in': [str(_sample_id()), _sample_id()]}}).sort('chapter_number', 1)),
+    HotQuery('libros', 'conteo de capítulos',
+             lambda c: c.find({'$or': [{'parent_id': _sample_id()}, {'parent_id': 'x'}]})),
+    HotQuery('libros', 'escaneo de audio_filename (huérfanos)',
+             lambda c: c.find({'audio_filename': {'$gt': ''}}, {'audio_filename': 1, '_id': 0})),
+    HotQuery('usuarios', 'login por correo',
+             lambda c: c.find({'correo': 'x@example.com'}).limit(1)),
+]
+
+# Etapas de plan que cuentan como acceso por índice
+_INDEX_STAGES = {'IXSCAN', 'EXPRESS_IXSCAN', 'IDHACK', 'EXPRESS_IDHACK', 'COUNT_SCAN', 'DISTINCT_SCAN'}
+
+
+def _key_tuple(keys) -> Tuple[Tuple[str, int], ...]:
+    return tuple((k, int(v)) for k, v in keys)
+
+
+def _existing(db, collection: str) -> Dict[Tuple, dict]:
+    """Índices existentes en `collection` indexados por su clave."""
+    try:
+        info = db[collection].index_information()
+    except Exception:
+        return {}
+    return {_key_tuple(spec.get('key', [])): dict(spec, name=name) for name, spec in info.items()}
+
+
+def missing_indexes(db, specs: Optional[List[IndexSpec]] = None) -> List[IndexSpec]:
+    """Índices declarados que no existen (por clave; un índice único debe serlo)."""
+    out = []
+    cache: Dict[str, Dict[Tuple, dict]] = {}
+    for spec in specs or REQUIRED_INDEXES:
+        if spec.collection not in cache:
+            cache[spec.collection] = _existing(db, spec.collection)
+        found = cache[spec.collection].get(_key_tuple(spec.keys))
+        if found is None or (spec.unique and not found.get('unique')):
+            out.append(spec)
+    return out
+
+
+def _duplicates(db, spec: IndexSpec, limit: int = 5) -> List:
+    """Valores repetidos que impiden crear un índice único."""
+    field = spec.keys[0][0]
+    try:
+        rows = db[spec.collection].aggregate([
+            {'$group': {'_id': f'${field}', 'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}},
+            {'$limit': limit},
+        ])
+        return [r['_id'] for r in rows]
+    except Exception:
+        return []
+
+
+def ensure_indexes(db, specs: Optional[List[IndexSpec]] = None) -> dict:
+    """Crea (idempotente) los índices declarados.
+    Devuelve {'created': [...], 'existing': [...], 'errors': [{'index', 'error'}]}.
+    """
+    report = {'created': [], 'existing': [], 'errors': []}
+    if db is None:
+        return report
+    specs = specs or REQUIRED_INDEXES
+    missing = {(s.collection, s.name) for s in missing_indexes(db, specs)}
+    for spec in specs:
+        label = f"{spec.collection}.{spec.name}"
+        if (spec.collection, spec.name) not in missing:
+            report['existing'].append(label)
+            continue
+        try:
+            options = {'name': spec.name, 'unique': spec.unique}
+            if spec.expire_after is not None:
+                options['expireAfterSeconds'] = spec.expire_after
+            db[spec.collection].create_index(spec.keys, **options)
+            report['created'].append(label)
+        except (DuplicateKeyError, OperationFailure) as e:
+            err = str(e)
+            dups = _duplicates(db, spec) if spec.unique else []
+            if dups:
+                err = f"valores duplicados en {spec.keys[0][0]}: {dups}"
+            report['errors'].append({'index': label, 'error': err})
+        except Exception as e:
+            report['errors'].append({'index': label, 'error': str(e)})
+    return report
+
+
+def _plan_stages(node) -> List[str]:
+    stages = []
+    if isinstance(node, dict):
+        if isinstance(node.get('stage'), str):
+            stages.append(node['stage'])
+        for v in node.values():
+            stages.extend(_plan_stages(v))
+    elif isinstance(node, list):
+        for v in node:
+            stages.extend(_plan_stages(v))
+    return stages
+
+
+def verify_query_plans(db, queries: Optional[List[HotQuery]] = None) -> List[dict]:
+    """explain() de cada consulta caliente: {'query', 'collection', 'stages', 'ok'}.
+    ok es None si el servidor no permitió obtener el plan."""
+    results = []
+    if db is None:
+        return results
+    for q in queries or HOT_QUERIES:
+        entry = {'query': q.name, 'collection': q.collection, 'stages': [], 'ok': None}
+        try:
+            plan = q.build(db[q.collection]).explain()
+            winning = (plan.get('queryPlanner') or {}).get('winningPlan') or plan
+            stages = _plan_stages(winning)
+            entry['stages'] = stages
+            entry['ok'] = 'COLLSCAN' not in stages and any(s in _INDEX_STAGES for s in stages)
+        except Exception as e:
+            entry['error'] = str(e)
+        results.append(entry)
+    return results
+
+
+def report_startup(db, create: bool = True) -> dict:
+    """Crea los índices (si `create`) e informa por consola de lo que falte."""
+    report = {'created': [], 'existing': [], 'errors': []}
+    if db is None:
+        return report
+    if create:
+        report = ensure_indexes(db)
+        if report['created']:
+            print(f"🗂️  Índices creados: {', '.join(report['created'])}")
+        for err in report['errors']:
+            print(f"⚠️  No se pudo crear el índice {err['index']}: {err['error']}")
+    missing = missing_indexes(db)
+    if missing:
+        names = ', '.join(f"{s.collection}.{s.name}" for s in missing)
+        print(f"⚠️  Faltan índices de MongoDB: {names} (ejecuta: python db_indexes.py)")
+    else:
+        print(f"🗂️  Índices de MongoDB OK ({len(REQUIRED_INDEXES)})")
+    report['missing'] = [f"{s.collection}.{s.name}" for s in missing]
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="Crea y verifica los índices de MongoDB de Sinsay")
+    p.add_argument('--uri', default=DEFAULT_URI, help='URI de MongoDB')
+    p.add_argument('--db', default=DEFAULT_DB, help='Base de datos')
+    p.add_argument('--check', action='store_true', help='Solo informar; no crear índices')
+    p.add_argument('--no-explain', action='store_true', help='No verificar los planes de las consultas')
+    args = p.parse_args()
+
+    from pymongo import MongoClient
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print(f"ERROR: no se pudo conectar a MongoDB: {e}", file=sys.stderr)
+        sys.exit(2)
+    db = client[args.db]
+
+    failed = False
+    if not args.check:
+        report = ensure_indexes(db)
+        for label in report['created']:
+            print(f"➕ creado   {label}")
+        for label in report['existing']:
+            print(f"✔  existe   {label}")
+        for err in report['errors']:
+            failed = True
+            print(f"❌ error    {err['index']}: {err['error']}")
+    missing = missing_indexes(db)
+    for spec in missing:
+        failed = True
+        print(f"❌ falta    {spec.collection}.{spec.name} {spec.keys} — {spec.reason}")
+
+    if not args.no_explain:
+        for r in verify_query_plans(db):
+            if r['ok'] is None:
+                print(f"?  plan     {r['collection']}: {r['query']} ({r.get('error', 'sin plan')})")
+                continue
+            mark = '✔ ' if r['ok'] else '❌'
+            failed = failed or not r['ok']
+            print(f"{mark} plan     {r['collection']}: {r['query']} → {' > '.join(r['stages'])}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
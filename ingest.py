@@ -0,0 +1,145 @@
+import os
+import hashlib
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+# Ingesta de archivos subidos.
+# El parser multipart de Werkzeug escribe cada archivo en el objeto que devuelve
+# Request._get_file_stream; aquí ese objeto es un archivo único en `uploads/`
+# que calcula el SHA-256 y controla el tamaño mientras llegan los bytes, sin
+# volver a leer el archivo después.
+# La colección `source_files` (clave = sha256) guarda por contenido la referencia
+# al texto ya extraído (colección `texts`) y los audios generados por
+# (motor, voz, modelo), para que un archivo repetido no vuelva a pagar extracción
+# ni síntesis.
+
+MAX_UPLOAD_BYTES = int(os.environ.get('UPLOAD_MAX_MB', '50')) * 1024 * 1024
+
+
+class HashingSpoolFile:
+    """Archivo de escritura única que acumula SHA-256 y tamaño al escribir."""
+
+    def __init__(self, folder: str, filename: Optional[str], max_bytes: int = MAX_UPLOAD_BYTES):
+        safe = secure_filename(filename or '') or 'upload'
+        self.path = os.path.join(folder, f"{uuid.uuid4().hex}_{safe}")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.claimed = False
+        self._sha = hashlib.sha256()
+        self._fh = open(self.path, 'w+b')
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge()
+        self._sha.update(data)
+        return self._fh.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    def claim(self) -> str:
+        """La vista se queda con el archivo; si nadie lo reclama se borra al cerrar la petición."""
+        self.claimed = True
+        self._fh.flush()
+        return self.path
+
+    def discard(self):
+        try:
+            self._fh.close()
+        finally:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/close… del archivo real (FileStorage los usa)
+        return getattr(self._fh, name)
+
+    def __iter__(self):
+        return iter(self._fh)
+
+
+def discard_unclaimed(files) -> None:
+    """Borra los archivos subidos que ninguna vista reclamó (p.ej. rechazados)."""
+    for storage in files.values() if files else ():
+        spool = spooled_upload(storage)
+        if spool is not None and not spool.claimed:
+            spool.discard()
+
+
+def spooled_upload(file_storage) -> Optional[HashingSpoolFile]:
+    """Devuelve el HashingSpoolFile detrás de un FileStorage, si lo hay."""
+    stream = getattr(file_storage, 'stream', None)
+    return stream if isinstance(stream, HashingSpoolFile) else None
+
+
+def audio_variant_key(engine: str, voice_id: Optional[str], model: Optional[str]) -> str:
+    # Sin puntos: la clave se usa como campo anidado en MongoDB
+    return '|'.join((engine or '', voice_id or '', model or '')).replace('.', '_')
+
+
+class SourceFiles:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def touch(self, source: Optional[dict]) -> Optional[dict]:
+        """Registra una subida del contenido y devuelve la entrada previa (None si es nuevo)."""
+        sha256 = (source or {}).get('sha256')
+        if self.collection is None or not sha256:
+            return None
+        now = datetime.utcnow()
+        try:
+            return self.collection.find_one_and_update(
+                {'_id': sha256},
+                {
+                    '$setOnInsert': {'size': source.get('size'), 'filename': source.get('filename'), 'created_at': now},
+                    '$set': {'last_seen_at': now},
+                    '$inc': {'uploads': 1},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"⚠️  Error consultando source_files: {e}")
+            return None
+
+    def record_text(self, sha256: str, text_id: Optional[str]):
+        """Enlaza el contenido con su texto en la colección `texts`."""
+        if self.collection is None or not sha256 or not text_id:
+            return
+        try:
+            self.collection.update_one({'_id': sha256}, {'$set': {'text_id': text_id}}, upsert=True)
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar el texto de source_file: {e}")
+
+    def record_audio(self, sha256: str, engine: str, voice_id: Optional[str], model: Optional[str],
+                     audio_filename: str, tts_engine_label: Optional[str]):
+        if self.collection is None or not sha256 or not audio_filename:
+            return
+        key = audio_variant_key(engine, voice_id, model)
+        try:
+            self.collection.update_one({'_id': sha256}, {'$set': {f'audio.{key}': {
+                'audio_filename': audio_filename,
+                'tts_engine': tts_engine_label,
+                'created_at': datetime.utcnow(),
+            }}}, upsert=True)
+        except Exception as e:
+            print(f"⚠️  No se pudo registrar el audio de source_file: {e}")
+
+    def find_audio(self, entry: Optional[dict], engine: str, voice_id: Optional[str], model: Optional[str],
+                   audio_folder: str) -> Optional[dict]:
+        """Variante de audio ya generada (y aún en disco) para esa voz/modelo, o None."""
+        variant = ((entry or {}).get('audio') or {}).get(audio_variant_key(engine, voice_id, model))
+        if not variant:
+            return None
+        path = os.path.join(audio_folder, variant.get('audio_filename') or '')
+        if not os.path.isfile(path):
+            return None
+        return dict(variant, path=path)
@@ -0,0 +1,286 @@
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# Cola de trabajos persistente sobre MongoDB.
+# - El servidor web solo encola (enqueue_job) y consulta (get_job).
+# - Uno o más procesos worker (ver worker.py) toman trabajos con un "lease"
+#   atómico vía find_one_and_update; si un worker muere, el lease expira y
+#   otro worker puede retomar el trabajo.
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+DEFAULT_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+
+class JobPermanentError(Exception):
+    """Error que no debe reintentarse (p.ej. archivo sin texto o datos inválidos)."""
+
+
+def _to_oid(job_id):
+    if isinstance(job_id, ObjectId):
+        return job_id
+    try:
+        return ObjectId(str(job_id))
+    except Exception:
+        return None
+
+
+def enqueue_job(collection, kind: str, payload: dict, user_id: Optional[str] = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS, delay_seconds: float = 0) -> str:
+    """Inserta un trabajo en estado 'queued' y devuelve su id (string).
+    `delay_seconds` retrasa cuándo los workers pueden tomarlo (lease_job por id lo ignora).
+    """
+    now = datetime.utcnow()
+    doc = {
+        'kind': kind,
+        'status': JOB_QUEUED,
+        'stage': JOB_QUEUED,
+        'stages': [{'stage': JOB_QUEUED, 'at': now}],
+        'payload': payload or {},
+        'user_id': user_id,
+        'attempts': 0,
+        'max_attempts': max(1, int(max_attempts or 1)),
+        'available_at': now + timedelta(seconds=delay_seconds),
+        'created_at': now,
+        'updated_at': now,
+        'result': None,
+        'error': None,
+    }
+    result = collection.insert_one(doc)
+    return str(result.inserted_id)
+
+
+def lease_job(collection, worker_id: str, kinds: Optional[Iterable[str]] = None,
+              lease_seconds: int = DEFAULT_LEASE_SECONDS, job_id=None) -> Optional[dict]:
+    """Toma de forma atómica el trabajo más antiguo disponible (o con lease vencido).
+    Con `job_id` toma ese trabajo concreto si sigue en cola, sin esperar a `available_at`.
+    """
+    now = datetime.utcnow()
+    if job_id is not None:
+        oid = _to_oid(job_id)
+        if oid is None:
+            return None
+        query = {'_id': oid, 'status': JOB_QUEUED}
+    else:
+        query = {
+            '$or': [
+                {'status': JOB_QUEUED, 'available_at': {'$lte': now}},
+                {'status': JOB_RUNNING, 'lease_expires_at': {'$lt': now}},
+            ]
+        }
+    if kinds:
+        query['kind'] = {'$in': list(kinds)}
+    return collection.find_one_and_update(
+        query,
+        {
+            '$set': {
+                'status': JOB_RUNNING,
+                'worker_id': worker_id,
+                'leased_at': now,
+                'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                'updated_at': now,
+            },
+            '$inc': {'attempts': 1},
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _owned(oid, worker_id: Optional[str]) -> dict:
+    """Filtro del trabajo; con `worker_id`, solo si ese worker sigue teniéndolo."""
+    query = {'_id': oid}
+    if worker_id is not None:
+        query.update({'status': JOB_RUNNING, 'worker_id': worker_id})
+    return query
+
+
+def set_stage(collection, job_id, stage: str, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+              worker_id: Optional[str] = None, **extra) -> bool:
+    """Registra el avance de etapa y renueva el lease del worker.
+    Con `worker_id`, solo si ese worker sigue teniendo el trabajo; False si lo perdió."""
+    oid = _to_oid(job_id)
+    if oid is None:
+        return False
+    now = datetime.utcnow()
+    fields = {
+        'stage': stage,
+        'updated_at': now,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+    }
+    for k, v in extra.items():
+        fields[k] = v
+    return collection.update_one(_owned(oid, worker_id), {
+        '$set': fields,
+        '$push': {'stages': {'stage': stage, 'at': now}},
+    }).matched_count == 1
+
+
+def renew_lease(collection, job_id, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """Renueva el lease si `worker_id` todavía tiene el trabajo. False si lo perdió
+    (el lease venció y otro worker lo tomó)."""
+    oid = _to_oid(job_id)
+    if oid is None:
+        return False
+    now = datetime.utcnow()
+    result = collection.update_one(
+        {'_id': oid, 'status': JOB_RUNNING, 'worker_id': worker_id},
+        {'$set': {'lease_expires_at': now + timedelta(seconds=lease_seconds), 'updated_at': now}},
+    )
+    return result.matched_count == 1
+
+
+def complete_job(collection, job_id, result: Optional[dict] = None, worker_id: Optional[str] = None) -> bool:
+    """Marca el trabajo como terminado. Con `worker_id`, solo si ese worker conserva el lease."""
+    oid = _to_oid(job_id)
+    now = datetime.utcnow()
+    return collection.update_one(_owned(oid, worker_id), {
+        '$set': {
+            'status': JOB_DONE,
+            'stage': JOB_DONE,
+            'result': result or {},
+            'error': None,
+            'finished_at': now,
+            'updated_at': now,
+        },
+        '$push': {'stages': {'stage': JOB_DONE, 'at': now}},
+        '$unset': {'lease_expires_at': ''},
+    }).matched_count == 1
+
+
+def fail_job(collection, job_id, error, retry: bool = True, backoff_seconds: int = 15,
+             worker_id: Optional[str] = None) -> bool:
+    """Marca un intento fallido. Devuelve True si el trabajo volvió a la cola.
+    Con `worker_id` no hace nada si ese worker ya perdió el lease."""
+    oid = _to_oid(job_id)
+    job = collection.find_one(_owned(oid, worker_id), {'attempts': 1, 'max_attempts': 1})
+    if job is None and worker_id is not None:
+        return False
+    now = datetime.utcnow()
+    attempts = int((job or {}).get('attempts') or 0)
+    max_attempts = int((job or {}).get('max_attempts') or 1)
+    if retry and attempts < max_attempts:
+        collection.update_one(_owned(oid, worker_id), {
+            '$set': {
+                'status': JOB_QUEUED,
+                'stage': JOB_QUEUED,
+                'error': str(error),
+                'available_at': now + timedelta(seconds=backoff_seconds * attempts),
+                'updated_at': now,
+            },
+            '$push': {'stages': {'stage': 'retry', 'at': now, 'error': str(error)[:500]}},
+            '$unset': {'lease_expires_at': ''},
+        })
+        return True
+    collection.update_one(_owned(oid, worker_id), {
+        '$set': {
+            'status': JOB_FAILED,
+            'stage': JOB_FAILED,
+            'error': str(error),
+            'finished_at': now,
+            'updated_at': now,
+        },
+        '$push': {'stages': {'stage': JOB_FAILED, 'at': now, 'error': str(error)[:500]}},
+        '$unset': {'lease_expires_at': ''},
+    })
+    return False
+
+
+def get_job(collection, job_id) -> Optional[dict]:
+    oid = _to_oid(job_id)
+    if oid is None:
+        return None
+    return collection.find_one({'_id': oid})
+
+
+def serialize_job(job: dict) -> dict:
+    """Convierte un documento de job a un dict apto para JSON (sin payload interno)."""
+    def _ts(v):
+        return v.isoformat() + 'Z' if isinstance(v, datetime) else v
+    return {
+        'job_id': str(job.get('_id')),
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'stage': job.get('stage'),
+        'stages': [
+            {k: _ts(v) for k, v in (s or {}).items()}
+            for s in (job.get('stages') or [])
+        ],
+        'attempts': job.get('attempts', 0),
+        'max_attempts': job.get('max_attempts', 1),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'created_at': _ts(job.get('created_at')),
+        'updated_at': _ts(job.get('updated_at')),
+        'finished_at': _ts(job.get('finished_at')),
+    }
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def process_job(collection, job: dict, handler: Callable, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                worker_id: Optional[str] = None):
+    """Ejecuta un trabajo ya tomado con lease_job por `worker_id` y registra el resultado
+    (completado, reintento o fallo definitivo) solo mientras ese worker conserve el lease.
+    `stage_cb(stage)` devuelve False si el lease se perdió (otro worker retomó el trabajo)."""
+    job_id = job['_id']
+    wid = worker_id or job.get('worker_id')
+    print(f"📥 Trabajo {job_id} ({job.get('kind')}) intento {job.get('attempts')}")
+
+    def stage_cb(stage, **extra):
+        try:
+            owned = set_stage(collection, job_id, stage, lease_seconds=lease_seconds, worker_id=wid, **extra)
+        except Exception as _e:
+            print(f"⚠️  No se pudo registrar etapa {stage} de {job_id}: {_e}")
+            return True
+        if not owned:
+            print(f"⚠️  Trabajo {job_id}: lease perdido en la etapa {stage}")
+        return owned
+
+    try:
+        result = handler(job, stage_cb)
+        if complete_job(collection, job_id, result, worker_id=wid):
+            print(f"✅ Trabajo {job_id} completado")
+        else:
+            print(f"⚠️  Trabajo {job_id} terminado, pero ya lo tiene otro worker: no se registra")
+    except JobPermanentError as e:
+        fail_job(collection, job_id, e, retry=False, worker_id=wid)
+        print(f"❌ Trabajo {job_id} falló (sin reintento): {e}")
+    except Exception as e:
+        requeued = fail_job(collection, job_id, e, retry=True, worker_id=wid)
+        print(f"⚠️  Trabajo {job_id} falló: {e} ({'reintentará' if requeued else 'sin más intentos'})")
+
+
+def run_worker(collection, handlers: Dict[str, Callable], worker_id: Optional[str] = None,
+               poll_interval: float = 1.0, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+               stop_event: Optional[threading.Event] = None):
+    """Bucle principal del worker.
+    `handlers` mapea kind -> callable(job, stage_cb) que devuelve el dict de resultado.
+    Un JobPermanentError marca el trabajo como fallido sin reintentos.
+    """
+    wid = worker_id or default_worker_id()
+    stop = stop_event or threading.Event()
+    print(f"👷 Worker {wid} escuchando trabajos: {', '.join(handlers.keys())}")
+    while not stop.is_set():
+        job = None
+        try:
+            job = lease_job(collection, wid, kinds=list(handlers.keys()), lease_seconds=lease_seconds)
+        except Exception as e:
+            print(f"⚠️  Error al tomar trabajo: {e}")
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+
+        process_job(collection, job, handlers.get(job.get('kind')), lease_seconds=lease_seconds, worker_id=wid)
@@ -0,0 +1,124 @@
+import json
+import base64
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from book_details import HEAVY_FIELDS
+from book_ids import id_variants
+
+# Listado paginado de la biblioteca (/api/v2/libros).
+# - Paginación por keyset sobre (uploaded_at, _id) descendente: cada página es una
+#   consulta indexada de `limit` documentos, sin skip (índices en db_indexes.py).
+# - Proyección `fields=`: por defecto nunca incluye el texto ni blobs pesados.
+# - ETag débil a partir de un contador de cambios de la biblioteca (colección
+#   `counters`, doc 'libros'), incrementado en cada alta/edición/borrado.
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+# Campos de catálogo que se devuelven si no se pide `fields`
+DEFAULT_FIELDS = (
+    '_id', 'title', 'subtitle', 'category', 'categoryLabel', 'level', 'levelLabel',
+    'duration', 'duration_seconds', 'audio_filename', 'audio_url', 'cover_image_url',
+    'voice_id', 'tts_engine', 'topics', 'uploaded_by', 'uploaded_at', 'created_at',
+    'is_chapter', 'parent_id', 'chapter_number', 'chapter_roman', 'chapter_title',
+)
+# Nunca se devuelven en listados (viven en `texts`/`book_details`; usar los endpoints por libro)
+BLOCKED_FIELDS = frozenset(HEAVY_FIELDS)
+# Estadísticas de reproducción: cambian en cada play y no invalidan el ETag,
+# así que el listado v2 tampoco las expone
+VOLATILE_FIELDS = frozenset({'play_count', 'completion_count', 'last_played_at', 'last_played_by', 'last_position'})
+
+
+def bump_library_version(counters) -> None:
+    """Marca la biblioteca como modificada (invalida los ETag de listados)."""
+    if counters is None:
+        return
+    try:
+        counters.update_one({'_id': 'libros'}, {'$inc': {'v': 1}}, upsert=True)
+    except Exception as e:
+        print(f"⚠️  No se pudo actualizar la versión de la biblioteca: {e}")
+
+
+def library_version(counters) -> int:
+    if counters is None:
+        return 0
+    try:
+        return int((counters.find_one({'_id': 'libros'}) or {}).get('v') or 0)
+    except Exception:
+        return 0
+
+
+def listing_etag(version: int, args: Iterable[Tuple[str, str]]) -> str:
+    """Valor del ETag (débil, sin comillas): versión de la biblioteca + parámetros de la consulta."""
+    h = hashlib.sha1(json.dumps(sorted(args)).encode('utf-8')).hexdigest()[:12]
+    return f'lib-{version}-{h}'
+
+
+def parse_fields(raw: Optional[str]) -> Dict[str, int]:
+    names = [f.strip() for f in (raw or '').split(',') if f.strip()] or list(DEFAULT_FIELDS)
+    proj = {f: 1 for f in names
+            if f not in BLOCKED_FIELDS and f not in VOLATILE_FIELDS and not f.startswith('$')}
+    # Siempre hacen falta para el cursor
+    proj['_id'] = 1
+    proj['uploaded_at'] = 1
+    return proj
+
+
+def encode_cursor(doc: dict) -> str:
+    _id = doc.get('_id')
+    payload = [doc.get('uploaded_at'), str(_id), isinstance(_id, ObjectId)]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(raw: str):
+    """Devuelve (uploaded_at, _id) o lanza ValueError."""
+    try:
+        padded = raw + '=' * (-len(raw) % 4)
+        uploaded_at, _id, is_oid = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return uploaded_at, (ObjectId(_id) if is_oid else _id)
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
+def _after_cursor(uploaded_at, _id) -> dict:
+    # Orden descendente; los documentos sin uploaded_at (null) van al final
+    if uploaded_at is None:
+        return {'uploaded_at': None, '_id': {'$lt': _id}}
+    return {'$or': [
+        {'uploaded_at': {'$lt': uploaded_at}},
+        {'uploaded_at': uploaded_at, '_id': {'$lt': _id}},
+        {'uploaded_at': None},
+    ]}
+
+
+def build_filter(category: Optional[str] = None, level: Optional[str] = None,
+                 is_chapter: Optional[bool] = None, parent_id: Optional[str] = None) -> dict:
+    query = {}
+    if category:
+        query['category'] = category
+    if level:
+        query['level'] = level
+    if is_chapter is True:
+        query['is_chapter'] = True
+    elif is_chapter is False:
+        # Los libros antiguos no tienen el campo
+        query['is_chapter'] = {'$ne': True}
+    if parent_id:
+        query['parent_id'] = {'$in': id_variants(parent_id)}
+    return query
+
+
+def list_books(collection, query: dict, projection: Dict[str, int], limit: int = DEFAULT_LIMIT,
+               cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Una página del listado y el cursor de la siguiente (None si no hay más)."""
+    limit = max(1, min(MAX_LIMIT, int(limit or DEFAULT_LIMIT)))
+    q = dict(query)
+    if cursor:
+        after = _after_cursor(*decode_cursor(cursor))
+        q = {'$and': [q, after]} if q else after
+    docs = list(collection.find(q, projection).sort([('uploaded_at', -1), ('_id', -1)]).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
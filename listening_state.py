@@ -0,0 +1,203 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from book_ids import canonical_id, id_variants
+
+# Estado de escucha por usuario: un documento por (user_id, book_id) en la
+# colección `listening_state` con posición, progreso y fechas de reproducción.
+# Las escrituras llegan en lote desde PlaybackBuffer (write_behind.py); aquí
+# solo se construyen los campos y se leen recientes / continuar / posición, todo
+# con rangos sobre los índices (user_id, last_played_at) y
+# (user_id, in_progress, last_played_at) declarados en db_indexes.py.
+# /recientes usa una única agregación ($match + $facet) que devuelve las
+# tarjetas de la página y los contadores a la vez: el coste depende de lo que el
+# usuario escuchó en la ventana, no del tamaño del catálogo.
+
+DEFAULT_RECENT_LIMIT = 20
+MAX_RECENT_LIMIT = 100
+RECENT_PAGE_SIZE = 24
+# /recientes: resultado por usuario reutilizado durante unos segundos
+SUMMARY_CACHE_SECONDS = float(os.environ.get('RECIENTES_CACHE_SECONDS', '5'))
+SUMMARY_CACHE_SIZE = 1024
+
+# Campos del catálogo que acompañan a cada entrada
+BOOK_CARD_FIELDS = {
+    'title': 1, 'subtitle': 1, 'category': 1, 'categoryLabel': 1, 'level': 1, 'levelLabel': 1,
+    'duration': 1, 'duration_seconds': 1, 'audio_url': 1, 'audio_filename': 1, 'cover_image_url': 1,
+    'is_chapter': 1, 'parent_id': 1, 'chapter_number': 1,
+}
+_STATE_FIELDS = {'_id': 0, 'book_id': 1, 'last_played_at': 1, 'position_sec': 1, 'duration_sec': 1,
+                 'progress': 1, 'completed_at': 1, 'in_progress': 1}
+
+
+def state_book_id(book_id) -> str:
+    """book_id canónico como string (así se guarda en listening_state)."""
+    cid = canonical_id(book_id)
+    return str(cid) if cid is not None else ''
+
+
+def playback_fields(event: str, position: float, duration: float, now: datetime, book_id=None) -> Dict:
+    """Campos de listening_state para un evento de reproducción.
+    `book_ref` es el _id del libro con su tipo (para $lookup contra `libros`)."""
+    fields = {'last_played_at': now}
+    if book_id is not None:
+        fields['book_ref'] = canonical_id(book_id)
+    if duration and duration > 0:
+        fields['progress'] = int(max(0, min(100, round((position / duration) * 100))))
+        fields['position_sec'] = int(max(0, round(position)))
+        fields['duration_sec'] = int(max(0, round(duration)))
+    if event == 'ended':
+        fields['progress'] = 100
+        fields['position_sec'] = 0
+        fields['completed_at'] = now
+    progress = fields.get('progress')
+    if progress is not None:
+        fields['in_progress'] = 0 < progress < 100
+    return fields
+
+
+class ListeningState:
+    def __init__(self, collection, books_collection=None, cache_seconds: float = SUMMARY_CACHE_SECONDS):
+        self.collection = collection
+        self.books_collection = books_collection
+        self.cache_seconds = cache_seconds
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _with_books(self, states: List[Dict]) -> List[Dict]:
+        """Une cada estado con su ficha de catálogo (una sola consulta $in por _id)."""
+        if not states or self.books_collection is None:
+            return states
+        ids = []
+        for s in states:
+            ids.extend(id_variants(s.get('book_id')))
+        books = {}
+        for b in self.books_collection.find({'_id': {'$in': ids}}, dict(BOOK_CARD_FIELDS)):
+            books[str(b['_id'])] = b
+        out = []
+        for s in states:
+            book = books.get(s.get('book_id'))
+            if book is None:
+                continue  # libro borrado
+            card = dict(book, **s)
+            card['_id'] = str(book['_id'])
+            if card.get('parent_id') is not None:
+                card['parent_id'] = str(card['parent_id'])
+            out.append(card)
+        return out
+
+    def recent(self, user_id: str, since: Optional[datetime] = None,
+               limit: int = DEFAULT_RECENT_LIMIT) -> List[Dict]:
+        if self.collection is None or not user_id:
+            return []
+        q = {'user_id': str(user_id)}
+        if since is not None:
+            q['last_played_at'] = {'$gte': since}
+        limit = max(1, min(MAX_RECENT_LIMIT, int(limit or DEFAULT_RECENT_LIMIT)))
+        states = list(self.collection.find(q, _STATE_FIELDS).sort('last_played_at', -1).limit(limit))
+        return self._with_books(states)
+
+    def _summary_pipeline(self, user_id: str, since: datetime, today_start: datetime,
+                          skip: int, limit: int) -> List[Dict]:
+        projection = {f: 1 for f in _STATE_FIELDS if f != '_id'}
+        projection.update({f'book.{f}': 1 for f in list(BOOK_CARD_FIELDS) + ['_id']})
+        projection['_id'] = 0
+        cards = [
+            {'$sort': {'last_played_at': -1}},
+            {'$skip': skip},
+            {'$limit': limit},
+        ]
+        if self.books_collection is not None:
+            cards.append({'$lookup': {'from': self.books_collection.name, 'localField': 'book_ref',
+                                      'foreignField': '_id', 'as': 'book'}})
+        cards.append({'$project': projection})
+        return [
+            {'$match': {'user_id': str(user_id), 'last_played_at': {'$gte': since}}},
+            {'$facet': {
+                'cards': cards,
+                'total': [{'$count': 'n'}],
+                # Completados: terminados dentro de la ventana
+                'completed': [{'$match': {'completed_at': {'$gte': since}}}, {'$count': 'n'}],
+                'today': [{'$match': {'completed_at': {'$gte': today_start}}}, {'$count': 'n'}],
+                # En progreso: empezados y no completados en la ventana
+                'in_progress': [{'$match': {'progress': {'$gt': 0, '$lt': 100},
+                                            'completed_at': {'$not': {'$gte': since}}}},
+                                {'$count': 'n'}],
+            }},
+        ]
+
+    def recent_summary(self, user_id: str, since: datetime, today_start: datetime,
+                       page: int = 1, page_size: int = RECENT_PAGE_SIZE) -> Dict:
+        """Tarjetas (paginadas) y contadores total/completed/in_progress/today de la
+        ventana, en una sola agregación. Cacheado `cache_seconds` por usuario y página."""
+        empty = {'cards': [], 'total': 0, 'completed': 0, 'in_progress': 0, 'today': 0,
+                 'page': 1, 'pages': 1}
+        if self.collection is None or not user_id:
+            return empty
+        page = max(1, int(page or 1))
+        page_size = max(1, min(MAX_RECENT_LIMIT, int(page_size or RECENT_PAGE_SIZE)))
+        key = (str(user_id), page, page_size)
+        now_ts = datetime.utcnow().timestamp()
+        with self._cache_lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] > now_ts:
+                return hit[1]
+        pipeline = self._summary_pipeline(user_id, since, today_start, (page - 1) * page_size, page_size)
+        facet = next(iter(self.collection.aggregate(pipeline)), None) or {}
+
+        def count(name):
+            rows = facet.get(name) or []
+            return int(rows[0].get('n') or 0) if rows else 0
+
+        cards = []
+        missing = []
+        for row in facet.get('cards') or []:
+            book = (row.pop('book', None) or [None])[0]
+            if book is None:
+                missing.append(row)  # sin book_ref o _id sin normalizar
+                continue
+            card = dict(book, **row)
+            card['_id'] = str(book['_id'])
+            if card.get('parent_id') is not None:
+                card['parent_id'] = str(card['parent_id'])
+            cards.append(card)
+        if missing:
+            joined = {c['book_id']: c for c in self._with_books(missing)}
+            cards = sorted(cards + list(joined.values()),
+                           key=lambda c: c.get('last_played_at') or datetime.min, reverse=True)
+        total = count('total')
+        result = dict(empty, cards=cards, total=total, completed=count('completed'),
+                      in_progress=count('in_progress'), today=count('today'), page=page,
+                      pages=max(1, -(-total // page_size)))
+        with self._cache_lock:
+            self._cache[key] = (now_ts + self.cache_seconds, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > SUMMARY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    def continue_listening(self, user_id: str, limit: int = 10) -> List[Dict]:
+        if self.collection is None or not user_id:
+            return []
+        limit = max(1, min(MAX_RECENT_LIMIT, int(limit or 10)))
+        states = list(self.collection.find({'user_id': str(user_id), 'in_progress': True}, _STATE_FIELDS)
+                      .sort('last_played_at', -1).limit(limit))
+        return self._with_books(states)
+
+    def position(self, user_id: str, book_id) -> Optional[Dict]:
+        if self.collection is None or not user_id:
+            return None
+        return self.collection.find_one({'user_id': str(user_id), 'book_id': state_book_id(book_id)}, _STATE_FIELDS)
+
+    def forget_book(self, book_id):
+        """Borra el estado de todos los usuarios para un libro eliminado."""
+        if self.collection is None:
+            return
+        try:
+            self.collection.delete_many({'book_id': state_book_id(book_id)})
+        except Exception as e:
+            print(f"⚠️  No se pudo borrar listening_state de {book_id}: {e}")
+
@@ -0,0 +1,182 @@
+import struct
+from typing import List, Optional, Tuple
+
+# Unión de archivos MP3 a nivel de frame.
+# Concatenar bytes de varios MP3 deja varias etiquetas ID3 y cabeceras Xing/VBRI
+# intercaladas; los reproductores calculan mal la duración y el seek. Aquí se
+# extraen solo los frames de audio de cada parte y se escribe una cabecera
+# Xing/Info nueva con el total de frames, bytes y la tabla TOC de seek.
+
+_BITRATES = {
+    # (version_bits == 3 -> MPEG1) Layer III
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    # MPEG2 / MPEG2.5 Layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG1
+    2: [22050, 24000, 16000],  # MPEG2
+    0: [11025, 12000, 8000],   # MPEG2.5
+}
+
+
+class FrameHeader:
+    __slots__ = ('raw', 'version_bits', 'bitrate_index', 'sr_index', 'padding',
+                 'channel_mode', 'bitrate', 'sample_rate', 'length', 'samples')
+
+    def __init__(self, raw: int):
+        self.raw = raw
+        self.version_bits = (raw >> 19) & 0x3
+        self.bitrate_index = (raw >> 12) & 0xF
+        self.sr_index = (raw >> 10) & 0x3
+        self.padding = (raw >> 9) & 0x1
+        self.channel_mode = (raw >> 6) & 0x3
+        mpeg1 = self.version_bits == 3
+        self.bitrate = _BITRATES[1 if mpeg1 else 2][self.bitrate_index] * 1000
+        self.sample_rate = _SAMPLE_RATES[self.version_bits][self.sr_index]
+        self.samples = 1152 if mpeg1 else 576
+        coef = 144 if mpeg1 else 72
+        self.length = coef * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_size(self) -> int:
+        mono = self.channel_mode == 3
+        if self.version_bits == 3:
+            return 17 if mono else 32
+        return 9 if mono else 17
+
+
+def _parse_header(data: bytes, pos: int) -> Optional[FrameHeader]:
+    if pos + 4 > len(data):
+        return None
+    raw = struct.unpack('>I', data[pos:pos + 4])[0]
+    if (raw >> 21) & 0x7FF != 0x7FF:
+        return None
+    version_bits = (raw >> 19) & 0x3
+    layer_bits = (raw >> 17) & 0x3
+    bitrate_index = (raw >> 12) & 0xF
+    sr_index = (raw >> 10) & 0x3
+    # Solo Layer III (0b01); descartar valores reservados
+    if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or sr_index == 3:
+        return None
+    hdr = FrameHeader(raw)
+    if hdr.length < 4:
+        return None
+    return hdr
+
+
+def _skip_tags(data: bytes) -> Tuple[int, int]:
+    """Devuelve (inicio, fin) del área de audio sin ID3v2 inicial ni ID3v1 final."""
+    start = 0
+    while data[start:start + 3] == b'ID3' and len(data) >= start + 10:
+        size = data[start + 6:start + 10]
+        tag_len = (size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3]
+        footer = 10 if data[start + 5] & 0x10 else 0
+        start += 10 + tag_len + footer
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    return start, end
+
+
+def _is_info_frame(data: bytes, pos: int, hdr: FrameHeader) -> bool:
+    xing_at = pos + 4 + hdr.side_info_size
+    if data[xing_at:xing_at + 4] in (b'Xing', b'Info'):
+        return True
+    return data[pos + 36:pos + 40] == b'VBRI'
+
+
+def iter_frames(data: bytes):
+    """Itera (offset, FrameHeader) sobre los frames de audio de un MP3.
+    Omite etiquetas y la cabecera Xing/Info/VBRI del primer frame.
+    """
+    start, end = _skip_tags(data)
+    pos = start
+    first = True
+    while pos + 4 <= end:
+        hdr = _parse_header(data, pos)
+        if hdr is None or pos + hdr.length > end:
+            # Resincronizar: avanzar hasta el siguiente byte 0xFF
+            nxt = data.find(b'\xff', pos + 1, end)
+            if nxt < 0:
+                break
+            pos = nxt
+            continue
+        if first:
+            first = False
+            if _is_info_frame(data, pos, hdr):
+                pos += hdr.length
+                continue
+        yield pos, hdr
+        pos += hdr.length
+
+
+def _build_xing_frame(template: FrameHeader, frame_count: int, frame_offsets: List[int],
+                      audio_bytes: int, is_vbr: bool) -> bytes:
+    """Construye un frame vacío con cabecera Xing (VBR) o Info (CBR)."""
+    mpeg1 = template.version_bits == 3
+    table = _BITRATES[1 if mpeg1 else 2]
+    side = template.side_info_size
+    needed = 4 + side + 4 + 4 + 4 + 4 + 100
+    # Elegir el bitrate más bajo cuyo frame quepa la cabecera Xing completa
+    bitrate_index = template.bitrate_index
+    for idx in range(1, 15):
+        coef = 144 if mpeg1 else 72
+        length = coef * table[idx] * 1000 // template.sample_rate
+        if length >= needed:
+            bitrate_index = idx
+            break
+    # Cabecera: misma versión/frecuencia/canales, sin CRC, sin padding
+    raw = template.raw
+    raw |= (1 << 16)                      # protection bit = 1 (sin CRC)
+    raw = (raw & ~(0xF << 12)) | (bitrate_index << 12)
+    raw &= ~(1 << 9)                      # sin padding
+    hdr = FrameHeader(raw)
+    frame = bytearray(hdr.length)
+    struct.pack_into('>I', frame, 0, raw)
+
+    total_bytes = audio_bytes + hdr.length
+    toc = bytearray(100)
+    if frame_count > 0 and total_bytes > 0:
+        for i in range(100):
+            idx = min(frame_count - 1, int(i * frame_count / 100))
+            toc[i] = min(255, int((frame_offsets[idx] + hdr.length) * 256 / total_bytes))
+    at = 4 + side
+    frame[at:at + 4] = b'Xing' if is_vbr else b'Info'
+    struct.pack_into('>I', frame, at + 4, 0x0007)  # frames | bytes | TOC
+    struct.pack_into('>I', frame, at + 8, frame_count)
+    struct.pack_into('>I', frame, at + 12, total_bytes)
+    frame[at + 16:at + 116] = toc
+    return bytes(frame)
+
+
+def join_mp3_parts(parts: List[bytes]) -> bytes:
+    """Une varios MP3 en uno solo a nivel de frame con cabecera Xing/Info reescrita.
+    Si no se reconocen frames (formato inesperado) devuelve la concatenación simple.
+    """
+    parts = [p for p in parts if p]
+    if not parts:
+        return b''
+    if len(parts) == 1:
+        return parts[0]
+    frames = []
+    offsets = []
+    template = None
+    bitrates = set()
+    size = 0
+    for data in parts:
+        for pos, hdr in iter_frames(data):
+            if template is None:
+                template = hdr
+            elif (hdr.version_bits, hdr.sr_index) != (template.version_bits, template.sr_index):
+                # Partes con distinta frecuencia no pueden mezclarse en un mismo stream
+                raise ValueError('Las partes MP3 tienen distinta frecuencia de muestreo')
+            offsets.append(size)
+            frames.append(data[pos:pos + hdr.length])
+            size += hdr.length
+            bitrates.add(hdr.bitrate_index)
+    if template is None:
+        return b''.join(parts)
+    xing = _build_xing_frame(template, len(frames), offsets, size, is_vbr=len(bitrates) > 1)
+    return xing + b''.join(frames)
+
@@ -0,0 +1,122 @@
+import os
+import atexit
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import PyPDF2
+
+# Extracción de texto PDF por páginas.
+# Los rangos de páginas se reparten en un pool de procesos (PyPDF2 es Python puro
+# y no libera el GIL) y se entregan en orden mediante un generador: el consumidor
+# puede empezar a trabajar con las primeras páginas mientras el resto se extrae,
+# y como mucho `window` rangos están en vuelo a la vez (memoria acotada).
+
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', '16'))
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Páginas por debajo de este número se extraen en el propio proceso
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '48'))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class PageText(NamedTuple):
+    index: int   # número de página (0-based)
+    text: str
+    start: int   # offset del primer carácter en el texto concatenado
+    end: int     # offset exclusivo del final
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if PDF_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+                atexit.register(_pool.shutdown, wait=False)
+            except Exception as e:
+                print(f"⚠️  Pool de extracción PDF no disponible, se usará un solo proceso: {e}")
+                return None
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    """Tarea del pool: extrae las páginas [start, stop) de `path`."""
+    with open(path, 'rb') as fh:
+        reader = PyPDF2.PdfReader(fh)
+        out = []
+        for i in range(start, stop):
+            try:
+                out.append(reader.pages[i].extract_text() or '')
+            except Exception:
+                # Una página corrupta no debe invalidar el documento entero
+                out.append('')
+        return out
+
+
+def _iter_sequential(path: str, start: int = 0) -> Iterator[Tuple[int, str]]:
+    with open(path, 'rb') as fh:
+        reader = PyPDF2.PdfReader(fh)
+        for i in range(start, len(reader.pages)):
+            try:
+                yield i, reader.pages[i].extract_text() or ''
+            except Exception:
+                yield i, ''
+
+
+def _iter_parallel(path: str, n_pages: int, pool: ProcessPoolExecutor, per_task: int,
+                   window: int) -> Iterator[Tuple[int, str]]:
+    ranges = deque((s, min(s + per_task, n_pages)) for s in range(0, n_pages, per_task))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < window:
+                s, e = ranges.popleft()
+                in_flight.append((s, pool.submit(_extract_range, path, s, e)))
+            s, fut = in_flight.popleft()
+            for offset, text in enumerate(fut.result()):
+                yield s + offset, text
+    finally:
+        # Consumidor que abandona el generador: no dejar trabajo pendiente en el pool
+        for _, fut in in_flight:
+            fut.cancel()
+
+
+def iter_pdf_pages(path: str, pages_per_task: int = PDF_PAGES_PER_TASK,
+                   window: Optional[int] = None) -> Iterator[PageText]:
+    """Genera las páginas de `path` en orden con sus offsets en el texto concatenado."""
+    with open(path, 'rb') as fh:
+        n_pages = len(PyPDF2.PdfReader(fh).pages)
+    pool = _get_pool() if n_pages >= PDF_PARALLEL_MIN_PAGES else None
+    if pool is not None:
+        source = _iter_parallel(path, n_pages, pool, max(1, pages_per_task), window or PDF_WORKERS * 2)
+    else:
+        source = _iter_sequential(path)
+    pos = 0
+    emitted = 0
+    try:
+        for index, text in source:
+            yield PageText(index, text, pos, pos + len(text))
+            pos += len(text)
+            emitted += 1
+    except Exception as e:
+        if pool is None or emitted >= n_pages:
+            raise
+        # Pool roto (p.ej. un worker murió): continuar en este proceso desde donde iba
+        print(f"⚠️  Extracción PDF paralela falló ({e}); continuando en un solo proceso")
+        _reset_pool()
+        for index, text in _iter_sequential(path, start=emitted):
+            yield PageText(index, text, pos, pos + len(text))
+            pos += len(text)
@@ -0,0 +1,423 @@
+import os
+import re
+import math
+import heapq
+from bisect import bisect_left, insort
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from book_ids import id_variants
+
+# Índice invertido en memoria para /api/search (BM25F).
+# - Texto normalizado: minúsculas y sin acentos ("Canción" == "cancion").
+# - Campos con peso propio: título, subtítulo, categoría, topics del análisis y
+#   resumen; cada campo normaliza la frecuencia por su longitud media (BM25F).
+# - Se construye al arrancar y se actualiza por libro en altas, ediciones y
+#   borrados de este proceso. Los cambios hechos por otros procesos (worker)
+#   se detectan por la versión de la biblioteca (counters.libros) y provocan una
+#   reconstrucción en segundo plano.
+# - Una consulta solo recorre las listas de sus términos y devuelve el top-k
+#   con un heap sobre todo el catálogo.
+# PrefixIndex (autocompletado) comparte el mismo mantenimiento: un array
+# ordenado de claves normalizadas (bisect) sobre títulos, subtítulos y
+# categorías, ponderado por play_count.
+
+SEARCH_REFRESH_SECONDS = float(os.environ.get('SEARCH_REFRESH_SECONDS', '30'))
+
+# (campo del documento, peso, b)
+FIELDS: Tuple[Tuple[str, float, float], ...] = (
+    ('title', 3.0, 0.75),
+    ('subtitle', 2.0, 0.75),
+    ('category', 2.0, 0.3),
+    ('topics', 2.0, 0.5),
+    ('summary', 1.0, 0.75),
+)
+K1 = 1.2
+
+# Autocompletado: (campo, etiqueta, bonus de ranking)
+SUGGEST_FIELDS: Tuple[Tuple[str, str, float], ...] = (
+    ('title', 'title', 1.0),
+    ('categoryLabel', 'category', 0.5),
+    ('subtitle', 'subtitle', 0.0),
+)
+SUGGEST_LIMIT = 10
+# Rango máximo de claves que se puntúa entero; con más coincidencias (prefijos
+# cortos) se recorren las frases de más a menos populares hasta llenar el top-k
+_SCAN_LIMIT = 2000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a al algo como con de del el ella en entre es esta este esto la las le lo los mas mi no o para pero por que se
+sin sobre su sus un una uno unos y ya the of and to in
+""".split())
+
+
+def fold(text) -> str:
+    """Minúsculas y sin diacríticos."""
+    t = unicodedata.normalize('NFKD', str(text or '')).lower()
+    return ''.join(ch for ch in t if not unicodedata.combining(ch))
+
+
+def tokenize(text) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(fold(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+def phrase_key(text) -> str:
+    """Clave de autocompletado: texto normalizado con un espacio entre palabras."""
+    return ' '.join(_TOKEN_RE.findall(fold(text)))
+
+
+def book_fields(doc: dict, summary: Optional[str] = None) -> Dict[str, str]:
+    """Texto indexable de cada campo de un libro."""
+    topics = doc.get('topics')
+    if topics is None:
+        topics = ((doc.get('analysis') or {}).get('topics') if isinstance(doc.get('analysis'), dict) else None)
+    return {
+        'title': doc.get('title') or '',
+        'subtitle': doc.get('subtitle') or '',
+        'category': f"{doc.get('category') or ''} {doc.get('categoryLabel') or ''}",
+        'topics': ' '.join(str(t) for t in (topics or [])),
+        'summary': summary if summary is not None else (doc.get('summary') or ''),
+    }
+
+
+_INDEX_PROJECTION = {'title': 1, 'subtitle': 1, 'category': 1, 'categoryLabel': 1, 'topics': 1,
+                     'summary': 1, 'play_count': 1}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # término -> {doc_id: [tf por campo]}
+        self._postings: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+        # doc_id -> (longitud por campo, términos del documento)
+        self._docs: Dict[str, Tuple[List[int], Tuple[str, ...]]] = {}
+        self._len_totals = [0] * len(FIELDS)
+        self.version = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def term_count(self) -> int:
+        return len(self._postings)
+
+    # -- mantenimiento --
+    def add(self, doc_id, fields: Dict[str, str]):
+        doc_id = str(doc_id)
+        per_field = [tokenize(fields.get(name, '')) for name, _w, _b in FIELDS]
+        tfs: Dict[str, List[int]] = {}
+        for i, tokens in enumerate(per_field):
+            for tok in tokens:
+                tf = tfs.get(tok)
+                if tf is None:
+                    tf = tfs[tok] = [0] * len(FIELDS)
+                tf[i] += 1
+        lengths = [len(t) for t in per_field]
+        with self._lock:
+            self._remove_locked(doc_id)
+            for tok, tf in tfs.items():
+                self._postings[tok][doc_id] = tf
+            self._docs[doc_id] = (lengths, tuple(tfs))
+            for i, n in enumerate(lengths):
+                self._len_totals[i] += n
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(str(doc_id))
+
+    def _remove_locked(self, doc_id: str):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        lengths, terms = entry
+        for i, n in enumerate(lengths):
+            self._len_totals[i] -= n
+        for tok in terms:
+            plist = self._postings.get(tok)
+            if plist is not None:
+                plist.pop(doc_id, None)
+                if not plist:
+                    del self._postings[tok]
+
+    # -- consulta --
+    def search(self, query: str, k: int = 30, extra_terms: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """Top-k (doc_id, score) por BM25F."""
+        terms = list(dict.fromkeys(tokenize(query) + [t for e in extra_terms for t in tokenize(e)]))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg = [max(total / n_docs, 1e-9) for total in self._len_totals]
+            scores: Dict[str, float] = defaultdict(float)
+            for term in terms:
+                plist = self._postings.get(term)
+                if not plist:
+                    continue
+                df = len(plist)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in plist.items():
+                    lengths = self._docs[doc_id][0]
+                    wtf = 0.0
+                    for i, (_name, weight, b) in enumerate(FIELDS):
+                        if tf[i]:
+                            wtf += weight * tf[i] / (1 - b + b * lengths[i] / avg[i])
+                    scores[doc_id] += idf * wtf / (K1 + wtf)
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+    # -- construcción --
+    @classmethod
+    def build(cls, books, details=None, prefix: Optional['PrefixIndex'] = None) -> 'SearchIndex':
+        """Índice completo desde `libros` (+ resúmenes de `book_details`).
+        Si se pasa `prefix`, se llena en la misma lectura."""
+        index = cls()
+        if books is None:
+            return index
+        summaries = {}
+        if details is not None:
+            for d in details.find({'summary': {'$exists': True}}, {'summary': 1}):
+                summaries[str(d['_id'])] = d.get('summary') or ''
+        for doc in books.find({}, dict(_INDEX_PROJECTION, **{'analysis.topics': 1})):
+            index.add(doc['_id'], book_fields(doc, summaries.get(str(doc['_id']))))
+            if prefix is not None:
+                prefix.add(doc['_id'], doc, doc.get('play_count') or 0, bulk=True)
+        if prefix is not None:
+            prefix.finish_bulk()
+        return index
+
+
+class PrefixIndex:
+    """Sugerencias por prefijo sobre frases (título, subtítulo, categoría).
+
+    Cada frase se indexa por su inicio y por el inicio de cada palabra
+    ("quij" encuentra "El Quijote"). Las frases repetidas en varios libros se
+    guardan una vez y suman la popularidad de todos ellos.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # (clave desde una palabra, clave de frase) ordenados
+        self._keys: List[Tuple[str, Tuple[str, str]]] = []
+        # (tipo, clave) -> [texto, bonus, {book_id: play_count}]
+        self._phrases: Dict[Tuple[str, str], list] = {}
+        self._by_book: Dict[str, List[Tuple[str, str]]] = {}
+        # (-puntuación base, clave de frase), de más a menos popular
+        self._ranked: List[Tuple[float, Tuple[str, str]]] = []
+
+    def __len__(self):
+        return len(self._phrases)
+
+    @staticmethod
+    def _suffixes(key: str) -> List[str]:
+        words = key.split(' ')
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def add(self, book_id, doc: dict, play_count: int = 0, bulk: bool = False):
+        book_id = str(book_id)
+        with self._lock:
+            self._remove_locked(book_id)
+            own = []
+            for field, kind, bonus in SUGGEST_FIELDS:
+                text = str(doc.get(field) or (doc.get('category') if field == 'categoryLabel' else '') or '').strip()
+                key = phrase_key(text)
+                if not key or (kind, key) in own:
+                    continue
+                pkey = (kind, key)
+                phrase = self._phrases.get(pkey)
+                if phrase is None:
+                    phrase = self._phrases[pkey] = [text, bonus, {}]
+                    for suffix in self._suffixes(key):
+                        if bulk:
+                            self._keys.append((suffix, pkey))
+                        else:
+                            insort(self._keys, (suffix, pkey))
+                phrase[2][book_id] = int(play_count or 0)
+                if not bulk:
+                    insort(self._ranked, (-self._base_score(phrase), pkey))
+                own.append(pkey)
+            self._by_book[book_id] = own
+
+    def finish_bulk(self):
+        with self._lock:
+            self._keys.sort()
+            self._rerank()
+
+    @staticmethod
+    def _base_score(phrase: list) -> float:
+        return phrase[1] + math.log1p(sum(phrase[2].values()))
+
+    def _rerank(self):
+        self._ranked = sorted((-self._base_score(p), pkey) for pkey, p in self._phrases.items())
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove_locked(str(book_id))
+
+    def _remove_locked(self, book_id: str):
+        own = self._by_book.pop(book_id, None)
+        if not own:
+            return
+        for pkey in own:
+            phrase = self._phrases.get(pkey)
+            if phrase is None:
+                continue
+            phrase[2].pop(book_id, None)
+            if phrase[2]:
+                continue
+            del self._phrases[pkey]
+            for suffix in self._suffixes(pkey[1]):
+                i = bisect_left(self._keys, (suffix, pkey))
+                if i < len(self._keys) and self._keys[i] == (suffix, pkey):
+                    del self._keys[i]
+        # Las entradas de _ranked de frases borradas se saltan al recorrerlo
+        if len(self._ranked) > 2 * len(self._phrases) + 64:
+            self._rerank()
+
+    def add_plays(self, book_id, n: int = 1):
+        """Suma reproducciones (en memoria) a las frases del libro. El orden por
+        popularidad de prefijos cortos se recalcula en la próxima reconstrucción."""
+        book_id = str(book_id)
+        with self._lock:
+            for pkey in self._by_book.get(book_id, ()):
+                plays = self._phrases[pkey][2]
+                plays[book_id] = plays.get(book_id, 0) + n
+
+    def suggest(self, query: str, limit: int = SUGGEST_LIMIT) -> List[str]:
+        q = phrase_key(query)
+        if not q:
+            return []
+        with self._lock:
+            keys = self._keys
+            lo = bisect_left(keys, (q,))
+            hi = bisect_left(keys, (q + '\uffff',), lo)
+            scores: Dict[Tuple[str, str], float] = {}
+            if hi - lo <= _SCAN_LIMIT:
+                for suffix, pkey in keys[lo:hi]:
+                    # Coincidencia al inicio de la frase antes que a mitad
+                    score = self._base_score(self._phrases[pkey]) + (2.0 if suffix == pkey[1] else 0.0)
+                    if score > scores.get(pkey, -1.0):
+                        scores[pkey] = score
+            else:
+                # Muchas coincidencias: bastan las primeras de la lista por popularidad
+                wanted = 3 * max(limit, SUGGEST_LIMIT)
+                word_start = ' ' + q
+                for neg, pkey in self._ranked:
+                    if pkey in scores or pkey not in self._phrases:
+                        continue
+                    key = pkey[1]
+                    if key.startswith(q):
+                        scores[pkey] = -neg + 2.0
+                    elif word_start in key:
+                        scores[pkey] = -neg
+                    else:
+                        continue
+                    if len(scores) >= wanted:
+                        break
+            top = heapq.nlargest(len(scores), scores.items(), key=lambda kv: kv[1])
+            out, seen = [], set()
+            for pkey, _score in top:
+                text = self._phrases[pkey][0]
+                if text not in seen:
+                    seen.add(text)
+                    out.append(text)
+                    if len(out) >= limit:
+                        break
+        return out
+
+
+class LiveSearchIndex:
+    """SearchIndex que se mantiene al día: updates por libro y reconstrucción
+    cuando otro proceso cambió la biblioteca."""
+
+    def __init__(self, books, details=None, version_fn=None, refresh_seconds: float = SEARCH_REFRESH_SECONDS):
+        self.books = books
+        self.details = details
+        self.version_fn = version_fn
+        self.refresh_seconds = refresh_seconds
+        self.index = SearchIndex()
+        self.prefix = PrefixIndex()
+        self.ready = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._rebuild_lock = threading.Lock()
+
+    def rebuild(self) -> SearchIndex:
+        with self._rebuild_lock:
+            version = self.version_fn() if self.version_fn else None
+            t0 = time.time()
+            prefix = PrefixIndex()
+            fresh = SearchIndex.build(self.books, self.details, prefix)
+            fresh.version = version
+            self.index, self.prefix = fresh, prefix
+            self.ready = True
+            print(f"🔎 Índice de búsqueda: {len(fresh)} libros en {(time.time() - t0) * 1000:.0f} ms")
+            return fresh
+
+    def upsert(self, book_id):
+        """Reindexa un libro leyendo su ficha actual (una consulta por _id); si ya
+        no existe, lo quita del índice."""
+        if not self.ready or self.books is None or book_id is None:
+            return
+        try:
+            ids = id_variants(book_id)
+            doc = self.books.find_one({'_id': {'$in': ids}}, dict(_INDEX_PROJECTION))
+            if doc is None:
+                self.remove(book_id)
+                return
+            summary = None
+            if self.details is not None:
+                summary = (self.details.find_one({'_id': doc['_id']}, {'summary': 1}) or {}).get('summary')
+            self.index.add(doc['_id'], book_fields(doc, summary))
+            self.prefix.add(doc['_id'], doc, doc.get('play_count') or 0)
+        except Exception as e:
+            print(f"⚠️  No se pudo actualizar el índice de búsqueda para {book_id}: {e}")
+
+    def remove(self, book_id):
+        for v in id_variants(book_id):
+            self.index.remove(v)
+            self.prefix.remove(v)
+
+    def add_plays(self, book_id, n: int = 1):
+        self.prefix.add_plays(book_id, n)
+
+    def suggest(self, query: str, limit: int = SUGGEST_LIMIT) -> List[str]:
+        """Autocompletado desde memoria (nunca consulta MongoDB; vacío hasta que el índice esté listo)."""
+        return self.prefix.suggest(query, limit)
+
+    def search(self, query: str, k: int = 30, extra_terms: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        if not self.ready:
+            self.rebuild()
+        return self.index.search(query, k, extra_terms)
+
+    def _loop(self):
+        if not self.ready:
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"⚠️  No se pudo construir el índice de búsqueda: {e}")
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                version = self.version_fn() if self.version_fn else None
+                if version != self.index.version:
+                    self.rebuild()
+            except Exception as e:
+                print(f"⚠️  Error refrescando el índice de búsqueda: {e}")
+
+    def start(self):
+        """Construye el índice en segundo plano y lo refresca cada `refresh_seconds`."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='search-index-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self) -> Dict:
+        index = self.index
+        return {'ready': self.ready, 'books': len(index), 'terms': index.term_count, 'phrases': len(self.prefix),
+                'version': index.version, 'refresh_seconds': self.refresh_seconds}
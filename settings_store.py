@@ -0,0 +1,223 @@
+import os
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt  # type: ignore
+
+# Configuración de ejecución con caché en memoria.
+# - Las lecturas (get) solo consultan un snapshot inmutable en memoria: cero I/O.
+# - Un hilo de fondo revisa cada `refresh_seconds` el mtime de settings.json y,
+#   si hay MongoDB, un contador de versión en la colección `settings`; si cambió,
+#   recarga. Así todos los procesos ven los cambios en a lo sumo `refresh_seconds`.
+# - Las escrituras toman un lock de archivo entre procesos, escriben a un temporal
+#   y hacen os.replace (atómico), y luego incrementan la versión en MongoDB.
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    'tts_primary': 'elevenlabs',
+    'eleven_voice_id': os.environ.get('ELEVEN_VOICE_ID') or 'Rachel',
+    'eleven_model': os.environ.get('ELEVEN_MODEL', 'eleven_multilingual_v2'),
+    'eleven_chunk_chars': int(os.environ.get('ELEVEN_CHUNK_CHARS', '4000')),
+    'google_tts_chunk_bytes': int(os.environ.get('GOOGLE_TTS_CHUNK_BYTES', '4800')),
+    'ai_provider_order': ['gemini', 'openai'],
+}
+
+_CHOICES = {
+    'tts_primary': ('elevenlabs', 'google'),
+}
+_AI_PROVIDERS = ('gemini', 'openai')
+_VERSION_DOC_ID = 'runtime'
+
+
+def _coerce(key: str, value, default):
+    """Valida/convierte un valor al tipo de su default. Lanza ValueError si no es válido."""
+    if isinstance(default, bool):
+        return bool(value)
+    if isinstance(default, int):
+        v = int(value)
+        if v <= 0:
+            raise ValueError(f"{key} debe ser positivo")
+        return v
+    if isinstance(default, list):
+        if isinstance(value, str):
+            value = [p.strip() for p in value.split(',')]
+        items = [str(v).strip().lower() for v in (value or []) if str(v).strip()]
+        if key == 'ai_provider_order':
+            items = [v for v in items if v in _AI_PROVIDERS]
+        return list(dict.fromkeys(items))
+    v = str(value or '').strip()
+    if key in _CHOICES:
+        v = v.lower()
+        if v not in _CHOICES[key]:
+            raise ValueError(f"{key} inválido: {value}")
+    if not v:
+        raise ValueError(f"{key} vacío")
+    return v
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Lock exclusivo entre procesos sobre `path` (fcntl en Unix, msvcrt en Windows)."""
+    fh = open(path, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            fh.close()
+
+
+class SettingsStore:
+    def __init__(self, path: str, defaults: Optional[Dict[str, Any]] = None,
+                 collection=None, refresh_seconds: float = 2.0):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.defaults = dict(defaults or DEFAULT_SETTINGS)
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._write_lock = threading.Lock()
+        self._snapshot: Dict[str, Any] = dict(self.defaults)
+        self._mtime = None
+        self._version = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.reload()
+
+    # -- lectura (camino caliente) --
+    def get(self, key: str, default=None):
+        return self._snapshot.get(key, default)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self._snapshot)
+
+    # -- recarga --
+    def _read_file(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh) or {}
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️  settings.json ilegible, se mantiene la configuración anterior: {e}")
+            return dict(self._snapshot)
+
+    def _read_mongo(self):
+        if self.collection is None:
+            return None
+        try:
+            return self.collection.find_one({'_id': _VERSION_DOC_ID}) or {}
+        except Exception:
+            return None
+
+    def _merge(self, *sources) -> Dict[str, Any]:
+        merged = dict(self.defaults)
+        for src in sources:
+            for k, v in (src or {}).items():
+                if k not in self.defaults:
+                    continue
+                try:
+                    merged[k] = _coerce(k, v, self.defaults[k])
+                except (TypeError, ValueError):
+                    pass
+        return merged
+
+    def reload(self):
+        """Relee archivo y MongoDB y reemplaza el snapshot de una vez."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        doc = self._read_mongo()
+        # MongoDB (compartido entre máquinas) tiene prioridad sobre el archivo local
+        self._snapshot = self._merge(self._read_file(), (doc or {}).get('values'))
+        self._mtime = mtime
+        self._version = (doc or {}).get('version')
+
+    def _changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            return True
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': _VERSION_DOC_ID}, {'version': 1}) or {}
+                return doc.get('version') != self._version
+            except Exception:
+                return False
+        return False
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                if self._changed():
+                    self.reload()
+            except Exception as e:
+                print(f"⚠️  Error refrescando configuración: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name='settings-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # -- escritura --
+    def update(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Valida y persiste `values`; devuelve el snapshot nuevo. Lanza ValueError si hay claves o valores inválidos."""
+        clean = {}
+        for k, v in (values or {}).items():
+            if k not in self.defaults:
+                raise ValueError(f"Clave de configuración desconocida: {k}")
+            clean[k] = _coerce(k, v, self.defaults[k])
+        with self._write_lock, _file_lock(self.lock_path):
+            data = self._read_file()
+            data.update(clean)
+            tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp, 'w', encoding='utf-8') as fh:
+                    json.dump(data, fh, ensure_ascii=False, indent=2)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                os.replace(tmp, self.path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            if self.collection is not None:
+                try:
+                    self.collection.update_one(
+                        {'_id': _VERSION_DOC_ID},
+                        {'$set': {f'values.{k}': v for k, v in clean.items()}, '$inc': {'version': 1}},
+                        upsert=True,
+                    )
+                except Exception as e:
+                    print(f"⚠️  No se pudo publicar la configuración en MongoDB: {e}")
+            self.reload()
+        return self.snapshot()
+
+    def set(self, key: str, value) -> bool:
+        try:
+            self.update({key: value})
+            return True
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar {key}: {e}")
+            return False
@@ -0,0 +1,77 @@
+(function(){
+  // Listados de /api/v2/libros para selectores y listas rápidas.
+  // Se pide una página (keyset, next_cursor) y la siguiente solo cuando el
+  // usuario elige "Cargar más…": nunca se recorre el catálogo completo.
+  const PAGE_SIZE = '50';
+  const MORE = '__more__';
+
+  async function fetchPage(params, cursor){
+    const qs = new URLSearchParams(Object.assign({ limit: PAGE_SIZE }, params || {}, cursor ? { cursor } : {}));
+    const r = await fetch('/api/v2/libros?' + qs.toString());
+    if (!r.ok) throw new Error('HTTP ' + r.status);
+    const data = await r.json();
+    return { libros: data.libros || [], next: data.next_cursor || '' };
+  }
+
+  function escapeHtml(s){
+    return String(s == null ? '' : s).replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+  }
+
+  // Llena un <select> con la primera página; la opción "Cargar más…" trae la siguiente.
+  // opts: placeholder, empty, filter(libro) -> bool, selected (id a preseleccionar)
+  async function fillSelect(select, params, opts){
+    opts = opts || {};
+    let cursor = '';
+    let shown = 0;
+    const addPage = async () => {
+      const page = await fetchPage(params, cursor);
+      cursor = page.next;
+      const items = page.libros.filter(opts.filter || (() => true));
+      shown += items.length;
+      const more = select.querySelector(`option[value="${MORE}"]`);
+      if (more) more.remove();
+      select.insertAdjacentHTML('beforeend', items.map(b =>
+        `<option value="${escapeHtml(b._id)}">${escapeHtml(b.title || 'Sin título')}</option>`).join(''));
+      if (cursor) select.insertAdjacentHTML('beforeend', `<option value="${MORE}">Cargar más…</option>`);
+    };
+    select.innerHTML = `<option value="">${escapeHtml(opts.placeholder || 'Selecciona…')}</option>`;
+    await addPage();
+    if (!shown && !cursor && opts.empty){
+      select.innerHTML = `<option value="">${escapeHtml(opts.empty)}</option>`;
+      return;
+    }
+    if (opts.selected && select.querySelector(`option[value="${opts.selected}"]`)) select.value = opts.selected;
+    let previous = select.value;
+    if (select._librosMore) select.removeEventListener('change', select._librosMore);
+    select._librosMore = async () => {
+      if (select.value !== MORE){ previous = select.value; return; }
+      select.value = previous;
+      try { await addPage(); } catch(e){ /* se puede reintentar */ }
+    };
+    select.addEventListener('change', select._librosMore);
+  }
+
+  // Lista de enlaces con la primera página y un botón "Cargar más".
+  // renderItem(libro) -> html; empty: texto si no hay libros
+  async function fillList(container, params, renderItem, empty){
+    let cursor = '';
+    const addPage = async () => {
+      const page = await fetchPage(params, cursor);
+      cursor = page.next;
+      const btn = container.querySelector('.libros-more');
+      if (btn) btn.remove();
+      container.insertAdjacentHTML('beforeend', page.libros.map(renderItem).join(''));
+      if (cursor){
+        container.insertAdjacentHTML('beforeend',
+          '<button type="button" class="libros-more quick-item" style="background:none;border:0;cursor:pointer;text-align:left;width:100%;">Cargar más…</button>');
+        container.querySelector('.libros-more').addEventListener('click', () => { addPage().catch(()=>{}); });
+      }
+      return page.libros.length;
+    };
+    container.innerHTML = '';
+    const n = await addPage();
+    if (!n && !cursor && empty) container.innerHTML = `<div style="opacity:.7;padding:0.5rem 1.5rem;">${escapeHtml(empty)}</div>`;
+  }
+
+  window.Libros = { fetchPage, fillSelect, fillList, escapeHtml };
+})();
@@ -0,0 +1,103 @@
+import re
+import zlib
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from bson import Binary
+
+# Almacén de textos extraídos, separado de los libros.
+# Cada documento de la colección `texts` (clave = sha256 del texto normalizado)
+# guarda el texto completo comprimido con zlib. Los libros solo guardan
+# `text_id`, así que las consultas de biblioteca no arrastran el blob y resumen,
+# quiz, subtítulos y Braille comparten el mismo texto ya normalizado.
+
+_TRAILING_WS_RE = re.compile(r"[ \t\r\f\v]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+# Textos descomprimidos que se mantienen en memoria (por proceso)
+TEXT_LRU_SIZE = 32
+
+
+def normalize_text(text: str) -> str:
+    """NFC, saltos de línea Unix, sin espacios al final de línea y como mucho una línea en blanco seguida."""
+    t = unicodedata.normalize('NFC', text or '')
+    t = t.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    t = _TRAILING_WS_RE.sub('\n', t)
+    return _BLANK_LINES_RE.sub('\n\n', t)
+
+
+def text_id_for(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def build_text(pages: Iterable[str]) -> str:
+    """Normaliza página por página (a medida que llegan) y las concatena."""
+    return ''.join(normalize_text(page) for page in pages)
+
+
+class TextStore:
+    def __init__(self, collection, lru_size: int = TEXT_LRU_SIZE):
+        self.collection = collection
+        self._lru: "OrderedDict[str, str]" = OrderedDict()
+        self._lru_size = lru_size
+        self._lock = threading.Lock()
+
+    def _remember(self, text_id: str, text: str):
+        with self._lock:
+            self._lru[text_id] = text
+            self._lru.move_to_end(text_id)
+            while len(self._lru) > self._lru_size:
+                self._lru.popitem(last=False)
+
+    def put_pages(self, pages: Iterable[str]) -> Tuple[Optional[str], str]:
+        """Guarda (idempotente) el texto de estas páginas y devuelve (text_id, texto normalizado).
+        text_id es None si no hay base de datos o el texto está vacío."""
+        text = build_text(pages)
+        return self._put(text), text
+
+    def put(self, text: str) -> Optional[str]:
+        """Guarda un texto ya completo (TXT, DOCX o datos antiguos)."""
+        return self._put(normalize_text(text))
+
+    def _put(self, text: str) -> Optional[str]:
+        if self.collection is None or not text or not text.strip():
+            return None
+        text_id = text_id_for(text)
+        try:
+            if self.collection.count_documents({'_id': text_id}, limit=1) == 0:
+                self.collection.update_one({'_id': text_id}, {'$setOnInsert': {
+                    'z': Binary(zlib.compress(text.encode('utf-8'), 6)),
+                    'chars': len(text),
+                    'created_at': datetime.utcnow(),
+                }}, upsert=True)
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar el texto {text_id[:12]}…: {e}")
+            return None
+        self._remember(text_id, text)
+        return text_id
+
+    def get(self, text_id: Optional[str]) -> Optional[str]:
+        """Texto completo descomprimido (o None si no existe)."""
+        if not text_id:
+            return None
+        with self._lock:
+            cached = self._lru.get(text_id)
+            if cached is not None:
+                self._lru.move_to_end(text_id)
+                return cached
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({'_id': text_id}, {'z': 1})
+        except Exception as e:
+            print(f"⚠️  Error leyendo texto {text_id[:12]}…: {e}")
+            return None
+        if not doc or not doc.get('z'):
+            return None
+        text = zlib.decompress(bytes(doc['z'])).decode('utf-8')
+        self._remember(text_id, text)
+        return text
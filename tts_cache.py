@@ -0,0 +1,217 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+import uuid
+from datetime import datetime
+from typing import Callable, Optional
+
+# Caché de audio TTS direccionada por contenido.
+# Clave = sha256(texto normalizado, voz, modelo, motor). El audio vive en
+# `audio_files/tts_cache/<clave>.mp3` y el índice (tamaño, último uso) en MongoDB,
+# lo que permite desalojar por tamaño total en orden LRU. El total de bytes es un
+# contador (`bytes` en cache_stats) que se ajusta con $inc en cada alta y baja;
+# el índice `last_used_at` solo se recorre cuando el total supera `max_bytes`.
+
+
+def normalize_tts_text(text: str) -> str:
+    """Normaliza Unicode (NFC) y espacios para que ediciones triviales no cambien la clave."""
+    t = unicodedata.normalize('NFC', text or '')
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def make_cache_key(text: str, voice_id: Optional[str], model: Optional[str], engine: str) -> str:
+    h = hashlib.sha256()
+    for part in (normalize_tts_text(text), voice_id or '', model or '', engine or ''):
+        h.update(part.encode('utf-8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+class TTSCache:
+    def __init__(self, collection, folder: str, max_bytes: int, stats_collection=None):
+        self.collection = collection
+        self.stats_collection = stats_collection
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_ready = False
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.mp3")
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+        if self.stats_collection is not None:
+            try:
+                self.stats_collection.update_one({'_id': 'tts_cache'}, {'$inc': {field: 1}}, upsert=True)
+            except Exception:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Devuelve el audio cacheado (y actualiza su último uso) o None."""
+        if self.collection is None:
+            return None
+        try:
+            entry = self.collection.find_one_and_update(
+                {'_id': key},
+                {'$set': {'last_used_at': datetime.utcnow()}, '$inc': {'hits': 1}},
+            )
+        except Exception as e:
+            print(f"⚠️  Error consultando caché TTS: {e}")
+            entry = None
+        if entry:
+            try:
+                with open(self._path(key), 'rb') as fh:
+                    data = fh.read()
+                if data:
+                    self._count('hits')
+                    return data
+            except FileNotFoundError:
+                pass
+            # Entrada huérfana (archivo borrado a mano): limpiarla
+            try:
+                self._delete(key)
+            except Exception:
+                pass
+        self._count('misses')
+        return None
+
+    def put(self, key: str, audio: bytes, **meta):
+        """Guarda el audio (escritura atómica) y registra la entrada; luego desaloja si hace falta."""
+        if self.collection is None or not audio:
+            return
+        self._ensure_total()
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'wb') as fh:
+                fh.write(audio)
+            os.replace(tmp, path)
+            now = datetime.utcnow()
+            previous = self.collection.find_one_and_update({'_id': key}, {
+                '$set': {'size': len(audio), 'last_used_at': now, **meta},
+                '$setOnInsert': {'created_at': now, 'hits': 0},
+            }, projection={'size': 1}, upsert=True)
+            self._add_bytes(len(audio) - int((previous or {}).get('size') or 0))
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar en caché TTS: {e}")
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+            return
+        self.evict_if_needed()
+
+    def _recount(self) -> int:
+        """Suma exacta de `size`: recorre toda la colección, solo para (re)inicializar el contador."""
+        agg = list(self.collection.aggregate([{'$group': {'_id': None, 'bytes': {'$sum': '$size'}}}]))
+        return int(agg[0]['bytes']) if agg else 0
+
+    def _ensure_total(self) -> bool:
+        """Inicializa el contador de bytes si la caché es anterior a él. True si está listo."""
+        if self._total_ready:
+            return True
+        if self.stats_collection is None:
+            return False
+        try:
+            doc = self.stats_collection.find_one({'_id': 'tts_cache'}, {'bytes': 1})
+            if not doc or 'bytes' not in doc:
+                # Si otro proceso lo inicializa a la vez, el upsert falla por _id duplicado
+                # y el próximo intento ya encuentra el contador
+                self.stats_collection.update_one({'_id': 'tts_cache', 'bytes': {'$exists': False}},
+                                                 {'$set': {'bytes': self._recount()}}, upsert=True)
+            self._total_ready = True
+        except Exception as e:
+            print(f"⚠️  No se pudo inicializar el total de la caché TTS: {e}")
+        return self._total_ready
+
+    def _add_bytes(self, delta: int):
+        # Llamar a _ensure_total() antes de escribir: si el contador se inicializara
+        # después, el recuento ya incluiría esta entrada. Sin contador no se suma nada.
+        if delta and self._total_ready:
+            try:
+                self.stats_collection.update_one({'_id': 'tts_cache'}, {'$inc': {'bytes': delta}})
+            except Exception as e:
+                print(f"⚠️  No se pudo actualizar el total de la caché TTS: {e}")
+
+    def _delete(self, key: str) -> int:
+        """Borra la entrada y su archivo; devuelve los bytes liberados (0 si otro proceso la borró)."""
+        self._ensure_total()
+        entry = self.collection.find_one_and_delete({'_id': key}, projection={'size': 1})
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        size = int((entry or {}).get('size') or 0)
+        self._add_bytes(-size)
+        return size
+
+    def total_bytes(self) -> int:
+        try:
+            if self._ensure_total():
+                doc = self.stats_collection.find_one({'_id': 'tts_cache'}, {'bytes': 1}) or {}
+                return int(doc.get('bytes') or 0)
+            return self._recount()
+        except Exception:
+            return 0
+
+    def evict_if_needed(self):
+        """Desaloja entradas menos usadas recientemente hasta quedar bajo `max_bytes`."""
+        if self.collection is None or self.max_bytes <= 0:
+            return
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        try:
+            for entry in self.collection.find({}, {'_id': 1}).sort('last_used_at', 1):
+                if total <= self.max_bytes:
+                    break
+                total -= self._delete(entry['_id'])
+                self._count('evictions')
+            else:
+                # Se vació la caché sin bajar del límite: el contador se desvió, rehacerlo
+                if total > self.max_bytes and self._total_ready:
+                    self.stats_collection.update_one({'_id': 'tts_cache'}, {'$set': {'bytes': self._recount()}})
+        except Exception as e:
+            print(f"⚠️  Error al desalojar caché TTS: {e}")
+
+    def wrap(self, synth: Callable[[str], bytes], voice_id: Optional[str], model: Optional[str],
+             engine: str) -> Callable[[str], bytes]:
+        """Envuelve una función texto->mp3 para que consulte/llene la caché por fragmento."""
+        def cached(text: str) -> bytes:
+            key = make_cache_key(text, voice_id, model, engine)
+            hit = self.get(key)
+            if hit:
+                return hit
+            audio = synth(text)
+            self.put(key, audio, engine=engine, voice_id=voice_id, model=model, chars=len(text))
+            return audio
+        return cached
+
+    def stats(self) -> dict:
+        out = {
+            'process': {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions},
+            'max_bytes': self.max_bytes,
+        }
+        if self.collection is not None:
+            try:
+                out['entries'] = self.collection.estimated_document_count()
+                out['bytes'] = self.total_bytes()
+            except Exception:
+                pass
+        if self.stats_collection is not None:
+            try:
+                doc = self.stats_collection.find_one({'_id': 'tts_cache'}) or {}
+                out['global'] = {k: doc.get(k, 0) for k in ('hits', 'misses', 'evictions')}
+            except Exception:
+                pass
+        total = self.hits + self.misses
+        out['process']['hit_ratio'] = round(self.hits / total, 3) if total else None
+        return out
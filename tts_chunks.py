@@ -0,0 +1,155 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# Segmentación de textos largos para TTS y síntesis concurrente por fragmentos.
+# Los motores limitan el tamaño por petición (ElevenLabs por caracteres,
+# Google por bytes UTF-8), así que la medida es configurable.
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…;:])\s+")
+
+
+def utf8_len(s: str) -> int:
+    return len(s.encode('utf-8'))
+
+
+def _split_oversized(piece: str, max_len: int, measure: Callable[[str], int]) -> List[str]:
+    """Divide una oración demasiado larga por palabras (y, en último caso, por caracteres)."""
+    out = []
+    cur = ''
+    for word in piece.split():
+        cand = f"{cur} {word}" if cur else word
+        if measure(cand) <= max_len:
+            cur = cand
+            continue
+        if cur:
+            out.append(cur)
+        if measure(word) <= max_len:
+            cur = word
+        else:
+            # Palabra gigante (URLs, basura de PDF): corte duro
+            buf = ''
+            for ch in word:
+                if measure(buf + ch) > max_len:
+                    out.append(buf)
+                    buf = ''
+                buf += ch
+            cur = buf
+    if cur:
+        out.append(cur)
+    return out
+
+
+def split_text_for_tts(text: str, max_len: int = 4000, measure: Callable[[str], int] = len) -> List[str]:
+    """Divide `text` en fragmentos de tamaño <= max_len respetando párrafos y oraciones.
+    Los párrafos se agrupan mientras quepan; un párrafo largo se parte por oraciones
+    y una oración larga por palabras.
+    """
+    if not text or not text.strip():
+        return []
+    units = []
+    for para in _PARAGRAPH_RE.split(text):
+        para = re.sub(r"\s+", " ", para).strip()
+        if not para:
+            continue
+        if measure(para) <= max_len:
+            units.append((para, True))
+            continue
+        for sent in _SENTENCE_RE.split(para):
+            sent = sent.strip()
+            if not sent:
+                continue
+            if measure(sent) <= max_len:
+                units.append((sent, False))
+            else:
+                units.extend((p, False) for p in _split_oversized(sent, max_len, measure))
+
+    chunks = []
+    cur = ''
+    for piece, is_para in units:
+        sep = '\n\n' if is_para else ' '
+        cand = f"{cur}{sep}{piece}" if cur else piece
+        if measure(cand) <= max_len:
+            cur = cand
+        else:
+            if cur:
+                chunks.append(cur)
+            cur = piece
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def iter_split_text_for_tts(pieces: Iterable[str], max_len: int = 4000,
+                            measure: Callable[[str], int] = len) -> Iterator[str]:
+    """Versión incremental de split_text_for_tts para texto que llega por partes
+    (p.ej. páginas de un PDF). Un fragmento se emite en cuanto queda cerrado por un
+    salto de párrafo (u oración) posterior, sin esperar al resto del documento.
+    """
+    buf = ''
+    for piece in pieces:
+        if not piece:
+            continue
+        buf += piece
+        cut = None
+        for m in _PARAGRAPH_RE.finditer(buf):
+            cut = m
+        if cut is None:
+            for m in _SENTENCE_RE.finditer(buf):
+                cut = m
+        if cut is None or measure(buf[:cut.start()]) <= max_len:
+            continue
+        chunks = split_text_for_tts(buf[:cut.start()], max_len=max_len, measure=measure)
+        for chunk in chunks[:-1]:
+            yield chunk
+        # El último fragmento puede crecer con el texto siguiente: se vuelve a partir
+        tail = buf[cut.end():]
+        buf = f"{chunks[-1]}{cut.group(0)}{tail}" if chunks else tail
+    for chunk in split_text_for_tts(buf, max_len=max_len, measure=measure):
+        yield chunk
+
+
+class ChunkSynthesisError(Exception):
+    """Algún fragmento no pudo sintetizarse tras los reintentos."""
+
+    def __init__(self, message, failed: Dict[int, Exception]):
+        super().__init__(message)
+        self.failed = failed
+
+
+def synthesize_chunks(chunks: List[str], synth_fn: Callable[[str], bytes], max_workers: int = 4,
+                      retries: int = 2, retry_delay: float = 1.0) -> List[bytes]:
+    """Sintetiza los fragmentos en un pool acotado y devuelve el audio en orden.
+    Solo se reintentan los fragmentos que fallaron.
+    """
+    results: List[Optional[bytes]] = [None] * len(chunks)
+    pending = list(range(len(chunks)))
+    failed: Dict[int, Exception] = {}
+    attempt = 0
+    while pending:
+        failed = {}
+        workers = max(1, min(max_workers, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts-chunk') as pool:
+            futures = {i: pool.submit(synth_fn, chunks[i]) for i in pending}
+            for i, fut in futures.items():
+                try:
+                    audio = fut.result()
+                    if not audio:
+                        raise Exception('Fragmento de audio vacío')
+                    results[i] = audio
+                except Exception as e:
+                    failed[i] = e
+        if not failed:
+            break
+        attempt += 1
+        if attempt > retries:
+            raise ChunkSynthesisError(
+                f"{len(failed)} de {len(chunks)} fragmentos fallaron: {next(iter(failed.values()))}",
+                failed,
+            )
+        print(f"🔁 Reintentando {len(failed)} fragmento(s) TTS (intento {attempt}/{retries})")
+        time.sleep(retry_delay * attempt)
+        pending = sorted(failed.keys())
+    return [r or b'' for r in results]
@@ -0,0 +1,213 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Enrutador de motores TTS con ventana móvil de latencia/errores y circuit breakers.
+# Cada motor tiene subrutas (ElevenLabs: client/http/legacy/stream; Google: grpc).
+# Una subruta con demasiados errores se "abre" y deja de recibir tráfico durante
+# un enfriamiento; luego se permite una única prueba (half-open) que la cierra o
+# la vuelve a abrir con un enfriamiento mayor.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+WINDOW_SECONDS = float(os.environ.get('TTS_ROUTER_WINDOW_SECONDS', '300'))
+WINDOW_MAX_SAMPLES = int(os.environ.get('TTS_ROUTER_WINDOW_SAMPLES', '200'))
+MIN_SAMPLES = int(os.environ.get('TTS_ROUTER_MIN_SAMPLES', '5'))
+ERROR_RATE_THRESHOLD = float(os.environ.get('TTS_ROUTER_ERROR_RATE', '0.5'))
+CONSECUTIVE_FAILURES = int(os.environ.get('TTS_ROUTER_CONSECUTIVE_FAILURES', '3'))
+COOLDOWN_SECONDS = float(os.environ.get('TTS_ROUTER_COOLDOWN_SECONDS', '30'))
+MAX_COOLDOWN_SECONDS = float(os.environ.get('TTS_ROUTER_MAX_COOLDOWN_SECONDS', '600'))
+# Un motor alternativo debe ser al menos este factor más rápido para desplazar al primario
+LATENCY_MARGIN = float(os.environ.get('TTS_ROUTER_LATENCY_MARGIN', '1.5'))
+
+
+class CircuitOpenError(Exception):
+    """La subruta tiene el circuito abierto: se omite sin esperar al proveedor."""
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class PathBreaker:
+    """Estadísticas en ventana + circuit breaker de una subruta (motor, ruta)."""
+
+    def __init__(self):
+        self.samples = deque(maxlen=WINDOW_MAX_SAMPLES)  # (ts, ok, secs_per_kchar)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = COOLDOWN_SECONDS
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.last_error = None
+
+    def _trim(self, now: float):
+        while self.samples and now - self.samples[0][0] > WINDOW_SECONDS:
+            self.samples.popleft()
+
+    def allow(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record(self, now: float, ok: bool, latency: float, chars: int, error: Optional[str]):
+        self._trim(now)
+        self.samples.append((now, ok, latency * 1000.0 / max(1, chars)))
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.cooldown = COOLDOWN_SECONDS
+            self.probe_in_flight = False
+            return
+        self.last_error = error
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._open(now, backoff=True)
+            return
+        total = len(self.samples)
+        errors = sum(1 for s in self.samples if not s[1])
+        if self.consecutive_failures >= CONSECUTIVE_FAILURES or (
+                total >= MIN_SAMPLES and errors / total >= ERROR_RATE_THRESHOLD):
+            self._open(now, backoff=False)
+
+    def _open(self, now: float, backoff: bool):
+        if backoff:
+            self.cooldown = min(MAX_COOLDOWN_SECONDS, self.cooldown * 2)
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_in_flight = False
+
+    def latency_p50(self) -> Optional[float]:
+        return _percentile([s[2] for s in self.samples if s[1]], 0.5)
+
+    def snapshot(self, now: float) -> dict:
+        self._trim(now)
+        ok_lat = [s[2] for s in self.samples if s[1]]
+        total = len(self.samples)
+        errors = sum(1 for s in self.samples if not s[1])
+        return {
+            'state': self.state,
+            'samples': total,
+            'error_rate': round(errors / total, 3) if total else None,
+            'p50_s_per_kchar': _percentile(ok_lat, 0.5),
+            'p95_s_per_kchar': _percentile(ok_lat, 0.95),
+            'consecutive_failures': self.consecutive_failures,
+            'cooldown_s': self.cooldown,
+            'retry_in_s': round(max(0.0, self.opened_at + self.cooldown - now), 1) if self.state == OPEN else 0,
+            'last_error': self.last_error,
+        }
+
+
+class TTSRouter:
+    def __init__(self, paths: Dict[str, Iterable[str]]):
+        self._lock = threading.Lock()
+        self._paths = {engine: list(p) for engine, p in paths.items()}
+        self._breakers = {(engine, path): PathBreaker() for engine, p in self._paths.items() for path in p}
+        self.last = {'engine': None, 'fallback_reason': None, 'timestamp': None}
+
+    def _breaker(self, engine: str, path: str) -> PathBreaker:
+        br = self._breakers.get((engine, path))
+        if br is None:
+            br = self._breakers[(engine, path)] = PathBreaker()
+            self._paths.setdefault(engine, []).append(path)
+        return br
+
+    def allow(self, engine: str, path: str) -> bool:
+        with self._lock:
+            return self._breaker(engine, path).allow(time.time())
+
+    def release(self, engine: str, path: str):
+        """Libera una prueba half-open que terminó sin resultado (p.ej. cliente desconectado)."""
+        with self._lock:
+            self._breaker(engine, path).probe_in_flight = False
+
+    def record(self, engine: str, path: str, ok: bool, latency: float, chars: int = 1000, error=None):
+        with self._lock:
+            self._breaker(engine, path).record(time.time(), ok, latency, chars, str(error)[:300] if error else None)
+
+    def call(self, engine: str, path: str, fn: Callable[[], object], chars: int = 1000):
+        """Ejecuta `fn` a través del breaker de (engine, path) y registra su latencia.
+        Lanza CircuitOpenError sin llamar a `fn` si el circuito está abierto.
+        """
+        if not self.allow(engine, path):
+            raise CircuitOpenError(f"circuito abierto: {engine}/{path}")
+        t0 = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record(engine, path, False, time.monotonic() - t0, chars, e)
+            raise
+        self.record(engine, path, True, time.monotonic() - t0, chars)
+        return result
+
+    def _healthy(self, engine: str) -> bool:
+        # Solo cuentan las subrutas con tráfico: una ruta nunca usada (p.ej. legacy
+        # sin SDK instalado) no debe mantener "sano" a un motor caído.
+        used = [self._breakers[(engine, p)] for p in self._paths.get(engine, [])
+                if self._breakers[(engine, p)].samples or self._breakers[(engine, p)].state != CLOSED]
+        return not used or any(br.state != OPEN for br in used)
+
+    def is_healthy(self, engine: str) -> bool:
+        """Un motor está sano si alguna de sus subrutas usadas no tiene el circuito abierto."""
+        with self._lock:
+            return self._healthy(engine)
+
+    def _engine_latency(self, engine: str) -> Optional[float]:
+        lats = [self._breakers[(engine, p)].latency_p50() for p in self._paths.get(engine, [])]
+        lats = [l for l in lats if l is not None]
+        return min(lats) if lats else None
+
+    def order(self, primary: str, available: Iterable[str]) -> List[str]:
+        """Orden de motores a intentar: sanos primero (el primario salvo que otro sea
+        claramente más rápido), luego los abiertos como último recurso."""
+        engines = [e for e in available]
+        if primary in engines:
+            engines.remove(primary)
+            engines.insert(0, primary)
+        healthy = [e for e in engines if self.is_healthy(e)]
+        broken = [e for e in engines if e not in healthy]
+        with self._lock:
+            lat = {e: self._engine_latency(e) for e in healthy}
+        if len(healthy) > 1 and lat.get(healthy[0]) is not None:
+            base = lat[healthy[0]]
+            faster = [e for e in healthy[1:] if lat.get(e) is not None and lat[e] * LATENCY_MARGIN < base]
+            if faster:
+                best = min(faster, key=lambda e: lat[e])
+                healthy.remove(best)
+                healthy.insert(0, best)
+        return healthy + broken
+
+    def note_result(self, engine: Optional[str], fallback_reason: Optional[str]):
+        self.last = {'engine': engine, 'fallback_reason': fallback_reason, 'timestamp': int(time.time())}
+
+    def reset(self, engine: Optional[str] = None):
+        with self._lock:
+            for (eng, path) in list(self._breakers.keys()):
+                if engine is None or eng == engine:
+                    self._breakers[(eng, path)] = PathBreaker()
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            engines = {}
+            for engine, paths in self._paths.items():
+                engines[engine] = {
+                    'healthy': self._healthy(engine),
+                    'paths': {p: self._breakers[(engine, p)].snapshot(now) for p in paths},
+                }
+        return {'engines': engines, 'last': dict(self.last)}
@@ -0,0 +1,550 @@
+import os
+import json
+import glob
+import time
+import zlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # búsqueda semántica local desactivada
+    np = None
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt  # type: ignore
+
+from book_ids import id_variants
+from search_index import tokenize
+
+# Búsqueda semántica local (sin llamadas a la IA por consulta).
+# - Cada libro se representa con un vector TF-IDF "hasheado" (hashing trick con
+#   signo) de sus palabras y de los trigramas de caracteres de cada palabra, así
+#   que variantes como "dragón"/"dragones" comparten buena parte del vector.
+# - Los vectores (normalizados L2) viven en una matriz float32 mapeada en disco
+#   (numpy.memmap) más un mapa fila -> _id en meta.json; la consulta es un único
+#   producto matriz-vector (coseno) y un argpartition para el top-k.
+# - Los libros nuevos o editados se añaden al final (la fila vieja queda marcada
+#   como borrada). El IDF se congela entre compactaciones; la compactación
+#   reconstruye la matriz completa (IDF nuevo, sin filas borradas) cuando hay
+#   demasiadas filas borradas o añadidas desde la última.
+# - Un solo proceso escribe (lock de archivo); los demás solo leen y recargan
+#   cuando cambia meta.json. Las ediciones hechas en cualquier proceso marcan el
+#   libro con `vector_dirty_at` en `libros`; el escritor los recoge en cada ciclo.
+
+DIRTY_FIELD = 'vector_dirty_at'
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', 'vector_index')
+VECTOR_DIM = int(os.environ.get('VECTOR_DIM', '4096'))
+# Caracteres del texto completo que se vectorizan por libro (más texto llena
+# todos los buckets y el vector deja de distinguir libros)
+VECTOR_TEXT_CHARS = int(os.environ.get('VECTOR_TEXT_CHARS', '8000'))
+VECTOR_SYNC_SECONDS = float(os.environ.get('VECTOR_SYNC_SECONDS', '10'))
+# Compactar cuando las filas borradas o añadidas desde la última superan esta fracción
+VECTOR_COMPACT_RATIO = float(os.environ.get('VECTOR_COMPACT_RATIO', '0.2'))
+MIN_SCORE = 0.02
+_NGRAM_WEIGHT = 0.5
+_BATCH = 64
+
+
+def _buckets(text: str, dim: int) -> Dict[int, float]:
+    """Frecuencias con signo por bucket (palabras + trigramas de caracteres)."""
+    counts: Dict[int, float] = {}
+    for tok in tokenize(text):
+        feats = [(tok, 1.0)]
+        if len(tok) > 3:
+            padded = f'<{tok}>'
+            feats.extend((padded[i:i + 3], _NGRAM_WEIGHT) for i in range(len(padded) - 2))
+        for feat, w in feats:
+            h = zlib.crc32(feat.encode('utf-8'))
+            bucket = h % dim
+            counts[bucket] = counts.get(bucket, 0.0) + (w if h & 0x80000000 else -w)
+    return counts
+
+
+def raw_vector(text: str, dim: int):
+    """TF sublineal hasheado (sin IDF ni normalizar)."""
+    vec = np.zeros(dim, dtype=np.float32)
+    counts = _buckets(text, dim)
+    if counts:
+        idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        val = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        mag = np.abs(val)
+        # Buckets cuyos signos se cancelaron quedan en 0
+        vec[idx] = np.where(mag > 1e-6, np.sign(val) * (1.0 + np.log(np.maximum(mag, 1e-6))), 0.0)
+    return vec
+
+
+def _normalize(vec):
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+
+def book_document(doc: dict, summary: str = '', text: str = '') -> str:
+    """Texto que representa a un libro: título, topics y resumen (con peso doble)
+    más el inicio del texto."""
+    about = [doc.get('title') or '', doc.get('subtitle') or '', ' '.join(str(t) for t in doc.get('topics') or []),
+             summary or '']
+    parts = about + about + [(text or '')[:VECTOR_TEXT_CHARS]]
+    return '\n'.join(p for p in parts if p)
+
+
+class _WriterLock:
+    """Lock exclusivo no bloqueante que se mantiene mientras el proceso escribe el índice."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    @property
+    def held(self) -> bool:
+        return self._fh is not None
+
+    def acquire(self) -> bool:
+        if self._fh is not None:
+            return True
+        fh = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            fh.close()
+            return False
+        self._fh = fh
+        return True
+
+    def release(self):
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            fh.close()
+
+
+class VectorIndex:
+    """Matriz de vectores en disco + mapa de ids. No es thread-safe por sí sola."""
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, dim: int = VECTOR_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.generation = 0
+        self.ids: List[Optional[str]] = []  # fila -> _id (None si borrada)
+        self.rows: Dict[str, int] = {}
+        self.capacity = 0
+        self.appended = 0  # filas añadidas desde la última compactación
+        self.idf = None
+        self._matrix = None
+        self._alive = None
+        self._meta_mtime = None
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'vectors-{generation}.f32')
+
+    def _idf_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'idf-{generation}.npy')
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def live(self) -> int:
+        return len(self.rows)
+
+    # -- carga / guardado --
+    def load(self, writable: bool = False) -> bool:
+        """Abre el índice guardado. False si no existe o no es compatible."""
+        try:
+            mtime = os.path.getmtime(self.meta_path)
+            with open(self.meta_path, 'r', encoding='utf-8') as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if int(meta.get('dim') or 0) != self.dim:
+            print(f"⚠️  Índice vectorial con otra dimensión ({meta.get('dim')} != {self.dim}); se reconstruirá")
+            return False
+        generation = int(meta['generation'])
+        capacity = int(meta['capacity'])
+        try:
+            idf = np.load(self._idf_path(generation))
+            matrix = np.memmap(self._vectors_path(generation), dtype=np.float32,
+                               mode='r+' if writable else 'r', shape=(max(capacity, 1), self.dim))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  No se pudo abrir el índice vectorial: {e}")
+            return False
+        self.generation, self.capacity, self.idf, self._matrix = generation, capacity, idf, matrix
+        self.ids = list(meta.get('ids') or [])
+        self.appended = int(meta.get('appended') or 0)
+        self._reindex_rows()
+        self._meta_mtime = mtime
+        return True
+
+    def changed_on_disk(self) -> bool:
+        try:
+            return os.path.getmtime(self.meta_path) != self._meta_mtime
+        except OSError:
+            return False
+
+    def _reindex_rows(self):
+        self.rows = {i: r for r, i in enumerate(self.ids) if i is not None}
+        alive = np.zeros(max(self.capacity, 1), dtype=bool)
+        if self.rows:
+            alive[list(self.rows.values())] = True
+        self._alive = alive
+
+    def _save_meta(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+        meta = {'dim': self.dim, 'generation': self.generation, 'capacity': self.capacity,
+                'appended': self.appended, 'ids': self.ids, 'updated_at': time.time()}
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, self.meta_path)
+        self._meta_mtime = os.path.getmtime(self.meta_path)
+
+    # -- escritura --
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(64, self.capacity * 2, needed)
+        path = self._vectors_path(self.generation)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None  # cerrar el mapeo antes de ampliar el archivo (Windows)
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as fh:
+            fh.truncate(capacity * self.dim * 4)
+        self._matrix = np.memmap(path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        alive = np.zeros(capacity, dtype=bool)
+        if self._alive is not None:
+            alive[:len(self._alive)] = self._alive[:capacity]
+        self._alive = alive
+        self.capacity = capacity
+
+    def remove(self, book_id):
+        for v in id_variants(book_id):
+            row = self.rows.pop(str(v), None)
+            if row is not None:
+                self.ids[row] = None
+                self._alive[row] = False
+
+    def append(self, items: Iterable[Tuple[str, object]]) -> int:
+        """Añade (o reemplaza) libros a partir de su raw_vector, con el IDF actual.
+        Devuelve cuántos se añadieron."""
+        items = list(items)
+        if not items or self.idf is None:
+            return 0
+        self._grow(self.count + len(items))
+        for book_id, raw in items:
+            self.remove(book_id)
+            row = self.count
+            self._matrix[row] = _normalize(raw * self.idf)
+            self.ids.append(str(book_id))
+            self.rows[str(book_id)] = row
+            self._alive[row] = True
+        self.appended += len(items)
+        self._save_meta()
+        return len(items)
+
+    def needs_compaction(self) -> bool:
+        if self.idf is None:
+            return True
+        dead = self.count - self.live
+        base = max(self.live, 50)
+        return dead > VECTOR_COMPACT_RATIO * base or self.appended > VECTOR_COMPACT_RATIO * base
+
+    def compact(self, items: Iterable[Tuple[str, str]]):
+        """Reconstruye la matriz completa en una generación nueva (IDF recalculado)."""
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self.generation + 1
+        path = self._vectors_path(generation)
+        ids: List[str] = []
+        capacity = 64
+        matrix = np.memmap(path, dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        df = np.zeros(self.dim, dtype=np.float64)
+        for book_id, text in items:
+            if len(ids) == capacity:
+                matrix.flush()
+                del matrix
+                capacity *= 2
+                with open(path, 'r+b') as fh:
+                    fh.truncate(capacity * self.dim * 4)
+                matrix = np.memmap(path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+            vec = raw_vector(text, self.dim)
+            matrix[len(ids)] = vec
+            df += vec != 0
+            ids.append(str(book_id))
+        n = len(ids)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        for start in range(0, n, _BATCH):
+            block = matrix[start:start + _BATCH] * idf
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix[start:start + _BATCH] = block / norms
+        matrix.flush()
+        np.save(self._idf_path(generation), idf)
+        old = self.generation
+        self.generation, self.capacity, self.idf, self._matrix = generation, capacity, idf, matrix
+        self.ids, self.appended = ids, 0
+        self._reindex_rows()
+        self._save_meta()
+        self._cleanup()
+
+    def _cleanup(self):
+        """Borra archivos de generaciones anteriores (en Windows puede fallar si un
+        lector los tiene abiertos; se reintenta en la próxima compactación)."""
+        keep = {self._vectors_path(self.generation), self._idf_path(self.generation)}
+        for pattern in ('vectors-*.f32', 'idf-*.npy'):
+            for path in glob.glob(os.path.join(self.directory, pattern)):
+                if path not in keep:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    # -- consulta --
+    def search(self, query: str, k: int = 30, min_score: float = MIN_SCORE) -> List[Tuple[str, float]]:
+        n = self.count
+        if not n or self.idf is None or not query:
+            return []
+        q = _normalize(raw_vector(query, self.dim) * self.idf)
+        if not q.any():
+            return []
+        scores = np.asarray(self._matrix[:n] @ q)
+        scores[~self._alive[:n]] = -1.0
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if scores[i] >= min_score]
+
+
+class LiveVectorIndex:
+    """VectorIndex sincronizado con `libros` en segundo plano: añade libros nuevos
+    o editados, marca los borrados y compacta cuando hace falta."""
+
+    def __init__(self, books, details=None, texts=None, directory: str = VECTOR_INDEX_DIR,
+                 version_fn: Optional[Callable[[], object]] = None, sync_seconds: float = VECTOR_SYNC_SECONDS):
+        self.books = books
+        self.details = details
+        self.texts = texts
+        self.directory = directory
+        self.version_fn = version_fn
+        self.sync_seconds = sync_seconds
+        self.available = np is not None and books is not None
+        self.index = VectorIndex(directory) if np is not None else None
+        self._lock = threading.RLock()
+        self._writer = _WriterLock(os.path.join(directory, 'writer.lock'))
+        self._pending: Dict[str, None] = {}
+        self._dirty_cutoff: Optional[datetime] = None
+        self._version = None
+        self._compact_requested = False
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self.stats = {'appended': 0, 'removed': 0, 'compactions': 0, 'last_compaction_ms': None}
+
+    # -- origen de los documentos --
+    def _documents(self, query: dict) -> Iterable[Tuple[str, str]]:
+        """(_id, texto a vectorizar) de los libros de `query`, en lotes."""
+        projection = {'title': 1, 'subtitle': 1, 'topics': 1, 'text_id': 1, 'text': 1, 'summary': 1}
+        batch = []
+        for doc in self.books.find(query, projection):
+            batch.append(doc)
+            if len(batch) >= _BATCH:
+                yield from self._batch_documents(batch)
+                batch = []
+        if batch:
+            yield from self._batch_documents(batch)
+
+    def _batch_documents(self, docs: List[dict]) -> Iterable[Tuple[str, str]]:
+        summaries = {}
+        if self.details is not None:
+            for d in self.details.find({'_id': {'$in': [doc['_id'] for doc in docs]}}, {'summary': 1}):
+                summaries[d['_id']] = d.get('summary') or ''
+        for doc in docs:
+            summary = summaries.get(doc['_id']) or doc.get('summary') or ''
+            text = (self.texts.get(doc.get('text_id')) if self.texts is not None else None) or doc.get('text') or ''
+            yield str(doc['_id']), book_document(doc, summary, text)
+
+    # -- API --
+    def touch(self, book_id):
+        """Marca un libro para (re)vectorizar en el próximo ciclo (alta, edición o borrado).
+        La marca queda en `libros` para que la vea el proceso escritor, sea cual sea."""
+        if not self.available or book_id is None:
+            return
+        try:
+            self.books.update_many({'_id': {'$in': id_variants(book_id)}},
+                                   {'$set': {DIRTY_FIELD: datetime.utcnow()}})
+        except Exception as e:
+            print(f"⚠️  No se pudo marcar {book_id} para revectorizar: {e}")
+        if self._writer.held:
+            with self._lock:
+                self._pending[str(book_id)] = None
+        self._wake.set()
+
+    def request_compaction(self):
+        self._compact_requested = True
+        self._wake.set()
+
+    def search(self, query: str, k: int = 30) -> List[Tuple[str, float]]:
+        if not self.available:
+            return []
+        with self._lock:
+            try:
+                return self.index.search(query, k)
+            except Exception as e:
+                print(f"⚠️  Error en búsqueda vectorial: {e}")
+                return []
+
+    def snapshot(self) -> Dict:
+        if not self.available:
+            return {'available': False}
+        with self._lock:
+            idx = self.index
+            return dict(self.stats, available=True, writer=self._writer.held, rows=idx.count, books=idx.live,
+                        dim=idx.dim, generation=idx.generation, pending=len(self._pending),
+                        needs_compaction=idx.needs_compaction())
+
+    # -- ciclo de fondo --
+    def _clear_dirty(self, cutoff: Optional[datetime], ids: Optional[List] = None):
+        """Quita la marca de los libros ya vectorizados (no las puestas después de `cutoff`)."""
+        if cutoff is None:
+            return
+        query = {DIRTY_FIELD: {'$lte': cutoff}}
+        if ids is not None:
+            query['_id'] = {'$in': ids}
+        try:
+            self.books.update_many(query, {'$unset': {DIRTY_FIELD: ''}})
+        except Exception as e:
+            print(f"⚠️  No se pudo limpiar {DIRTY_FIELD}: {e}")
+
+    def _collect_dirty(self):
+        """Libros marcados por touch() en cualquier proceso -> pendientes."""
+        cutoff = datetime.utcnow()
+        dirty = [str(d['_id']) for d in self.books.find({DIRTY_FIELD: {'$lte': cutoff}}, {'_id': 1})]
+        with self._lock:
+            for i in dirty:
+                self._pending[i] = None
+        self._dirty_cutoff = cutoff
+
+    def _compact(self):
+        t0 = time.time()
+        cutoff = datetime.utcnow()
+        fresh = VectorIndex(self.directory, self.index.dim)
+        fresh.generation = self.index.generation
+        fresh.compact(self._documents({}))
+        with self._lock:
+            self.index = fresh
+            self._pending.clear()
+        self._clear_dirty(cutoff)
+        ms = round((time.time() - t0) * 1000)
+        self.stats['compactions'] += 1
+        self.stats['last_compaction_ms'] = ms
+        self._compact_requested = False
+        print(f"🧭 Índice vectorial compactado: {fresh.live} libros en {ms} ms")
+
+    def _sync_catalog(self):
+        """Libros nuevos -> pendientes; libros que ya no existen -> borrados."""
+        current = {str(d['_id']) for d in self.books.find({}, {'_id': 1})}
+        with self._lock:
+            known = set(self.index.rows)
+            for gone in known - current:
+                self.index.remove(gone)
+                self.stats['removed'] += 1
+            for new in current - known:
+                self._pending[new] = None
+            if known - current:
+                self.index._save_meta()
+
+    def _apply_pending(self):
+        with self._lock:
+            ids, self._pending = list(self._pending), {}
+        if not ids:
+            return
+        for start in range(0, len(ids), _BATCH):
+            chunk = ids[start:start + _BATCH]
+            variants = [v for i in chunk for v in id_variants(i)]
+            # Vectorizar fuera del lock: las búsquedas no esperan
+            items = [(i, raw_vector(text, self.index.dim)) for i, text in self._documents({'_id': {'$in': variants}})]
+            found = {i for i, _v in items}
+            with self._lock:
+                try:
+                    for missing in set(chunk) - found:
+                        if missing in self.index.rows:
+                            self.index.remove(missing)
+                            self.stats['removed'] += 1
+                    self.stats['appended'] += self.index.append(items)
+                    if set(chunk) - found:
+                        self.index._save_meta()
+                except Exception:
+                    # No perder los ids: se reintentan en el próximo ciclo
+                    for i in ids[start:]:
+                        self._pending[i] = None
+                    raise
+            self._clear_dirty(self._dirty_cutoff, variants)
+
+    def _cycle(self):
+        was_writer = self._writer.held
+        if not self._writer.acquire():
+            # Otro proceso escribe: solo recargar si cambió en disco
+            if self.index.changed_on_disk():
+                with self._lock:
+                    fresh = VectorIndex(self.directory, self.index.dim)
+                    if fresh.load():
+                        self.index = fresh
+            return
+        if not was_writer or self.index.idf is None or self.index.changed_on_disk():
+            # Recién promovido a escritor: el mapeo abierto como lector es de solo lectura
+            with self._lock:
+                fresh = VectorIndex(self.directory, self.index.dim)
+                if fresh.load(writable=True):
+                    self.index = fresh
+                elif self.index.idf is not None:
+                    self._compact_requested = True
+        version = self.version_fn() if self.version_fn else None
+        if self.index.idf is None or self._compact_requested:
+            self._compact()
+            self._version = version
+            return
+        if version != self._version:
+            self._sync_catalog()
+            self._version = version
+        self._collect_dirty()
+        self._apply_pending()
+        if self.index.needs_compaction():
+            self._compact()
+
+    def _loop(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while not self._stop.is_set():
+            try:
+                self._cycle()
+            except Exception as e:
+                print(f"⚠️  Error sincronizando el índice vectorial: {e}")
+            self._wake.wait(self.sync_seconds)
+            self._wake.clear()
+        self._writer.release()
+
+    def start(self):
+        if not self.available:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='vector-index-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
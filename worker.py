@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Worker de conversiones en segundo plano.
+
+Toma trabajos de la colección `jobs` (encolados por POST /api/jobs/convert)
+y ejecuta el mismo pipeline que /upload: extracción, TTS, guardado de audio,
+duración, portada y alta en biblioteca.
+
+También procesa los trabajos 'enrich' (resumen, análisis, moderación,
+accesibilidad, notas, quiz y subtítulos de un libro ya guardado) que el
+proceso web no llegó a tomar.
+
+Uso:
+  python worker.py                 # un worker
+  python worker.py --poll 0.5      # intervalo de sondeo en segundos
+
+Para escalar el throughput de TTS basta con lanzar más procesos worker.
+"""
+import argparse
+import sys
+
+from jobs import run_worker, default_worker_id, DEFAULT_LEASE_SECONDS
+
+
+def main():
+    p = argparse.ArgumentParser(description="Worker de trabajos de conversión (MongoDB)")
+    p.add_argument('--poll', type=float, default=1.0, help='Segundos entre sondeos cuando la cola está vacía')
+    p.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help='Duración del lease de cada trabajo (segundos)')
+    p.add_argument('--worker-id', default=None, help='Identificador del worker (por defecto host:pid)')
+    args = p.parse_args()
+
+    # Importar la app carga configuración, conexión a MongoDB y motores TTS
+    import app as sinsay_app
+
+    if sinsay_app.jobs_collection is None:
+        print('ERROR: no hay conexión a MongoDB; el worker no puede iniciar', file=sys.stderr)
+        sys.exit(2)
+    # El worker no atiende /api/search: no mantener los índices de búsqueda
+    sinsay_app.SEARCH_INDEX.stop()
+    sinsay_app.VECTORS.stop()
+
+    handlers = {
+        'convert': sinsay_app.handle_convert_job,
+        # Trabajos de streaming que ningún navegador reclamó a tiempo
+        'stream': sinsay_app.handle_convert_job,
+        'enrich': sinsay_app.handle_enrich_job,
+    }
+    try:
+        run_worker(
+            sinsay_app.jobs_collection,
+            handlers,
+            worker_id=args.worker_id or default_worker_id(),
+            poll_interval=args.poll,
+            lease_seconds=args.lease,
+        )
+    except KeyboardInterrupt:
+        print('👋 Worker detenido')
+
+
+if __name__ == '__main__':
+    main()
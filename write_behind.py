@@ -0,0 +1,217 @@
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Buffer write-behind para eventos de reproducción.
+# Las peticiones solo encolan en memoria: los eventos se agrupan por
+# (usuario, libro) —el último estado gana, los contadores se suman— y un hilo de
+# fondo los escribe cada `flush_seconds` o en cuanto se acumulan `max_events`:
+#   - el estado de escucha (posición, progreso…) en `listening_state`, un
+#     documento por (user_id, book_id), con un bulk_write;
+#   - los contadores agregados ($inc) en el documento del libro, otro bulk_write.
+# Al apagar el proceso se vacía el buffer (stop()).
+# Si MongoDB falla, las entradas vuelven al buffer y se reintentan en el próximo
+# vaciado: con un BulkWriteError solo las de las operaciones que fallaron (las
+# demás ya se aplicaron y reintentarlas duplicaría los $inc); con un error de
+# conexión, todas.
+
+PLAYBACK_FLUSH_SECONDS = float(os.environ.get('PLAYBACK_FLUSH_SECONDS', '5'))
+PLAYBACK_FLUSH_EVENTS = int(os.environ.get('PLAYBACK_FLUSH_EVENTS', '500'))
+# Tope de entradas pendientes si MongoDB no responde (las más viejas se descartan)
+PLAYBACK_MAX_PENDING = int(os.environ.get('PLAYBACK_MAX_PENDING', '50000'))
+
+
+class _Entry:
+    __slots__ = ('set', 'inc', 'at', 'events')
+
+    def __init__(self):
+        self.set: Dict = {}
+        self.inc: Dict = {}
+        self.at: Optional[datetime] = None
+        self.events = 0
+
+    def merge(self, other: '_Entry'):
+        """Combina `other` (más reciente) sobre esta entrada."""
+        if self.at is None or (other.at and other.at >= self.at):
+            self.set.update(other.set)
+            self.at = other.at
+        else:
+            self.set = dict(other.set, **self.set)
+        for k, v in other.inc.items():
+            self.inc[k] = self.inc.get(k, 0) + v
+        self.events += other.events
+
+
+class PlaybackBuffer:
+    def __init__(self, collection, id_filter: Callable[[str], dict], state_collection=None,
+                 flush_seconds: float = PLAYBACK_FLUSH_SECONDS, max_events: int = PLAYBACK_FLUSH_EVENTS,
+                 max_pending: int = PLAYBACK_MAX_PENDING):
+        self.collection = collection
+        self.state_collection = state_collection
+        self.id_filter = id_filter
+        self.flush_seconds = flush_seconds
+        self.max_events = max(1, max_events)
+        self.max_pending = max_pending
+        self._pending: Dict[Tuple[str, str], _Entry] = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'events': 0, 'flushes': 0, 'ops': 0, 'errors': 0, 'dropped': 0}
+
+    # -- encolar (camino de la petición) --
+    def add(self, user_id, book_id, set_fields: Optional[Dict] = None, inc: Optional[Dict] = None,
+            at: Optional[datetime] = None):
+        """`set_fields`: estado de escucha del usuario; `inc`: contadores del libro."""
+        entry = _Entry()
+        entry.set = dict(set_fields or {})
+        entry.inc = {k: v for k, v in (inc or {}).items() if v}
+        entry.at = at or datetime.utcnow()
+        entry.events = 1
+        key = (str(user_id or ''), str(book_id))
+        with self._lock:
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = entry
+            else:
+                current.merge(entry)
+            self._events += 1
+            self.stats['events'] += 1
+            full = self._events >= self.max_events
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    # -- vaciado --
+    # Cada builder devuelve [(claves de las entradas que cubre, operación)]
+    def _state_ops(self, entries: Dict[Tuple[str, str], _Entry]) -> List[Tuple[List, UpdateOne]]:
+        """Un upsert por (usuario, libro) con el estado más reciente."""
+        ops = []
+        for key, e in entries.items():
+            user_id, book_id = key
+            if not user_id or not e.set:
+                continue
+            ops.append(([key], UpdateOne(
+                {'user_id': user_id, 'book_id': book_id},
+                {'$set': e.set, '$setOnInsert': {'first_played_at': e.at}, '$inc': {'events': e.events}},
+                upsert=True,
+            )))
+        return ops
+
+    def _book_ops(self, entries: Dict[Tuple[str, str], _Entry]) -> List[Tuple[List, UpdateOne]]:
+        """Una operación por libro con la suma de los contadores de todos los oyentes."""
+        per_book: Dict[str, Dict] = {}
+        keys: Dict[str, List] = {}
+        for key, e in entries.items():
+            if not e.inc:
+                continue
+            book_id = key[1]
+            inc = per_book.setdefault(book_id, {})
+            for k, v in e.inc.items():
+                inc[k] = inc.get(k, 0) + v
+            keys.setdefault(book_id, []).append(key)
+        return [(keys[book_id], UpdateOne(self.id_filter(book_id), {'$inc': inc}))
+                for book_id, inc in per_book.items() if inc]
+
+    def flush(self) -> int:
+        """Escribe lo pendiente (un bulk_write por colección). Devuelve el número de operaciones."""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, {}
+                self._events = 0
+            if not entries:
+                return 0
+            written = 0
+            failed = {}
+            targets = (
+                (self.state_collection, self._state_ops, 'estado de escucha'),
+                (self.collection, self._book_ops, 'contadores de libros'),
+            )
+            for collection, build, label in targets:
+                if collection is None:
+                    continue
+                ops = build(entries)
+                if not ops:
+                    continue
+                try:
+                    collection.bulk_write([op for _keys, op in ops], ordered=False)
+                    written += len(ops)
+                    continue
+                except BulkWriteError as e:
+                    # Sin orden, las operaciones sin error ya se aplicaron
+                    bad = {err['index'] for err in (e.details or {}).get('writeErrors', [])}
+                    written += len(ops) - len(bad)
+                    print(f"⚠️  Fallaron {len(bad)} de {len(ops)} operaciones de {label} (se reintentarán): {e}")
+                except Exception as e:
+                    bad = set(range(len(ops)))
+                    print(f"⚠️  No se pudieron guardar {len(ops)} operaciones de {label} (se reintentará): {e}")
+                self.stats['errors'] += 1
+                # Reintentar solo la parte que falló
+                for i in bad:
+                    for key in ops[i][0]:
+                        entry = entries[key]
+                        retry = failed.setdefault(key, _Entry())
+                        retry.at = entry.at
+                        if build is self._state_ops:
+                            # `events` va con el estado: solo se reintenta si falló el estado
+                            retry.set, retry.events = entry.set, entry.events
+                        else:
+                            retry.inc = entry.inc
+            if failed:
+                self._requeue(failed)
+            if written:
+                self.stats['flushes'] += 1
+                self.stats['ops'] += written
+            return written
+
+    def _requeue(self, entries: Dict[Tuple[str, str], _Entry]):
+        with self._lock:
+            for key, e in entries.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = e
+                else:
+                    # Lo que llegó mientras tanto es más reciente
+                    e.merge(current)
+                    self._pending[key] = e
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                oldest = sorted(self._pending, key=lambda k: self._pending[k].at or datetime.min)[:overflow]
+                for k in oldest:
+                    del self._pending[k]
+                self.stats['dropped'] += overflow
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Error vaciando eventos de reproducción: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='playback-write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Detiene el hilo y vacía lo pendiente (llamar al apagar)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def snapshot(self) -> Dict:
+        return dict(self.stats, pending=self.pending(), flush_seconds=self.flush_seconds,
+                    max_events=self.max_events)